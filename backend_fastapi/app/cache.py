@@ -0,0 +1,568 @@
+"""Caché de respuestas (analytics / dashboards) con backend intercambiable.
+
+- Backends: `memory` (LRU en proceso) y `sqlite` (archivo local compartido por
+  todos los workers de uvicorn de la misma máquina).
+- Límite por número de entradas y por bytes (tamaño serializado) con desalojo LRU;
+  los expirados se purgan al escribir, no solo al leer.
+- Single-flight: ante una clave fría, un solo hilo calcula y los demás esperan
+  su resultado en lugar de lanzar N consultas iguales (`aget_or_compute`: lo
+  mismo entre corrutinas de rutas async, sin bloquear el event loop; con
+  `sqlite` las llamadas al backend desde rutas async corren en un hilo).
+- Contadores de hits / misses / desalojos / coalescidos para /api/v1/analytics/cache.
+- Versiones de datos por alcance (`all`, `ficha:<id>`, `materia:<id>`): las rutas
+  de escritura llaman `bump_data_version(...)` tras el commit y las claves incluyen
+  `data_version_tag(...)`, de modo que una carga invalida solo lo que toca y las
+  entradas versionadas pueden vivir mucho más (ANALYTICS_CACHE_VERSIONED_TTL,
+  1h por defecto solo con backend compartido). Con `memory` las versiones son
+  del proceso: los demás workers no ven el bump, así que el TTL versionado por
+  defecto es el corto; fijarlo más alto con `memory` requiere un solo worker.
+
+Configuración (env): ANALYTICS_CACHE_BACKEND, ANALYTICS_CACHE_TTL,
+ANALYTICS_CACHE_VERSIONED_TTL, ANALYTICS_CACHE_MAX_ENTRIES,
+ANALYTICS_CACHE_MAX_BYTES, ANALYTICS_CACHE_SQLITE_PATH.
+"""
+import os
+import time
+import asyncio
+import pickle
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class CacheBackend:
+    """Interfaz mínima de almacenamiento. `set` retorna cuántas entradas desalojó."""
+
+    name = "base"
+    shared = False  # True si todos los workers ven las mismas entradas y versiones
+    blocking = False  # True si hace E/S: desde rutas async se llama con asyncio.to_thread
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: int) -> int:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def info(self) -> Dict[str, Any]:
+        return {}
+
+    # Versiones de datos: fuera del LRU (desalojar una versión reviviría entradas viejas)
+    def get_versions(self, scopes: List[str]) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def bump_versions(self, scopes: List[str]) -> None:
+        raise NotImplementedError
+
+
+def _new_version() -> int:
+    # Una versión ausente (proceso nuevo, archivo borrado) nunca coincide con una anterior
+    return time.time_ns()
+
+
+def _sizeof(value: Any) -> Tuple[bytes, int]:
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return blob, len(blob)
+
+
+class MemoryBackend(CacheBackend):
+    """LRU en proceso (OrderedDict) acotado por entradas y bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            value, expires, size = entry
+            if expires < now:
+                self._drop(key)
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def _drop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def set(self, key: str, value: Any, ttl: int) -> int:
+        _, size = _sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return 0  # no cachear respuestas más grandes que todo el presupuesto
+        now = time.time()
+        evicted = 0
+        with self._lock:
+            self._drop(key)
+            self._data[key] = (value, now + ttl, size)
+            self._bytes += size
+            # Primero expirados, luego LRU
+            if self._over():
+                for k in [k for k, (_, exp, _s) in self._data.items() if exp < now]:
+                    self._drop(k)
+            while self._over() and len(self._data) > 1:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                evicted += 1
+        return evicted
+
+    def _over(self) -> bool:
+        return (self.max_entries and len(self._data) > self.max_entries) or (
+            self.max_bytes and self._bytes > self.max_bytes
+        )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes,
+                    "maxEntries": self.max_entries, "maxBytes": self.max_bytes,
+                    "versions": len(self._versions)}
+
+    def get_versions(self, scopes: List[str]) -> Dict[str, int]:
+        with self._lock:
+            return {s: self._versions.setdefault(s, _new_version()) for s in scopes}
+
+    def bump_versions(self, scopes: List[str]) -> None:
+        with self._lock:
+            for s in scopes:
+                self._versions[s] = max(self._versions.get(s, 0) + 1, _new_version())
+
+
+class SQLiteBackend(CacheBackend):
+    """Almacén compartido entre procesos en un archivo SQLite local (WAL)."""
+
+    name = "sqlite"
+    shared = True
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "expires REAL NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache (last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires, last_access FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        blob, expires, last_access = row
+        if expires < now:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires < ?", (key, now))
+            return False, None
+        if now - last_access > 1.0:  # evitar una escritura por cada lectura
+            conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        try:
+            return True, pickle.loads(blob)
+        except Exception:
+            return False, None
+
+    def set(self, key: str, value: Any, ttl: int) -> int:
+        blob, size = _sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return 0
+        now = time.time()
+        conn = self._conn()
+        evicted = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, size, last_access) VALUES (?,?,?,?,?)",
+                (key, sqlite3.Binary(blob), now + ttl, size, now),
+            )
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            if (self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes):
+                conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+                count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+                while count > 1 and ((self.max_entries and count > self.max_entries) or (self.max_bytes and total > self.max_bytes)):
+                    k, s = conn.execute(
+                        "SELECT key, size FROM cache WHERE key <> ? ORDER BY last_access LIMIT 1", (key,)
+                    ).fetchone()
+                    conn.execute("DELETE FROM cache WHERE key = ?", (k,))
+                    count -= 1
+                    total -= s
+                    evicted += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM cache")
+
+    def info(self) -> Dict[str, Any]:
+        count, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        versions = self._conn().execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+        return {"entries": count, "bytes": total, "maxEntries": self.max_entries,
+                "maxBytes": self.max_bytes, "path": self.path, "versions": versions}
+
+    def get_versions(self, scopes: List[str]) -> Dict[str, int]:
+        conn = self._conn()
+        marks = ",".join("?" for _ in scopes)
+        found = dict(conn.execute(f"SELECT scope, version FROM versions WHERE scope IN ({marks})", scopes).fetchall())
+        missing = [s for s in scopes if s not in found]
+        if missing:
+            seed = _new_version()
+            conn.executemany("INSERT OR IGNORE INTO versions (scope, version) VALUES (?, ?)", [(s, seed) for s in missing])
+            found.update(conn.execute(f"SELECT scope, version FROM versions WHERE scope IN ({marks})", scopes).fetchall())
+        return found
+
+    def bump_versions(self, scopes: List[str]) -> None:
+        seed = _new_version()
+        self._conn().executemany(
+            "INSERT INTO versions (scope, version) VALUES (?, ?) "
+            "ON CONFLICT(scope) DO UPDATE SET version = MAX(version + 1, excluded.version)",
+            [(s, seed) for s in scopes],
+        )
+
+
+class _Flight:
+    __slots__ = ("event",)
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class Cache:
+    """Fachada con TTL por defecto, single-flight y contadores."""
+
+    def __init__(self, name: str, backend: CacheBackend, ttl: int, versioned_ttl: Optional[int] = None):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        # TTL de las claves que incluyen versión de datos: la invalidación la hacen las escrituras
+        self.versioned_ttl = versioned_ttl if versioned_ttl is not None else ttl
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: Dict[str, asyncio.Event] = {}  # solo se usan desde el event loop
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "coalesced": 0, "errors": 0, "bumps": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        try:
+            found, value = self.backend.get(key)
+        except Exception:
+            self._count("errors")
+            return None
+        self._count("hits" if found else "misses")
+        return value if found else None
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Llamada al backend desde una ruta async: en un hilo si hace E/S (sqlite)."""
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() sin bloquear el event loop."""
+        if not self.enabled:
+            return None
+        try:
+            found, value = await self._call(self.backend.get, key)
+        except Exception:
+            self._count("errors")
+            return None
+        self._count("hits" if found else "misses")
+        return value if found else None
+
+    def _counted_set(self, evicted: int) -> None:
+        with self._lock:
+            self._stats["sets"] += 1
+            self._stats["evictions"] += evicted
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        try:
+            evicted = self.backend.set(key, value, ttl if ttl is not None else self.ttl)
+        except Exception:
+            self._count("errors")
+            return
+        self._counted_set(evicted)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """set() sin bloquear el event loop."""
+        if not self.enabled:
+            return
+        try:
+            evicted = await self._call(self.backend.set, key, value, ttl if ttl is not None else self.ttl)
+        except Exception:
+            self._count("errors")
+            return
+        self._counted_set(evicted)
+
+    def delete(self, key: str) -> None:
+        try:
+            self.backend.delete(key)
+        except Exception:
+            self._count("errors")
+
+    async def adelete(self, key: str) -> None:
+        """delete() sin bloquear el event loop."""
+        try:
+            await self._call(self.backend.delete, key)
+        except Exception:
+            self._count("errors")
+
+    def clear(self) -> None:
+        try:
+            self.backend.clear()
+        except Exception:
+            self._count("errors")
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[int] = None,
+                       wait_timeout: float = 30.0) -> Any:
+        """Retorna el valor cacheado o lo calcula una sola vez por clave (por proceso)."""
+        if not self.enabled:
+            return compute()
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count("coalesced")
+            flight.event.wait(wait_timeout)
+            try:
+                found, value = self.backend.get(key)
+            except Exception:
+                found = False
+            if found:
+                return value
+            # El líder falló o no cacheó: calcular de forma independiente
+            return compute()
+        try:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None,
+                              wait_timeout: float = 30.0) -> Any:
+        """get_or_compute() con `compute` async; quien espera cede el event loop."""
+        if not self.enabled:
+            return await compute()
+        value = await self.aget(key)
+        if value is not None:
+            return value
+        flight = self._aflights.get(key)
+        if flight is not None:
+            self._count("coalesced")
+            try:
+                await asyncio.wait_for(flight.wait(), wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                found, value = await self._call(self.backend.get, key)
+            except Exception:
+                found = False
+            if found:
+                return value
+            return await compute()
+        flight = self._aflights[key] = asyncio.Event()
+        try:
+            value = await compute()
+            if value is not None:
+                await self.aset(key, value, ttl)
+            return value
+        finally:
+            self._aflights.pop(key, None)
+            flight.set()
+
+    def version_tag(self, scopes: List[str]) -> str:
+        """Etiqueta para la clave a partir de las versiones actuales de `scopes`."""
+        try:
+            versions = self.backend.get_versions(scopes)
+        except Exception:
+            self._count("errors")
+            return f"nv{_new_version()}"  # sin versiones: clave irrepetible (no cachea de facto)
+        return "v" + ".".join(str(versions.get(s, 0)) for s in scopes)
+
+    async def aversion_tag(self, scopes: List[str]) -> str:
+        """version_tag() sin bloquear el event loop."""
+        try:
+            versions = await self._call(self.backend.get_versions, scopes)
+        except Exception:
+            self._count("errors")
+            return f"nv{_new_version()}"
+        return "v" + ".".join(str(versions.get(s, 0)) for s in scopes)
+
+    def bump(self, scopes: List[str]) -> None:
+        if not scopes:
+            return
+        try:
+            self.backend.bump_versions(scopes)
+        except Exception:
+            self._count("errors")
+            return
+        self._count("bumps")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        lookups = s["hits"] + s["misses"]
+        s["hitRate"] = round(s["hits"] / lookups, 4) if lookups else None
+        s["inFlight"] = len(self._flights) + len(self._aflights)
+        s["backend"] = self.backend.name
+        s["ttl"] = self.ttl
+        s["versionedTtl"] = self.versioned_ttl
+        try:
+            s.update(self.backend.info())
+        except Exception:
+            pass
+        return s
+
+
+def build_cache(name: str, prefix: str = "ANALYTICS_CACHE") -> Cache:
+    ttl = _env_int(f"{prefix}_TTL", 60)
+    max_entries = _env_int(f"{prefix}_MAX_ENTRIES", 1000)
+    max_bytes = _env_int(f"{prefix}_MAX_BYTES", 64 * 1024 * 1024)
+    backend_name = os.getenv(f"{prefix}_BACKEND", "memory").strip().lower()
+    backend: CacheBackend
+    if backend_name == "sqlite":
+        path = os.getenv(f"{prefix}_SQLITE_PATH") or os.path.join(tempfile.gettempdir(), f"sena_{name}_cache.sqlite3")
+        try:
+            backend = SQLiteBackend(path, max_entries, max_bytes)
+        except Exception:
+            # Archivo no accesible: degradar a memoria en lugar de impedir el arranque
+            backend = MemoryBackend(max_entries, max_bytes)
+    else:
+        backend = MemoryBackend(max_entries, max_bytes)
+    # En memoria un bump no llega a los otros workers: por defecto, mismo TTL corto
+    versioned_ttl = _env_int(f"{prefix}_VERSIONED_TTL", 3600 if backend.shared else ttl)
+    return Cache(name, backend, ttl, versioned_ttl)
+
+
+analytics_cache = build_cache("analytics")
+
+IdOrIds = Union[None, int, Iterable[Any]]
+
+
+def _ids(value: IdOrIds) -> Optional[List[int]]:
+    """None = alcance desconocido; int o iterable = ids concretos (ignora no numéricos)."""
+    if value is None:
+        return None
+    items = [value] if isinstance(value, (int, str)) else list(value)
+    out: List[int] = []
+    for v in items:
+        try:
+            out.append(int(v))
+        except (TypeError, ValueError):
+            continue
+    return sorted(set(out))
+
+
+def bump_data_version(fichas: IdOrIds = None, materias: IdOrIds = None, everything: bool = False) -> None:
+    """Invalida las respuestas cacheadas afectadas por una escritura ya confirmada.
+
+    Siempre sube `all` (vistas sin filtro). Por dimensión: los ids dados suben
+    `ficha:<id>` / `materia:<id>`; None (no se sabe qué se tocó) sube el comodín
+    `ficha:*` / `materia:*`, que invalida todas las vistas filtradas por esa
+    dimensión. `everything` sube `*` (invalida todo).
+    """
+    scopes = ["all"]
+    if everything:
+        scopes.append("*")
+    for dim, value in (("ficha", fichas), ("materia", materias)):
+        ids = _ids(value)
+        if ids is None:
+            scopes.append(f"{dim}:*")
+        else:
+            scopes.extend(f"{dim}:{i}" for i in ids)
+    analytics_cache.bump(scopes)
+
+
+def _version_scopes(ficha: Any = None, materia: Any = None) -> List[str]:
+    scopes = ["*"]
+    f_ids = _ids(ficha) if ficha is not None else None
+    m_ids = _ids(materia) if materia is not None else None
+    if not f_ids and not m_ids:
+        scopes.append("all")
+    if f_ids:
+        scopes += ["ficha:*"] + [f"ficha:{i}" for i in f_ids]
+    if m_ids:
+        scopes += ["materia:*"] + [f"materia:{i}" for i in m_ids]
+    return scopes
+
+
+def data_version_tag(ficha: Any = None, materia: Any = None) -> str:
+    """Etiqueta de versión para una vista filtrada por ficha y/o materia (ids).
+
+    Un filtro que no es un id (p. ej. número de ficha o código de materia) debe
+    pasarse como None: la vista queda atada a `all`, que toda escritura sube.
+    """
+    return analytics_cache.version_tag(_version_scopes(ficha, materia))
+
+
+async def adata_version_tag(ficha: Any = None, materia: Any = None) -> str:
+    """data_version_tag() para rutas async (sin bloquear el event loop)."""
+    return await analytics_cache.aversion_tag(_version_scopes(ficha, materia))
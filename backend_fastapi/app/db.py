@@ -1,10 +1,18 @@
 import os
-from contextlib import contextmanager
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
 import psycopg
 try:  # Python 3.9 compatibility: avoid PEP604 at annotation time if import issues
-    from psycopg_pool import ConnectionPool
+    from psycopg_pool import AsyncConnectionPool, ConnectionPool
 except ImportError:  # Fallback: provide a clear error later when first used
+    AsyncConnectionPool = None  # type: ignore
     ConnectionPool = None  # type: ignore
+from .utils.pool_metrics import pool_metrics
+from .utils.prepared import configure_connection, connection_kwargs
+
+logger = logging.getLogger("app.db")
 
 
 def _env(name: str, default: str = "") -> str:
@@ -28,35 +36,211 @@ def build_dsn() -> str:
     )
 
 
+def _pool_dsn() -> str:
+    cfg = get_db_settings()
+    return f"postgresql://{cfg['user']}:{cfg['password']}@{cfg['host']}:{cfg['port']}/{cfg['name']}"
+
+
+# Estado de conexión por pool para /health (sin consultar la base en cada probe):
+# `ok` = última conexión nueva establecida, `failed` = último reconnect_failed.
+_estado = {"sync": {"ok": None, "failed": None}, "async": {"ok": None, "failed": None}}
+
+
+def _configure_sync(conn) -> None:
+    configure_connection(conn)
+    _estado["sync"]["ok"] = time.time()
+
+
+async def _configure_async(conn) -> None:
+    configure_connection(conn)
+    _estado["async"]["ok"] = time.time()
+
+
+def _reconnect_failed(name: str):
+    def callback(pool) -> None:
+        _estado[name]["failed"] = time.time()
+        logger.warning("Pool %s: no se pudo reconectar en %ss; se sigue reintentando", name, pool.reconnect_timeout)
+    return callback
+
+
+def _pool_options(name: str, check) -> dict:
+    # check: valida la conexión al entregarla (una conexión rota tras un failover se
+    # descarta y se reemplaza); reconnect_timeout: ventana de reintentos con backoff
+    # exponencial de psycopg_pool antes de llamar reconnect_failed.
+    return {
+        "kwargs": connection_kwargs(),  # prepare_threshold (utils/prepared.py)
+        "timeout": int(os.getenv("DB_CONNECTION_TIMEOUT", "5")),
+        "max_idle": int(os.getenv("DB_IDLE_TIMEOUT", "30")),
+        "reconnect_timeout": float(os.getenv("DB_RECONNECT_TIMEOUT", "300")),
+        "reconnect_failed": _reconnect_failed(name),
+        "check": check,
+        "name": name,
+        "open": False,
+    }
+
+
 # Global connection pool (lazy init) - avoid PEP 604 (|) for Python 3.9 runtime quirks
 _pool = None  # type: ignore[assignment]
 
 
 def get_pool():  # -> ConnectionPool
+    """Pool sync; el lifespan de la app lo abre al arrancar (scripts: se abre al primer uso)."""
     global _pool
     if _pool is None:
-        cfg = get_db_settings()
-        dsn = (
-            f"postgresql://{cfg['user']}:{cfg['password']}@{cfg['host']}:{cfg['port']}/{cfg['name']}"
-        )
         # Pool params roughly mirror Node pool config defaults
         if ConnectionPool is None:
             raise RuntimeError("psycopg_pool not installed. Please install psycopg-pool==3.2.2")
-        _pool = ConnectionPool(
-            dsn,
+        pool = ConnectionPool(
+            _pool_dsn(),
             min_size=int(os.getenv("DB_POOL_MIN", "2")),
             max_size=int(os.getenv("DB_POOL_MAX", "10")),
-            timeout=int(os.getenv("DB_CONNECTION_TIMEOUT", "5")),
-            max_idle=int(os.getenv("DB_IDLE_TIMEOUT", "30")),
+            configure=_configure_sync,
+            **_pool_options("sync", ConnectionPool.check_connection),
         )
+        pool.open()
+        _pool = pool
     return _pool
 
 
+# Pool async para las rutas `async def` (analytics, dashboards, notificaciones): la
+# concurrencia de esas rutas la limita DB_ASYNC_POOL_MAX y no el threadpool de Starlette.
+# Las conexiones de ambos pools suman frente a max_connections de Postgres.
+_apool = None  # type: ignore[assignment]
+_apool_lock = None  # asyncio.Lock, se crea dentro del event loop
+
+
+async def get_apool():  # -> AsyncConnectionPool
+    global _apool, _apool_lock
+    if _apool is not None:
+        return _apool
+    if AsyncConnectionPool is None:
+        raise RuntimeError("psycopg_pool not installed. Please install psycopg-pool==3.2.2")
+    if _apool_lock is None:
+        _apool_lock = asyncio.Lock()
+    async with _apool_lock:
+        if _apool is None:
+            pool = AsyncConnectionPool(
+                _pool_dsn(),
+                min_size=int(os.getenv("DB_ASYNC_POOL_MIN", "1")),
+                max_size=int(os.getenv("DB_ASYNC_POOL_MAX", os.getenv("DB_POOL_MAX", "10"))),
+                configure=_configure_async,
+                **_pool_options("async", AsyncConnectionPool.check_connection),
+            )
+            await pool.open()
+            _apool = pool
+    return _apool
+
+
 @contextmanager
 def get_conn():
     pool = get_pool()
-    with pool.connection() as conn:  # psycopg connection from pool
-        yield conn
+    started = time.perf_counter()
+    acquired = None
+    try:
+        with pool.connection() as conn:  # psycopg connection from pool
+            acquired = time.perf_counter()
+            pool_metrics.record_wait("sync", acquired - started)
+            yield conn
+    except Exception:
+        if acquired is None:  # PoolTimeout / error al conectar (no errores de la ruta)
+            pool_metrics.record_error("sync")
+        raise
+    finally:
+        if acquired is not None:
+            pool_metrics.record_hold("sync", time.perf_counter() - acquired)
+
+
+@asynccontextmanager
+async def get_aconn():
+    """Equivalente async de get_conn(): `async with get_aconn() as conn`."""
+    pool = await get_apool()
+    started = time.perf_counter()
+    acquired = None
+    try:
+        async with pool.connection() as conn:  # psycopg AsyncConnection from pool
+            acquired = time.perf_counter()
+            pool_metrics.record_wait("async", acquired - started)
+            yield conn
+    except Exception:
+        if acquired is None:
+            pool_metrics.record_error("async")
+        raise
+    finally:
+        if acquired is not None:
+            pool_metrics.record_hold("async", time.perf_counter() - acquired)
+
+
+def pool_stats(reset: bool = False):
+    """get_stats() de los pools ya creados (None si aún no se usaron); `reset` usa pop_stats()."""
+    out = {}
+    for name, pool in (("sync", _pool), ("async", _apool)):
+        if pool is None:
+            out[name] = None
+            continue
+        stats = pool.pop_stats() if reset else pool.get_stats()
+        stats["connections_in_use"] = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+        out[name] = stats
+    return out
+
+
+async def close_apool() -> None:
+    global _apool
+    if _apool is not None:
+        pool, _apool = _apool, None
+        await pool.close()
+
+
+async def open_pools() -> None:
+    """Arranque: abre ambos pools y espera sus min_size conexiones (DB_POOL_OPEN_TIMEOUT).
+
+    Si la base no responde la app arranca igual: los pools siguen reintentando y
+    /health/ready responde 503 hasta que haya conexiones.
+    """
+    global _pool, _apool
+    timeout = float(os.getenv("DB_POOL_OPEN_TIMEOUT", "10"))
+    # wait() cierra el pool si vence: se reemplaza por uno abierto que sigue conectando
+    try:
+        await asyncio.to_thread(get_pool().wait, timeout)
+    except Exception as e:
+        logger.warning("Pool sync sin conexiones al arrancar: %s", e)
+        _pool = None
+        get_pool()
+    try:
+        await (await get_apool()).wait(timeout)
+    except Exception as e:
+        logger.warning("Pool async sin conexiones al arrancar: %s", e)
+        _apool = None
+        await get_apool()
+
+
+async def close_pools() -> None:
+    global _pool
+    await close_apool()
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await asyncio.to_thread(pool.close)
+
+
+def pool_health():
+    """Disponibilidad de los pools a partir de su estado (sin consulta a la base)."""
+    out = {}
+    for name, pool in (("sync", _pool), ("async", _apool)):
+        if pool is None or pool.closed:
+            out[name] = {"ready": False, "open": False}
+            continue
+        stats = pool.get_stats()
+        ok, failed = _estado[name]["ok"], _estado[name]["failed"]
+        out[name] = {
+            "ready": stats.get("pool_size", 0) > 0 and ok is not None and (failed is None or ok > failed),
+            "open": True,
+            "size": stats.get("pool_size", 0),
+            "available": stats.get("pool_available", 0),
+            "waiting": stats.get("requests_waiting", 0),
+            "lastConnect": ok,
+            "lastReconnectFailure": failed,
+        }
+    out["ready"] = all(v["ready"] for v in out.values())
+    return out
 
 
 def db_health():
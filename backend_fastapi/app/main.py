@@ -1,4 +1,6 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,6 +16,25 @@ APP_ENV = os.getenv("APP_ENV", "development")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
 APP_NAME = os.getenv("APP_NAME", "Sistema de Gestión Académica API (FastAPI)")
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Abrir los pools al arrancar: las primeras requests no pagan conexión + auth
+    from .db import open_pools, close_pools
+    from .services.upload_jobs import shutdown
+    from .utils.audit import audit_sink
+    await open_pools()
+    audit_sink.start()
+    try:
+        yield
+    finally:
+        # Liberar pools de la cola de cargas (los trabajos en curso no se esperan)
+        shutdown(wait=False)
+        # Escribir la auditoría pendiente antes de cerrar el pool que usa
+        await asyncio.to_thread(audit_sink.close)
+        await close_pools()
+
+
 app = FastAPI(
     title=APP_NAME,
     version=API_VERSION,
@@ -21,6 +42,7 @@ app = FastAPI(
     redoc_url="/redoc",
     openapi_url="/openapi.json",
     swagger_ui_parameters={"persistAuthorization": True},
+    lifespan=lifespan,
 )
 
 # CORS
@@ -32,6 +54,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Atribución de checkouts del pool a la ruta (ver /api/v1/db/pool)
+from .utils.pool_metrics import PoolRouteMiddleware  # noqa: E402
+app.add_middleware(PoolRouteMiddleware)
+
 # Routers
 from .routers.health import router as health_router  # noqa: E402
 from .routers.auth import router as auth_router  # noqa: E402
@@ -51,6 +77,7 @@ from .routers.evidencias_definiciones import router as evidencias_definiciones_r
 from .routers.analytics import router as analytics_router  # noqa: E402
 from .routers.notifications import router as notifications_router  # noqa: E402
 from .routers.maintenance_emails import router as maintenance_emails_router  # noqa: E402
+from .routers.uploads import router as uploads_router  # noqa: E402
 
 app.include_router(health_router)
 # Routers already include their versioned prefixes; include as-is to avoid duplicating paths
@@ -71,6 +98,7 @@ app.include_router(evidencias_definiciones_router)
 app.include_router(analytics_router)
 app.include_router(notifications_router)
 app.include_router(maintenance_emails_router)
+app.include_router(uploads_router)
 
 
 # Root info
@@ -86,3 +114,4 @@ def root_info():
         },
         "environment": APP_ENV,
     }
+
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from psycopg.rows import dict_row
 from ..db import get_conn
+from ..utils.prepared import execute_hot
 from ..security import (
     create_access_token,
     create_refresh_token,
@@ -28,7 +29,8 @@ class TokenPair(BaseModel):
 def login(payload: LoginRequest):
     # Busca usuario y valida password_hash con bcrypt
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(
+        execute_hot(
+            cur, "auth.login",
             "SELECT id, email, nombre, apellido, rol, activo, password_hash FROM users WHERE email = %s",
             [payload.email],
         )
@@ -72,7 +74,8 @@ def login(payload: LoginRequest):
 @router.get("/me")
 def me(claims: dict = Depends(get_current_user_claims)):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(
+        execute_hot(
+            cur, "auth.me",
             "SELECT id, email, nombre, apellido, rol, activo, avatar_url, telefono FROM users WHERE id = %s",
             [int(claims["sub"])],
         )
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, HTTPException, Query, Depends, UploadFile, File
-from typing import Optional, List, Tuple
-from math import ceil
+from fastapi import APIRouter, HTTPException, Query, Depends, UploadFile, File, Response
+from typing import Callable, Optional, List, Tuple
+from functools import partial
 from psycopg.rows import dict_row
 from ..db import get_conn
 from ..security import get_current_user_claims
 from ..utils.audit import record_event
+from ..cache import bump_data_version
+from ..services.upload_jobs import submit_job, accepted_payload
+from ..services.calificaciones_ingest import STAGING_TABLE, create_calificaciones_staging, append_staging, merge
+from ..utils.excel_stream import iter_excel_batches, ExcelTooLarge, spool_to_tempfile, remove_quietly
+from ..utils.bulk import analyze_staging
+from ..utils.export_stream import open_export, export_response, FORMAT_PATTERN
+from ..utils.pagination import Keyset, count_total, pagination_meta, resolve_total_mode, TOTAL_PATTERN
+from ..utils.search import relevance_order, search_filter, search_info, trgm_disponible, trgm_indexado
+from ..utils.prepared import execute_hot
 from pydantic import BaseModel, Field
 from fastapi.responses import StreamingResponse
 import io
+import os
 import pandas as pd
 import datetime
 
@@ -56,6 +66,14 @@ def _derive_letra(nota) -> Optional[str]:
     return "A" if v >= 3.0 else "F"
 
 # -------------------- List --------------------
+_KEYSET = Keyset("calificaciones", [
+    ("estudiante_nombre", "estudiante_nombre", "text"),
+    ("trimestre", "trimestre", "int"),
+    ("id", "id", "int"),
+])
+_SEARCH_COLUMNS = ["estudiante_documento", "estudiante_nombre"]
+
+
 @router.get("")
 def list_calificaciones(
     page: int = Query(1, ge=1),
@@ -65,15 +83,22 @@ def list_calificaciones(
     fichaId: Optional[int] = Query(None),
     trimestre: Optional[int] = Query(None, ge=1, le=4),
     estado: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío = primera página; luego nextCursor"),
+    total: Optional[str] = Query(None, pattern=TOTAL_PATTERN),
+    orden: Optional[str] = Query(None, pattern="^relevancia$", description="Con search: ordenar por similitud (pg_trgm)"),
 ):
+    if orden and cursor is not None:
+        raise HTTPException(status_code=400, detail="orden=relevancia no admite cursor; usar page/pageSize")
     offset = (page - 1) * pageSize
+    after = _KEYSET.decode(cursor)
+    total_mode = resolve_total_mode(total, cursor)
     filters: List[str] = []
     params: List = []
 
-    if search:
-        filters.append("(estudiante_documento ILIKE %s OR estudiante_nombre ILIKE %s)")
-        like = f"%{search}%"
-        params.extend([like, like])
+    if search and search.strip():
+        search_sql, search_params = search_filter(_SEARCH_COLUMNS, search)
+        filters.append(search_sql)
+        params.extend(search_params)
     if materiaId is not None:
         filters.append("materia_id = %s")
         params.append(materiaId)
@@ -88,22 +113,31 @@ def list_calificaciones(
         params.append(estado)
 
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
+    seek_sql, seek_params = _KEYSET.seek(after)
+    items_filters = filters + ([seek_sql] if seek_sql else [])
+    items_where = f"WHERE {' AND '.join(items_filters)}" if items_filters else ""
 
-    items_sql = f"""
-        SELECT {_cols()}
-        FROM calificaciones
-        {where_clause}
-        ORDER BY estudiante_nombre, trimestre
-        LIMIT %s OFFSET %s
-    """
-    count_sql = f"SELECT COUNT(*) AS total FROM calificaciones {where_clause}"
+    page_params = [pageSize + 1] if cursor is not None else [pageSize, offset]
 
+    next_cursor = None
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(count_sql, params)
-        total_row = cur.fetchone()
-        total = int(total_row["total"]) if total_row else 0
-        cur.execute(items_sql, [*params, pageSize, offset])
+        trgm = trgm_disponible(cur) if search else False
+        indexado = trgm and trgm_indexado(cur, "calificaciones", _SEARCH_COLUMNS)
+        ranked = bool(orden and trgm and search and search.strip())
+        rank_sql, rank_params = relevance_order(_SEARCH_COLUMNS, search) if ranked else ("", [])
+        items_sql = f"""
+            SELECT {_cols()}
+            FROM calificaciones
+            {items_where}
+            ORDER BY {rank_sql + ", " if rank_sql else ""}{_KEYSET.order_by()}
+            LIMIT %s {"" if cursor is not None else "OFFSET %s"}
+        """
+        total_count, exact = count_total(cur, "calificaciones", where_clause, params, total_mode, "calificaciones")
+        # SQL dinámico (filtros, búsqueda, cursor): sin prepare explícito, no ocupa el LRU de las calientes
+        cur.execute(items_sql, [*params, *seek_params, *rank_params, *page_params])
         items = cur.fetchall() or []
+    if cursor is not None:
+        items, next_cursor = _KEYSET.page(items, pageSize)
 
     # Añadir letra derivada
     for r in items:
@@ -111,12 +145,8 @@ def list_calificaciones(
     return {
         "success": True,
         "data": items,
-        "pagination": {
-            "page": page,
-            "pageSize": pageSize,
-            "total": total,
-            "totalPages": ceil(total / pageSize) if pageSize else 0,
-        },
+        "pagination": pagination_meta(page, pageSize, total_count, total_mode, exact, next_cursor, cursor is not None),
+        "search": search_info(search, indexado, ranked),
     }
 
 
@@ -124,7 +154,7 @@ def list_calificaciones(
 @router.get("/{calificacion_id}")
 def get_calificacion(calificacion_id: int):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(f"SELECT {_cols()} FROM calificaciones WHERE id = %s", [calificacion_id])
+        execute_hot(cur, "calificaciones.get", f"SELECT {_cols()} FROM calificaciones WHERE id = %s", [calificacion_id])
         row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Calificación no encontrada")
@@ -171,8 +201,7 @@ def create_calificacion(payload: CalificacionCreate, claims: dict = Depends(get_
         row = cur.fetchone()
         # Audit
         try:
-            record_event(conn,
-                         accion="crear_calificacion",
+            record_event(accion="crear_calificacion",
                          user_id=user_id,
                          user_email=user_email,
                          user_rol=user_rol,
@@ -182,6 +211,7 @@ def create_calificacion(payload: CalificacionCreate, claims: dict = Depends(get_
                          detalles={"materia_id": payload.materia_id, "ficha_id": payload.ficha_id, "trimestre": payload.trimestre})
         except Exception:
             pass
+    bump_data_version(fichas=payload.ficha_id, materias=payload.materia_id)
     return {"success": True, "data": row}
 
 
@@ -235,9 +265,13 @@ def update_calificacion(calificacion_id: int, payload: CalificacionUpdate, _: di
     if not row:
         raise HTTPException(status_code=404, detail="Calificación no encontrada")
     row["letra"] = _derive_letra(row.get("nota"))
+    # Si cambió ficha/materia también quedó desactualizado el alcance anterior (desconocido)
+    bump_data_version(
+        fichas=None if payload.ficha_id is not None else row.get("ficha_id"),
+        materias=None if payload.materia_id is not None else row.get("materia_id"),
+    )
     try:
-        record_event(conn,
-                     accion="actualizar_calificacion",
+        record_event(accion="actualizar_calificacion",
                      entidad_tipo="calificacion",
                      entidad_id=str(calificacion_id),
                      modulo="calificaciones",
@@ -251,14 +285,14 @@ def update_calificacion(calificacion_id: int, payload: CalificacionUpdate, _: di
 @router.delete("/{calificacion_id}")
 def delete_calificacion(calificacion_id: int, _: dict = Depends(get_current_user_claims)):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("DELETE FROM calificaciones WHERE id = %s RETURNING id", [calificacion_id])
+        cur.execute("DELETE FROM calificaciones WHERE id = %s RETURNING id, ficha_id, materia_id", [calificacion_id])
         row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Calificación no encontrada")
+    bump_data_version(fichas=row.pop("ficha_id"), materias=row.pop("materia_id"))
     row["letra"] = _derive_letra(row.get("nota"))
     try:
-        record_event(conn,
-                     accion="eliminar_calificacion",
+        record_event(accion="eliminar_calificacion",
                      entidad_tipo="calificacion",
                      entidad_id=str(calificacion_id),
                      modulo="calificaciones")
@@ -271,7 +305,8 @@ def delete_calificacion(calificacion_id: int, _: dict = Depends(get_current_user
 @router.get("/materia/{materia_id}")
 def calificaciones_por_materia(materia_id: int):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(
+        execute_hot(
+            cur, "calificaciones.por_materia",
             f"SELECT {_cols()} FROM calificaciones WHERE materia_id = %s ORDER BY estudiante_nombre, trimestre",
             [materia_id],
         )
@@ -284,7 +319,8 @@ def calificaciones_por_materia(materia_id: int):
 @router.get("/estudiante/{documento}")
 def calificaciones_por_estudiante(documento: str):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(
+        execute_hot(
+            cur, "calificaciones.por_estudiante",
             f"SELECT {_cols()} FROM calificaciones WHERE estudiante_documento = %s ORDER BY trimestre",
             [documento],
         )
@@ -314,31 +350,7 @@ def _validate_df(df: pd.DataFrame) -> Tuple[List[str], List[str]]:
     return missing, unexpected
 
 
-@router.post("/upload")
-def upload_calificaciones(
-    file: UploadFile = File(...),
-    claims: dict = Depends(get_current_user_claims),
-    dryRun: bool = Query(False, description="Si true no escribe en DB, solo muestra validaciones"),
-):
-    if not file.filename.lower().endswith((".xlsx", ".xls")):
-        raise HTTPException(status_code=400, detail="Formato no soportado, use .xlsx/.xls")
-    content = file.file.read()
-    try:
-        df = pd.read_excel(io.BytesIO(content))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
-    if df.empty:
-        raise HTTPException(status_code=400, detail="El archivo está vacío")
-    df.columns = [c.strip() for c in df.columns]
-    missing, unexpected = _validate_df(df)
-    if missing:
-        raise HTTPException(status_code=400, detail="Columnas faltantes: " + ", ".join(missing))
-    df.rename(columns={c: c.lower() for c in df.columns}, inplace=True)
-    df["estudiante_nombre"] = df["estudiante_nombre"].astype(str).str.strip()
-    df["estudiante_documento"] = df["estudiante_documento"].astype(str).str.strip()
-    if "nota" not in df.columns and "letra" in df.columns:
-        df["nota"] = df["letra"]
-
+def _validate_rows(df: pd.DataFrame) -> List[str]:
     # Validaciones de rango / letras
     validation_errors: List[str] = []
     for idx, row in df.iterrows():
@@ -359,30 +371,86 @@ def upload_calificaciones(
                         validation_errors.append(f"Fila {idx+2}: nota inválida (usar A/F o número 0-5)")
         except Exception as e:
             validation_errors.append(f"Fila {idx+2}: error validando - {e}")
-    if validation_errors and dryRun:
-        return {
-            "success": False,
-            "dryRun": True,
-            "errors": validation_errors[:50],
-            "unexpected_columns": unexpected,
-        }
-    if validation_errors:
-        raise HTTPException(status_code=400, detail="; ".join(validation_errors[:25]))
+    return validation_errors
+
+
+def parse_calificaciones(source, filename: str) -> dict:
+    """Lectura de encabezados (sin BD) del Excel de calificaciones. Serializable para el pool de procesos.
+
+    `source` es una ruta o un archivo abierto; las columnas se validan sobre el primer
+    lote y las filas se leen después, lote a lote, en _iter_calificaciones.
+    """
+    if not filename.lower().endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="Formato no soportado, use .xlsx/.xls")
+    batches = iter_excel_batches(source, filename)
+    try:
+        first = next(batches, None)
+    except ExcelTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
+    finally:
+        batches.close()
+    if first is None or first.empty:
+        raise HTTPException(status_code=400, detail="El archivo está vacío")
+    stripped = [c.strip() for c in first.columns]
+    first.columns = stripped
+    missing, unexpected = _validate_df(first)
+    if missing:
+        raise HTTPException(status_code=400, detail="Columnas faltantes: " + ", ".join(missing))
+    rename_map = {c: c.lower() for c in stripped}
+    keep = [rename_map[c] for c in stripped if c not in unexpected]
+    return {
+        "source": source,
+        "filename": filename,
+        "stripped": stripped,
+        "rename_map": rename_map,
+        "keep": keep,
+        "unexpected": unexpected,
+    }
 
-    # Prefetch mapping códigos/números -> id
+
+def _prepare(df: pd.DataFrame, parsed: dict) -> pd.DataFrame:
+    """Solo columnas reconocidas, nombres en minúscula y `nota` desde `letra` si falta."""
+    df.columns = parsed["stripped"]
+    df = df.rename(columns=parsed["rename_map"])[parsed["keep"]].copy()
+    df["estudiante_nombre"] = df["estudiante_nombre"].astype(str).str.strip()
+    df["estudiante_documento"] = df["estudiante_documento"].astype(str).str.strip()
+    if "nota" not in df.columns and "letra" in df.columns:
+        df["nota"] = df["letra"]
+    return df
+
+
+def _iter_calificaciones(parsed: dict):
+    """Lotes del archivo ya normalizados: (df, errores de validación) por lote."""
+    try:
+        for batch in iter_excel_batches(parsed["source"], parsed["filename"]):
+            df = _prepare(batch, parsed)
+            yield df, _validate_rows(df)
+    except ExcelTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
+
+
+def _id_maps(cur) -> Tuple[dict, dict]:
+    """Mapeos código de materia / número de ficha (en minúscula) -> id."""
     materia_map: dict[str,int] = {}
     ficha_map: dict[str,int] = {}
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("SELECT id, codigo FROM materias")
-        for r in cur.fetchall() or []:
-            if r.get("codigo"):
-                materia_map[str(r["codigo"]).strip().lower()] = r["id"]
-        cur.execute("SELECT id, numero FROM fichas")
-        for r in cur.fetchall() or []:
-            if r.get("numero"):
-                ficha_map[str(r["numero"]).strip().lower()] = r["id"]
-
-    resolution_errors: List[str] = []
+    cur.execute("SELECT id, codigo FROM materias")
+    for r in cur.fetchall() or []:
+        if r.get("codigo"):
+            materia_map[str(r["codigo"]).strip().lower()] = r["id"]
+    cur.execute("SELECT id, numero FROM fichas")
+    for r in cur.fetchall() or []:
+        if r.get("numero"):
+            ficha_map[str(r["numero"]).strip().lower()] = r["id"]
+    return materia_map, ficha_map
+
+
+def _resolve_rows(df: pd.DataFrame, materia_map: dict, ficha_map: dict, resolution_errors: List[str]) -> list:
     resolved_rows = []  # (materia_id, ficha_id, row)
     for idx, row in df.iterrows():
         try:
@@ -407,97 +475,127 @@ def upload_calificaciones(
             resolved_rows.append((materia_id, ficha_id, row))
         except Exception as e:
             resolution_errors.append(f"Fila {idx+2}: error resolviendo IDs - {e}")
+    return resolved_rows
+
+
+@router.post("/upload")
+def upload_calificaciones(
+    response: Response,
+    file: UploadFile = File(...),
+    claims: dict = Depends(get_current_user_claims),
+    dryRun: bool = Query(False, description="Si true no escribe en DB, solo muestra validaciones"),
+    background: bool = Query(False, description="Si true encola la carga y retorna un id de trabajo (ver /api/v1/uploads/{id})"),
+):
+    if background:
+        if not file.filename.lower().endswith((".xlsx", ".xls")):
+            raise HTTPException(status_code=400, detail="Formato no soportado, use .xlsx/.xls")
+        path = spool_to_tempfile(file.file, suffix=os.path.splitext(file.filename)[1].lower())
+        job = submit_job(
+            "calificaciones",
+            claims,
+            partial(_apply_calificaciones, claims=claims, dryRun=dryRun, filename=file.filename),
+            parse_fn=parse_calificaciones,
+            parse_args=(path, file.filename),
+            cleanup=partial(remove_quietly, path),
+            filename=file.filename,
+            parametros={"dryRun": dryRun},
+        )
+        response.status_code = 202
+        return accepted_payload(job)
+    parsed = parse_calificaciones(file.file, file.filename)
+    return _apply_calificaciones(parsed, None, claims=claims, dryRun=dryRun, filename=file.filename)
+
+
+def _apply_calificaciones(
+    parsed: dict,
+    progress: Optional[Callable[..., None]] = None,
+    claims: Optional[dict] = None,
+    dryRun: bool = False,
+    filename: Optional[str] = None,
+):
+    unexpected = parsed["unexpected"]
+    progress = progress or (lambda *a, **k: None)
+    # Las filas se procesan lote a lote: en memoria quedan solo contadores y errores
+    validation_errors: List[str] = []
+    resolution_errors: List[str] = []
 
     if dryRun:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            materia_map, ficha_map = _id_maps(cur)
+        rows_total = 0
+        resolvable = 0
+        for df, errs in _iter_calificaciones(parsed):
+            validation_errors.extend(errs)
+            rows_total += len(df)
+            if not validation_errors:
+                resolvable += len(_resolve_rows(df, materia_map, ficha_map, resolution_errors))
+        if validation_errors:
+            return {
+                "success": False,
+                "dryRun": True,
+                "errors": validation_errors[:50],
+                "unexpected_columns": unexpected,
+            }
         return {
             "success": True,
             "dryRun": True,
-            "rows_total": len(df),
-            "resolvable": len(resolved_rows),
+            "rows_total": rows_total,
+            "resolvable": resolvable,
             "resolution_errors": resolution_errors[:50],
             "unexpected_columns": unexpected,
         }
 
-    if not resolved_rows:
-        raise HTTPException(status_code=400, detail="No se pudo resolver ninguna fila: " + "; ".join(resolution_errors[:25]))
-
     user_id = int(claims.get("sub")) if claims and claims.get("sub") else None
     processed = 0
-    inserted = 0
-    updated = 0
+    fichas: set = set()
+    materias: set = set()
     now = datetime.date.today()
 
-    upsert_sql = (
-        "INSERT INTO calificaciones (" 
-        "materia_id, ficha_id, estudiante_nombre, estudiante_documento, trimestre, nota, estado, observaciones, cargado_por, fecha_carga) "
-        "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) "
-        "ON CONFLICT (materia_id, estudiante_documento, trimestre) DO UPDATE SET "
-        "ficha_id = EXCLUDED.ficha_id, "
-        "estudiante_nombre = EXCLUDED.estudiante_nombre, "
-        "nota = EXCLUDED.nota, "
-        "estado = EXCLUDED.estado, "
-        "observaciones = EXCLUDED.observaciones, "
-        "cargado_por = EXCLUDED.cargado_por, "
-        "fecha_carga = EXCLUDED.fecha_carga, "
-        "updated_at = CURRENT_TIMESTAMP "
-        "RETURNING (xmax = 0) AS inserted"
-    )
-
+    # Cada lote se valida, se resuelve y se copia a staging al llegar; al final un
+    # único upsert (services/calificaciones_ingest.py). Las claves repetidas en el
+    # archivo cuentan como actualizaciones, igual que fila a fila.
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
         try:
-            for materia_id, ficha_id, r in resolved_rows:
-                processed += 1
-                raw = str(r.get("nota") or "").strip().upper()
-                nota_val = None
-                estado_val = r.get("estado") or "Cursando"
-                if raw in ("A","F"):
-                    nota_val = 5.0 if raw == "A" else 2.0
-                    estado_val = "Aprobado" if raw == "A" else "Reprobado"
-                elif raw:
-                    try:
-                        fval = float(raw)
-                        nota_val = fval
-                        if fval >= 3.0:
-                            estado_val = "Aprobado"
-                        else:
-                            estado_val = "Reprobado"
-                    except Exception:
-                        # dejar nota_val None y estado cursando
-                        estado_val = "Cursando"
-                cur.execute(
-                    upsert_sql,
-                    [
-                        materia_id,
-                        ficha_id,
-                        r["estudiante_nombre"],
-                        r["estudiante_documento"],
-                        int(r["trimestre"]),
-                        nota_val,
-                        estado_val,
-                        r.get("observaciones"),
-                        user_id,
-                        now,
-                    ],
-                )
-                row_ret = cur.fetchone()
-                if row_ret and row_ret.get("inserted"):
-                    inserted += 1
-                else:
-                    updated += 1
+            materia_map, ficha_map = _id_maps(cur)
+            create_calificaciones_staging(cur)
+            for df, errs in _iter_calificaciones(parsed):
+                validation_errors.extend(errs)
+                if validation_errors:
+                    # Nada se escribirá: se sigue leyendo solo para reportar los errores
+                    continue
+                antes = len(resolution_errors)
+                resolved_rows = _resolve_rows(df, materia_map, ficha_map, resolution_errors)
+                progress("resolucion", 10, resolution_errors[antes:])
+                if resolved_rows:
+                    processed += append_staging(cur, resolved_rows, seq_start=processed)
+                    materias.update(m for m, _, _ in resolved_rows)
+                    fichas.update(f for _, f, _ in resolved_rows)
+            if validation_errors:
+                raise HTTPException(status_code=400, detail="; ".join(validation_errors[:25]))
+            if not processed:
+                raise HTTPException(status_code=400, detail="No se pudo resolver ninguna fila: " + "; ".join(resolution_errors[:25]))
+            analyze_staging(cur, STAGING_TABLE)
+            progress("escritura", 60)
+            result = merge(cur, user_id, now)
             conn.commit()
+        except HTTPException:
+            conn.rollback()
+            raise
         except Exception as e:
             conn.rollback()
             raise HTTPException(status_code=400, detail=f"Error procesando batch: {e}")
+    inserted = result["inserted"]
+    updated = processed - inserted
+    bump_data_version(fichas=fichas, materias=materias)
 
     # Audit global del batch
     try:
-        record_event(conn,
-                     accion="upload_calificaciones",
+        record_event(accion="upload_calificaciones",
                      user_id=user_id,
                      user_email=claims.get("email") if claims else None,
                      user_rol=claims.get("rol") if claims else None,
                      modulo="calificaciones",
-                     detalles={"processed": processed, "inserted": inserted, "updated": updated, "filename": file.filename})
+                     detalles={"processed": processed, "inserted": inserted, "updated": updated, "filename": filename})
     except Exception:
         pass
 
@@ -510,7 +608,7 @@ def upload_calificaciones(
             "resolution_errors": resolution_errors[:50],
             "unexpected_columns": unexpected,
         },
-        "filename": file.filename,
+        "filename": filename,
     }
 
 
@@ -526,6 +624,7 @@ def export_calificaciones(
     fichaId: Optional[int] = Query(None),
     trimestre: Optional[int] = Query(None, ge=1, le=4),
     estado: Optional[str] = Query(None),
+    format: str = Query("xlsx", pattern=FORMAT_PATTERN, description="xlsx | csv | ndjson (csv/ndjson se transmiten por lotes)"),
 ):
     filters: List[str] = []
     params: List = []
@@ -544,19 +643,17 @@ def export_calificaciones(
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
 
     sql = f"""
-    SELECT {_cols()} FROM calificaciones
+    SELECT materia_id, ficha_id, estudiante_nombre, estudiante_documento, trimestre, nota, estado,
+           observaciones, fecha_carga
+    FROM calificaciones
     {where_clause}
     ORDER BY materia_id, estudiante_nombre, trimestre
     """
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(sql, params)
-        rows = cur.fetchall() or []
-
-    if not rows:
+    batches = open_export(sql, params, name="export_calificaciones")
+    if batches is None:
         raise HTTPException(status_code=404, detail="No hay calificaciones para exportar")
 
-    df = pd.DataFrame(rows)
-    # Reordenar columnas para export
+    # Reordenar columnas para export; letra derivada para compatibilidad
     export_cols = [
         "materia_id",
         "ficha_id",
@@ -564,27 +661,24 @@ def export_calificaciones(
         "estudiante_documento",
         "trimestre",
         "nota",
+        "letra",
         "estado",
         "observaciones",
         "fecha_carga",
     ]
-    df = df[export_cols]
-    # Agregar letra derivada para compatibilidad
-    df.insert(6, "letra", df["nota"].apply(lambda n: "A" if pd.notna(n) and float(n) >= 3.0 else ("F" if pd.notna(n) else None)))
 
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Calificaciones")
-    output.seek(0)
-
-    filename = "calificaciones_export.xlsx"
-    headers = {
-        "Content-Disposition": f"attachment; filename={filename}",
-    }
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers,
+    def _with_letra(row: dict) -> dict:
+        n = row.get("nota")
+        row["letra"] = ("A" if float(n) >= 3.0 else "F") if n is not None else None
+        return row
+
+    return export_response(
+        batches,
+        [(c, c) for c in export_cols],
+        format,
+        "calificaciones_export",
+        sheet_name="Calificaciones",
+        transform=_with_letra,
     )
 
 
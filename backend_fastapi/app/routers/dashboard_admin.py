@@ -1,14 +1,24 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Depends
 from psycopg.rows import dict_row
 from datetime import datetime, timedelta
-from ..db import get_conn
+from typing import Any, Dict, List
+from ..db import get_aconn
+from ..security import get_current_user_claims
+from ..services.dashboard_bootstrap import abootstrap
+from ..services.evidencias_resumen import aconteos_activos
+from ..services.evidencia_definicion_ref import aactive_join
 
 router = APIRouter(prefix="/api/v1/dashboard/admin", tags=["dashboard-admin"])
 
-def _safe_count(cur, sql: str, params=None) -> int:
+def _row_value(row, idx=0):
+    if isinstance(row, dict):
+        return list(row.values())[idx]
+    return row[idx]
+
+async def _safe_count(cur, sql: str, params=None) -> int:
     try:
-        cur.execute(sql, params or [])
-        row = cur.fetchone()
+        await cur.execute(sql, params or [])
+        row = await cur.fetchone()
         if not row:
             return 0
         if isinstance(row, dict):
@@ -17,8 +27,10 @@ def _safe_count(cur, sql: str, params=None) -> int:
     except Exception:
         return 0
 
-@router.get("/stats")
-def admin_stats():
+# Cada widget recibe el cursor: las rutas abren su conexión y /bootstrap los
+# ejecuta todos sobre una sola (services/dashboard_bootstrap.py).
+
+async def _stats(cur) -> Dict[str, Any]:
     """Aggregate statistics for the admin dashboard using existing core tables."""
     now = datetime.utcnow()
     period_end = now
@@ -26,24 +38,36 @@ def admin_stats():
     prev_start = now - timedelta(days=60)
     prev_end = now - timedelta(days=30)
 
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        usuarios_activos = _safe_count(cur, "SELECT COUNT(*) FROM users WHERE activo")
-        fichas_registradas = _safe_count(cur, "SELECT COUNT(*) FROM fichas")
-        evidencias_cargadas = _safe_count(cur, "SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE e.letra IS NOT NULL")
-        tareas_distintas = _safe_count(cur, "SELECT COUNT(DISTINCT e.evidencia_nombre) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa")
-
-        def period_count(table: str, ts_col: str, where_extra: str = ""):
-            try:
-                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {ts_col} BETWEEN %s AND %s {where_extra}", [period_start, period_end])
-                c1 = cur.fetchone()[0]
-                cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {ts_col} BETWEEN %s AND %s {where_extra}", [prev_start, prev_end])
-                c2 = cur.fetchone()[0]
-                return c1, c2
-            except Exception:
-                return 0, 0
-
-        new_users_30, new_users_prev = period_count("users", "created_at")
-        evidencias_30, evidencias_prev = period_count("evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa", "e.created_at", "AND e.letra IS NOT NULL")
+    usuarios_activos = await _safe_count(cur, "SELECT COUNT(*) FROM users WHERE activo")
+    fichas_registradas = await _safe_count(cur, "SELECT COUNT(*) FROM fichas")
+    # Resumen diario mantenido por las cargas (una consulta); sin migración: conteos directos
+    try:
+        async with cur.connection.transaction():
+            resumen = await aconteos_activos(cur, period_start.date(), prev_start.date())
+    except Exception:
+        resumen = None
+    if resumen is not None:
+        evidencias_cargadas = resumen["calificadas"]
+        tareas_distintas = resumen["distintas"]
+    else:
+        evidencias_cargadas = await _safe_count(cur, f"SELECT COUNT(*) FROM evidencias e {await aactive_join(cur)} WHERE e.letra IS NOT NULL")
+        tareas_distintas = await _safe_count(cur, f"SELECT COUNT(DISTINCT e.evidencia_nombre) FROM evidencias e {await aactive_join(cur)}")
+
+    async def period_count(table: str, ts_col: str, where_extra: str = ""):
+        try:
+            await cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {ts_col} BETWEEN %s AND %s {where_extra}", [period_start, period_end])
+            c1 = _row_value(await cur.fetchone())
+            await cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {ts_col} BETWEEN %s AND %s {where_extra}", [prev_start, prev_end])
+            c2 = _row_value(await cur.fetchone())
+            return c1, c2
+        except Exception:
+            return 0, 0
+
+    new_users_30, new_users_prev = await period_count("users", "created_at")
+    if resumen is not None:
+        evidencias_30, evidencias_prev = resumen["calificadas_actual"], resumen["calificadas_previo"]
+    else:
+        evidencias_30, evidencias_prev = await period_count(f"evidencias e {await aactive_join(cur)}", "e.created_at", "AND e.letra IS NOT NULL")
 
     def trend(current: int, previous: int):
         if previous == 0:
@@ -51,164 +75,198 @@ def admin_stats():
         return round(((current - previous) / previous) * 100.0, 2)
 
     return {
-        "success": True,
-        "data": {
-            "usuariosActivos": usuarios_activos,
-            "fichasRegistradas": fichas_registradas,
-            "tareasCargadas": evidencias_cargadas,
-            "tareasDistintas": tareas_distintas,
-            "tendencias": {
-                "usuarios": trend(new_users_30, new_users_prev),
-                "cargas": trend(evidencias_30, evidencias_prev)
-            },
-            "periodo": {
-                "actualDesde": period_start.isoformat(),
-                "actualHasta": period_end.isoformat(),
-            }
+        "usuariosActivos": usuarios_activos,
+        "fichasRegistradas": fichas_registradas,
+        "tareasCargadas": evidencias_cargadas,
+        "tareasDistintas": tareas_distintas,
+        "tendencias": {
+            "usuarios": trend(new_users_30, new_users_prev),
+            "cargas": trend(evidencias_30, evidencias_prev)
+        },
+        "periodo": {
+            "actualDesde": period_start.isoformat(),
+            "actualHasta": period_end.isoformat(),
         }
     }
 
-@router.get("/activity")
-def admin_recent_activity(limit: int = Query(10, ge=1, le=50)):
+@router.get("/stats")
+async def admin_stats():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _stats(cur)
+    return {"success": True, "data": data}
+
+async def _activity(cur, limit: int = 10) -> List[Dict[str, Any]]:
     """Actividad reciente basada en tabla audit_logs.
     Si audit_logs está vacío se muestran eventos básicos de respaldo.
     """
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+    events = []
+    # Intentar cargar desde audit_logs primero
+    try:
+        await cur.execute("""
+            SELECT id, created_at, user_id, user_email, user_rol, accion, modulo,
+                   entidad_tipo, entidad_id, metodo_http, ruta, estado_http, duracion_ms
+            FROM audit_logs
+            ORDER BY created_at DESC
+            LIMIT %s
+        """, [limit])
+        rows = await cur.fetchall() or []
+        for r in rows:
+            events.append({
+                "id": r.get('id'),
+                "timestamp": r.get('created_at'),
+                "usuario": r.get('user_email') or r.get('user_id'),
+                "rol": r.get('user_rol'),
+                "accion": r.get('accion'),
+                "modulo": r.get('modulo'),
+                "entidadTipo": r.get('entidad_tipo'),
+                "entidadId": r.get('entidad_id'),
+                "http": {
+                    "metodo": r.get('metodo_http'),
+                    "ruta": r.get('ruta'),
+                    "estado": r.get('estado_http'),
+                    "duracionMs": r.get('duracion_ms')
+                }
+            })
+    except Exception:
         events = []
-        # Intentar cargar desde audit_logs primero
+    # Fallback si no hay datos de audit_logs
+    if not events:
         try:
-            cur.execute("""
-                SELECT id, created_at, user_id, user_email, user_rol, accion, modulo,
-                       entidad_tipo, entidad_id, metodo_http, ruta, estado_http, duracion_ms
-                FROM audit_logs
+            await cur.execute("""
+                SELECT 'usuario_creado' AS tipo, id, email, nombre, apellido, rol, created_at
+                FROM users
                 ORDER BY created_at DESC
                 LIMIT %s
             """, [limit])
-            rows = cur.fetchall() or []
-            for r in rows:
+            for r in await cur.fetchall() or []:
                 events.append({
-                    "id": r.get('id'),
                     "timestamp": r.get('created_at'),
-                    "usuario": r.get('user_email') or r.get('user_id'),
-                    "rol": r.get('user_rol'),
-                    "accion": r.get('accion'),
-                    "modulo": r.get('modulo'),
-                    "entidadTipo": r.get('entidad_tipo'),
-                    "entidadId": r.get('entidad_id'),
-                    "http": {
-                        "metodo": r.get('metodo_http'),
-                        "ruta": r.get('ruta'),
-                        "estado": r.get('estado_http'),
-                        "duracionMs": r.get('duracion_ms')
-                    }
+                    "usuario": r.get('email'),
+                    "rol": r.get('rol'),
+                    "accion": "usuario_creado",
+                    "modulo": "users"
                 })
-        except Exception:
-            events = []
-        # Fallback si no hay datos de audit_logs
-        if not events:
-            try:
-                cur.execute("""
-                    SELECT 'usuario_creado' AS tipo, id, email, nombre, apellido, rol, created_at
-                    FROM users
-                    ORDER BY created_at DESC
-                    LIMIT %s
-                """, [limit])
-                for r in cur.fetchall() or []:
-                    events.append({
-                        "timestamp": r.get('created_at'),
-                        "usuario": r.get('email'),
-                        "rol": r.get('rol'),
-                        "accion": "usuario_creado",
-                        "modulo": "users"
-                    })
-            except Exception:
-                pass
-            try:
-                cur.execute("""
-                    SELECT e.evidencia_nombre, e.documento, e.created_at, e.letra
-                    FROM evidencias e
-                    JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa
-                    WHERE e.letra IS NOT NULL
-                    ORDER BY e.created_at DESC
-                    LIMIT %s
-                """, [limit])
-                for r in cur.fetchall() or []:
-                    events.append({
-                        "timestamp": r.get('created_at'),
-                        "usuario": r.get('documento'),
-                        "accion": "calificacion_registrada",
-                        "modulo": "calificaciones",
-                        "entidadTipo": "evidencia",
-                        "entidadId": r.get('evidencia_nombre'),
-                    })
-            except Exception:
-                pass
-        events.sort(key=lambda e: e.get('timestamp') or datetime.min, reverse=True)
-    return {"success": True, "data": events[:limit]}
-
-@router.get("/pending-tasks")
-def admin_pending_tasks():
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        inactivos = _safe_count(cur, "SELECT COUNT(*) FROM users WHERE NOT activo")
-        evidencias_pendientes = _safe_count(cur, "SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE e.letra IS NULL")
-        try:
-            cur.execute("""
-                SELECT COUNT(*) FROM (
-                  SELECT documento, SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) AS faltas
-                  FROM evidencias
-                  GROUP BY documento
-                  HAVING SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) > 10
-                ) t
-            """)
-            riesgo = cur.fetchone()[0]
-        except Exception:
-            riesgo = 0
-    return {"success": True, "data": {"usuariosInactivos": inactivos, "evidenciasPendientes": evidencias_pendientes, "estudiantesAltoRiesgo": riesgo}}
-
-@router.get("/managed-students")
-def admin_managed_students():
-    """Métricas globales de estudiantes (admin)."""
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        try:
-            cur.execute("SELECT COUNT(DISTINCT estudiante_documento) AS total FROM calificaciones")
-            total = (cur.fetchone() or {}).get("total", 0)
-        except Exception:
-            total = 0
-        estado = {"Aprobado": 0, "Reprobado": 0, "Cursando": 0}
-        try:
-            cur.execute("""
-                SELECT estado, COUNT(DISTINCT estudiante_documento) AS c
-                FROM calificaciones WHERE estado IS NOT NULL
-                GROUP BY estado
-            """)
-            for r in cur.fetchall() or []:
-                estado[r.get("estado") if isinstance(r, dict) else r[0]] = r.get("c") if isinstance(r, dict) else r[1]
-        except Exception:
-            pass
-        por_materia = []
-        try:
-            cur.execute("""
-                SELECT m.id, m.nombre, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
-                FROM calificaciones c JOIN materias m ON m.id = c.materia_id
-                GROUP BY m.id, m.nombre
-                ORDER BY estudiantes DESC
-                LIMIT 50
-            """)
-            for r in cur.fetchall() or []:
-                por_materia.append({"materiaId": r.get("id"), "materia": r.get("nombre"), "estudiantes": r.get("estudiantes")})
         except Exception:
             pass
-        por_ficha = []
         try:
-            cur.execute("""
-                SELECT f.id, f.numero, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
-                FROM calificaciones c JOIN fichas f ON f.id = c.ficha_id
-                GROUP BY f.id, f.numero
-                ORDER BY estudiantes DESC
-                LIMIT 50
-            """)
-            for r in cur.fetchall() or []:
-                por_ficha.append({"fichaId": r.get("id"), "ficha": r.get("numero"), "estudiantes": r.get("estudiantes")})
+            await cur.execute(f"""
+                SELECT e.evidencia_nombre, e.documento, e.created_at, e.letra
+                FROM evidencias e
+                {await aactive_join(cur)}
+                WHERE e.letra IS NOT NULL
+                ORDER BY e.created_at DESC
+                LIMIT %s
+            """, [limit])
+            for r in await cur.fetchall() or []:
+                events.append({
+                    "timestamp": r.get('created_at'),
+                    "usuario": r.get('documento'),
+                    "accion": "calificacion_registrada",
+                    "modulo": "calificaciones",
+                    "entidadTipo": "evidencia",
+                    "entidadId": r.get('evidencia_nombre'),
+                })
         except Exception:
             pass
-    return {"success": True, "data": {"total": total, "estado": estado, "porMateria": por_materia, "porFicha": por_ficha}}
+    events.sort(key=lambda e: e.get('timestamp') or datetime.min, reverse=True)
+    return events[:limit]
+
+@router.get("/activity")
+async def admin_recent_activity(limit: int = Query(10, ge=1, le=50)):
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _activity(cur, limit)
+    return {"success": True, "data": data}
+
+async def _pending_tasks(cur) -> Dict[str, Any]:
+    inactivos = await _safe_count(cur, "SELECT COUNT(*) FROM users WHERE NOT activo")
+    try:
+        async with cur.connection.transaction():
+            resumen = await aconteos_activos(cur, datetime.utcnow().date(), datetime.utcnow().date())
+    except Exception:
+        resumen = None
+    if resumen is not None:
+        evidencias_pendientes = resumen["pendientes"]
+    else:
+        evidencias_pendientes = await _safe_count(cur, f"SELECT COUNT(*) FROM evidencias e {await aactive_join(cur)} WHERE e.letra IS NULL")
+    try:
+        await cur.execute("""
+            SELECT COUNT(*) FROM (
+              SELECT documento, SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) AS faltas
+              FROM evidencias
+              GROUP BY documento
+              HAVING SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) > 10
+            ) t
+        """)
+        riesgo = _row_value(await cur.fetchone())
+    except Exception:
+        riesgo = 0
+    return {"usuariosInactivos": inactivos, "evidenciasPendientes": evidencias_pendientes, "estudiantesAltoRiesgo": riesgo}
+
+@router.get("/pending-tasks")
+async def admin_pending_tasks():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _pending_tasks(cur)
+    return {"success": True, "data": data}
+
+async def _managed_students(cur) -> Dict[str, Any]:
+    """Métricas globales de estudiantes (admin)."""
+    try:
+        await cur.execute("SELECT COUNT(DISTINCT estudiante_documento) AS total FROM calificaciones")
+        total = (await cur.fetchone() or {}).get("total", 0)
+    except Exception:
+        total = 0
+    estado = {"Aprobado": 0, "Reprobado": 0, "Cursando": 0}
+    try:
+        await cur.execute("""
+            SELECT estado, COUNT(DISTINCT estudiante_documento) AS c
+            FROM calificaciones WHERE estado IS NOT NULL
+            GROUP BY estado
+        """)
+        for r in await cur.fetchall() or []:
+            estado[r.get("estado") if isinstance(r, dict) else r[0]] = r.get("c") if isinstance(r, dict) else r[1]
+    except Exception:
+        pass
+    por_materia = []
+    try:
+        await cur.execute("""
+            SELECT m.id, m.nombre, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
+            FROM calificaciones c JOIN materias m ON m.id = c.materia_id
+            GROUP BY m.id, m.nombre
+            ORDER BY estudiantes DESC
+            LIMIT 50
+        """)
+        for r in await cur.fetchall() or []:
+            por_materia.append({"materiaId": r.get("id"), "materia": r.get("nombre"), "estudiantes": r.get("estudiantes")})
+    except Exception:
+        pass
+    por_ficha = []
+    try:
+        await cur.execute("""
+            SELECT f.id, f.numero, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
+            FROM calificaciones c JOIN fichas f ON f.id = c.ficha_id
+            GROUP BY f.id, f.numero
+            ORDER BY estudiantes DESC
+            LIMIT 50
+        """)
+        for r in await cur.fetchall() or []:
+            por_ficha.append({"fichaId": r.get("id"), "ficha": r.get("numero"), "estudiantes": r.get("estudiantes")})
+    except Exception:
+        pass
+    return {"total": total, "estado": estado, "porMateria": por_materia, "porFicha": por_ficha}
+
+@router.get("/managed-students")
+async def admin_managed_students():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _managed_students(cur)
+    return {"success": True, "data": data}
+
+@router.get("/bootstrap")
+async def admin_bootstrap(claims: dict = Depends(get_current_user_claims)):
+    """Todos los widgets del dashboard admin en una conexión y un mismo snapshot."""
+    widgets = {
+        "stats": _stats,
+        "activity": _activity,
+        "pendingTasks": _pending_tasks,
+        "managedStudents": _managed_students,
+    }
+    return {"success": True, "data": await abootstrap("admin", claims, widgets)}
@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Depends
 from datetime import datetime, timedelta
 from psycopg.rows import dict_row
-from ..db import get_conn
-from ..utils.grades import average_letters
+from typing import Any, Dict, List
+from ..db import get_aconn
+from ..security import get_current_user_claims
+from ..services.dashboard_bootstrap import abootstrap
+from ..utils.grades import average_letters, average_letter_counts
+from ..services.evidencias_resumen import aconteos_activos, aconteos_letras, apor_evidencia
+from ..services.evidencia_definicion_ref import aactive_join
 
 router = APIRouter(prefix="/api/v1/dashboard/coordinador", tags=["dashboard-coordinador"])
 
-def _fetch_one(cur, sql: str, params=None, default=0):
+def _row_value(row, idx=0):
+    if isinstance(row, dict):
+        return list(row.values())[idx]
+    return row[idx]
+
+async def _fetch_one(cur, sql: str, params=None, default=0):
     try:
-        cur.execute(sql, params or [])
-        row = cur.fetchone()
+        await cur.execute(sql, params or [])
+        row = await cur.fetchone()
         if not row:
             return default
         if isinstance(row, dict):
@@ -24,185 +34,253 @@ def _trend(current: float, previous: float) -> float:
         return 100.0 if current > 0 else 0.0
     return round(((current - previous) / previous) * 100.0, 2)
 
-@router.get("/stats")
-def coordinador_stats():
+# Cada widget recibe el cursor: las rutas abren su conexión y /bootstrap los
+# ejecuta todos sobre una sola (services/dashboard_bootstrap.py).
+
+async def _stats(cur) -> Dict[str, Any]:
     now = datetime.utcnow()
     period_start = now - timedelta(days=30)
     prev_start = now - timedelta(days=60)
     prev_end = now - timedelta(days=30)
 
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        total_evidencias = _fetch_one(cur, "SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa")
-        entregadas = _fetch_one(cur, "SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE e.letra IS NOT NULL AND e.letra <> '-' ")
-        calificadas = _fetch_one(cur, "SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE e.letra IS NOT NULL")
-        fichas_activas = _fetch_one(cur, "SELECT COUNT(*) FROM fichas WHERE (estado='activa' OR estado IS NULL)")
+    fichas_activas = await _fetch_one(cur, "SELECT COUNT(*) FROM fichas WHERE (estado='activa' OR estado IS NULL)")
+    # Resumen diario mantenido por las cargas; sin migración se usan las consultas directas
+    try:
+        async with cur.connection.transaction():
+            resumen = await aconteos_activos(cur, period_start.date(), prev_start.date())
+            letras_conteo = await aconteos_letras(cur) if resumen is not None else None
+    except Exception:
+        resumen = None
+    if resumen is not None:
+        total_evidencias = resumen["total"]
+        entregadas = resumen["entregadas"]
+        calificadas = resumen["calificadas"]
+        promedio_general = average_letter_counts({"A": letras_conteo["A"], "D": letras_conteo["D"]})
+        entregadas_cur, entregadas_prev = resumen["entregadas_actual"], resumen["entregadas_previo"]
+        calificadas_cur, calificadas_prev = resumen["calificadas_actual"], resumen["calificadas_previo"]
+    else:
+        activas = await aactive_join(cur)
+        total_evidencias = await _fetch_one(cur, f"SELECT COUNT(*) FROM evidencias e {activas}")
+        entregadas = await _fetch_one(cur, f"SELECT COUNT(*) FROM evidencias e {activas} WHERE e.letra IS NOT NULL AND e.letra <> '-' ")
+        calificadas = await _fetch_one(cur, f"SELECT COUNT(*) FROM evidencias e {activas} WHERE e.letra IS NOT NULL")
 
         # Promedio general por letra (heurística)
         try:
-            cur.execute("""
+            await cur.execute("""
                 SELECT letra FROM evidencias WHERE letra IS NOT NULL AND letra <> '-' LIMIT 5000
             """)
-            letras = [r[0] if not isinstance(r, dict) else r['letra'] for r in cur.fetchall() or []]
+            letras = [r[0] if not isinstance(r, dict) else r['letra'] for r in await cur.fetchall() or []]
         except Exception:
             letras = []
         promedio_general = average_letters(letras)
 
         # Period comparisons
-        def period_ratio(where: str):
+        async def period_ratio(where: str):
             try:
-                cur.execute(f"SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE {where} AND e.created_at BETWEEN %s AND %s", [period_start, now])
-                c1 = cur.fetchone()[0]
-                cur.execute(f"SELECT COUNT(*) FROM evidencias e JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa WHERE {where} AND e.created_at BETWEEN %s AND %s", [prev_start, prev_end])
-                c2 = cur.fetchone()[0]
+                await cur.execute(f"SELECT COUNT(*) FROM evidencias e {activas} WHERE {where} AND e.created_at BETWEEN %s AND %s", [period_start, now])
+                c1 = _row_value(await cur.fetchone())
+                await cur.execute(f"SELECT COUNT(*) FROM evidencias e {activas} WHERE {where} AND e.created_at BETWEEN %s AND %s", [prev_start, prev_end])
+                c2 = _row_value(await cur.fetchone())
                 return c1, c2
             except Exception:
                 return 0, 0
-        entregadas_cur, entregadas_prev = period_ratio("letra IS NOT NULL AND letra <> '-' ")
-        calificadas_cur, calificadas_prev = period_ratio("letra IS NOT NULL")
+        entregadas_cur, entregadas_prev = await period_ratio("letra IS NOT NULL AND letra <> '-' ")
+        calificadas_cur, calificadas_prev = await period_ratio("letra IS NOT NULL")
 
     tareas_entregadas_pct = round((entregadas / total_evidencias)*100, 2) if total_evidencias else 0.0
     calificaciones_cargadas_pct = round((calificadas / total_evidencias)*100, 2) if total_evidencias else 0.0
 
     return {
-        "success": True,
-        "data": {
-            "tareasEntregadasPorcentaje": tareas_entregadas_pct,
-            "calificacionesCargadasPorcentaje": calificaciones_cargadas_pct,
-            "promedioGeneral": promedio_general,
-            "fichasActivas": fichas_activas,
-            "tendencias": {
-                "tareas": _trend(entregadas_cur, entregadas_prev),
-                "calificaciones": _trend(calificadas_cur, calificadas_prev)
-            },
-            "periodo": {
-                "inicio": period_start.isoformat(),
-                "fin": now.isoformat()
-            }
+        "tareasEntregadasPorcentaje": tareas_entregadas_pct,
+        "calificacionesCargadasPorcentaje": calificaciones_cargadas_pct,
+        "promedioGeneral": promedio_general,
+        "fichasActivas": fichas_activas,
+        "tendencias": {
+            "tareas": _trend(entregadas_cur, entregadas_prev),
+            "calificaciones": _trend(calificadas_cur, calificadas_prev)
+        },
+        "periodo": {
+            "inicio": period_start.isoformat(),
+            "fin": now.isoformat()
         }
     }
 
+@router.get("/stats")
+async def coordinador_stats():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _stats(cur)
+    return {"success": True, "data": data}
+
+async def _at_risk_students(cur, limit: int = 10) -> List[Dict[str, Any]]:
+    try:
+        await cur.execute(f"""
+            SELECT e.documento AS estudiante, SUM(CASE WHEN e.letra='-' THEN 1 ELSE 0 END) AS faltas
+            FROM evidencias e
+            {await aactive_join(cur)}
+            GROUP BY e.documento
+            HAVING SUM(CASE WHEN e.letra='-' THEN 1 ELSE 0 END) > 10
+            ORDER BY faltas DESC
+            LIMIT %s
+        """, [limit])
+        rows = await cur.fetchall() or []
+        data = [{"estudiante": (r.get('estudiante') if isinstance(r, dict) else r[0]), "faltas": (r.get('faltas') if isinstance(r, dict) else r[1])} for r in rows]
+    except Exception:
+        data = []
+    return data
+
 @router.get("/at-risk-students")
-def coordinador_at_risk_students(limit: int = Query(10, ge=1, le=100)):
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        try:
-            cur.execute("""
-                SELECT e.documento AS estudiante, SUM(CASE WHEN e.letra='-' THEN 1 ELSE 0 END) AS faltas
-                FROM evidencias e
-                JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa
-                GROUP BY e.documento
-                HAVING SUM(CASE WHEN e.letra='-' THEN 1 ELSE 0 END) > 10
-                ORDER BY faltas DESC
-                LIMIT %s
-            """, [limit])
-            rows = cur.fetchall() or []
-            data = [{"estudiante": (r.get('estudiante') if isinstance(r, dict) else r[0]), "faltas": (r.get('faltas') if isinstance(r, dict) else r[1])} for r in rows]
-        except Exception:
-            data = []
+async def coordinador_at_risk_students(limit: int = Query(10, ge=1, le=100)):
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _at_risk_students(cur, limit)
     return {"success": True, "data": data}
 
-@router.get("/performance-by-course")
-def coordinador_performance_by_course(limit: int = Query(10, ge=1, le=50)):
+async def _performance_by_course(cur, limit: int = 10) -> List[Dict[str, Any]]:
     """Performance heurístico por materia (usa evidencias agrupadas por evidencia_nombre)."""
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        try:
-            cur.execute("""
-                SELECT e.evidencia_nombre AS curso,
-                       COUNT(*) AS total,
-                       SUM(CASE WHEN e.letra IS NOT NULL AND e.letra <> '-' THEN 1 ELSE 0 END) AS entregadas,
-                       SUM(CASE WHEN e.letra IS NOT NULL THEN 1 ELSE 0 END) AS calificadas
-                FROM evidencias e
-                JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa
-                GROUP BY e.evidencia_nombre
-                ORDER BY COUNT(*) DESC
-                LIMIT %s
-            """, [limit])
-            rows = cur.fetchall() or []
-            data = []
-            for r in rows:
-                curso = r.get('curso') if isinstance(r, dict) else r[0]
-                total = r.get('total') if isinstance(r, dict) else r[1]
-                entregadas = r.get('entregadas') if isinstance(r, dict) else r[2]
-                calificadas = r.get('calificadas') if isinstance(r, dict) else r[3]
-                completion = round((entregadas/total)*100,2) if total else 0.0
-                calif_pct = round((calificadas/total)*100,2) if total else 0.0
-                data.append({
-                    "curso": curso,
-                    "total": total,
-                    "entregadas": entregadas,
-                    "calificadas": calificadas,
-                    "progreso": completion,
-                    "calificacionesPct": calif_pct
-                })
-        except Exception:
-            data = []
+    try:
+        async with cur.connection.transaction():
+            resumen = await apor_evidencia(cur, solo_activas=True, limit=limit, orden="total")
+    except Exception:
+        resumen = None
+    if resumen is not None:
+        data = []
+        for r in resumen:
+            total = r["total"]
+            entregadas = r["aprobadas"] + r["reprobadas"]
+            calificadas = total - r["pendientes"]
+            data.append({
+                "curso": r["evidencia_nombre"],
+                "total": total,
+                "entregadas": entregadas,
+                "calificadas": calificadas,
+                "progreso": round((entregadas/total)*100,2) if total else 0.0,
+                "calificacionesPct": round((calificadas/total)*100,2) if total else 0.0
+            })
+        return data
+    try:
+        await cur.execute(f"""
+            SELECT e.evidencia_nombre AS curso,
+                   COUNT(*) AS total,
+                   SUM(CASE WHEN e.letra IS NOT NULL AND e.letra <> '-' THEN 1 ELSE 0 END) AS entregadas,
+                   SUM(CASE WHEN e.letra IS NOT NULL THEN 1 ELSE 0 END) AS calificadas
+            FROM evidencias e
+            {await aactive_join(cur)}
+            GROUP BY e.evidencia_nombre
+            ORDER BY COUNT(*) DESC
+            LIMIT %s
+        """, [limit])
+        rows = await cur.fetchall() or []
+        data = []
+        for r in rows:
+            curso = r.get('curso') if isinstance(r, dict) else r[0]
+            total = r.get('total') if isinstance(r, dict) else r[1]
+            entregadas = r.get('entregadas') if isinstance(r, dict) else r[2]
+            calificadas = r.get('calificadas') if isinstance(r, dict) else r[3]
+            completion = round((entregadas/total)*100,2) if total else 0.0
+            calif_pct = round((calificadas/total)*100,2) if total else 0.0
+            data.append({
+                "curso": curso,
+                "total": total,
+                "entregadas": entregadas,
+                "calificadas": calificadas,
+                "progreso": completion,
+                "calificacionesPct": calif_pct
+            })
+    except Exception:
+        data = []
+    return data
+
+@router.get("/performance-by-course")
+async def coordinador_performance_by_course(limit: int = Query(10, ge=1, le=50)):
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _performance_by_course(cur, limit)
     return {"success": True, "data": data}
 
-@router.get("/pending-approvals")
-def coordinador_pending_approvals():
+async def _pending_approvals(cur) -> Dict[str, Any]:
     """Placeholder: cargas pendientes. Si no existe tabla de uploads, devuelve cero."""
     # Intentar detectar tabla uploads
     pending = 0
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        try:
-            cur.execute("SELECT COUNT(*) FROM uploads WHERE estado='pendiente_aprobacion'")
-            pending = cur.fetchone()[0]
-        except Exception:
-            pending = 0
-    return {"success": True, "data": {"cargasPendientesAprobacion": pending}}
+    try:
+        await cur.execute("SELECT COUNT(*) FROM uploads WHERE estado='pendiente_aprobacion'")
+        pending = _row_value(await cur.fetchone())
+    except Exception:
+        pending = 0
+    return {"cargasPendientesAprobacion": pending}
 
-@router.get("/managed-students")
-def coordinador_managed_students():
+@router.get("/pending-approvals")
+async def coordinador_pending_approvals():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _pending_approvals(cur)
+    return {"success": True, "data": data}
+
+async def _managed_students(cur) -> Dict[str, Any]:
     """Métricas globales de estudiantes (heurística, sin relación directa coordinador-estudiante definida)."""
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        # Total distintos por evidencias (documento) y por calificaciones (estudiante_documento)
-        total = 0
-        try:
-            cur.execute("SELECT COUNT(DISTINCT estudiante_documento) FROM calificaciones")
-            total = cur.fetchone()[0] or 0
-        except Exception:
-            try:
-                cur.execute("SELECT COUNT(DISTINCT documento) FROM evidencias")
-                total = cur.fetchone()[0] or 0
-            except Exception:
-                total = 0
-        estado = {"Aprobado": 0, "Reprobado": 0, "Cursando": 0}
-        try:
-            cur.execute("""
-                SELECT estado, COUNT(DISTINCT estudiante_documento) AS c
-                FROM calificaciones WHERE estado IS NOT NULL
-                GROUP BY estado
-            """)
-            for r in cur.fetchall() or []:
-                if isinstance(r, dict):
-                    estado[r.get("estado")] = r.get("c")
-                else:
-                    estado[r[0]] = r[1]
-        except Exception:
-            pass
-        por_materia = []
-        try:
-            cur.execute("""
-                SELECT m.id, m.nombre, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
-                FROM calificaciones c JOIN materias m ON m.id = c.materia_id
-                GROUP BY m.id, m.nombre
-                ORDER BY estudiantes DESC
-                LIMIT 25
-            """)
-            for r in cur.fetchall() or []:
-                por_materia.append({"materiaId": r.get("id"), "materia": r.get("nombre"), "estudiantes": r.get("estudiantes")})
-        except Exception:
-            pass
-        por_ficha = []
+    # Total distintos por evidencias (documento) y por calificaciones (estudiante_documento)
+    total = 0
+    try:
+        await cur.execute("SELECT COUNT(DISTINCT estudiante_documento) FROM calificaciones")
+        total = _row_value(await cur.fetchone()) or 0
+    except Exception:
         try:
-            cur.execute("""
-                SELECT f.id, f.numero, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
-                FROM calificaciones c JOIN fichas f ON f.id = c.ficha_id
-                GROUP BY f.id, f.numero
-                ORDER BY estudiantes DESC
-                LIMIT 25
-            """)
-            for r in cur.fetchall() or []:
-                por_ficha.append({"fichaId": r.get("id"), "ficha": r.get("numero"), "estudiantes": r.get("estudiantes")})
+            await cur.execute("SELECT COUNT(DISTINCT documento) FROM evidencias")
+            total = _row_value(await cur.fetchone()) or 0
         except Exception:
-            pass
-    return {"success": True, "data": {"total": total, "estado": estado, "porMateria": por_materia, "porFicha": por_ficha}}
+            total = 0
+    estado = {"Aprobado": 0, "Reprobado": 0, "Cursando": 0}
+    try:
+        await cur.execute("""
+            SELECT estado, COUNT(DISTINCT estudiante_documento) AS c
+            FROM calificaciones WHERE estado IS NOT NULL
+            GROUP BY estado
+        """)
+        for r in await cur.fetchall() or []:
+            if isinstance(r, dict):
+                estado[r.get("estado")] = r.get("c")
+            else:
+                estado[r[0]] = r[1]
+    except Exception:
+        pass
+    por_materia = []
+    try:
+        await cur.execute("""
+            SELECT m.id, m.nombre, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
+            FROM calificaciones c JOIN materias m ON m.id = c.materia_id
+            GROUP BY m.id, m.nombre
+            ORDER BY estudiantes DESC
+            LIMIT 25
+        """)
+        for r in await cur.fetchall() or []:
+            por_materia.append({"materiaId": r.get("id"), "materia": r.get("nombre"), "estudiantes": r.get("estudiantes")})
+    except Exception:
+        pass
+    por_ficha = []
+    try:
+        await cur.execute("""
+            SELECT f.id, f.numero, COUNT(DISTINCT c.estudiante_documento) AS estudiantes
+            FROM calificaciones c JOIN fichas f ON f.id = c.ficha_id
+            GROUP BY f.id, f.numero
+            ORDER BY estudiantes DESC
+            LIMIT 25
+        """)
+        for r in await cur.fetchall() or []:
+            por_ficha.append({"fichaId": r.get("id"), "ficha": r.get("numero"), "estudiantes": r.get("estudiantes")})
+    except Exception:
+        pass
+    return {"total": total, "estado": estado, "porMateria": por_materia, "porFicha": por_ficha}
+
+@router.get("/managed-students")
+async def coordinador_managed_students():
+    async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        data = await _managed_students(cur)
+    return {"success": True, "data": data}
+
+@router.get("/bootstrap")
+async def coordinador_bootstrap(claims: dict = Depends(get_current_user_claims)):
+    """Todos los widgets del dashboard coordinador en una conexión y un mismo snapshot."""
+    widgets = {
+        "stats": _stats,
+        "atRiskStudents": _at_risk_students,
+        "performanceByCourse": _performance_by_course,
+        "pendingApprovals": _pending_approvals,
+        "managedStudents": _managed_students,
+    }
+    return {"success": True, "data": await abootstrap("coordinador", claims, widgets)}
@@ -1,5 +1,8 @@
-from fastapi import APIRouter
-from ..db import get_conn, get_db_settings
+from fastapi import APIRouter, Query
+from ..db import get_conn, get_db_settings, pool_stats
+from ..utils.audit import audit_sink
+from ..utils.pool_metrics import pool_metrics
+from ..utils.prepared import statement_stats
 
 router = APIRouter(prefix="/api/v1/db", tags=["db"])
 
@@ -29,3 +32,26 @@ def db_config():
     cfg = get_db_settings()
     redacted = {**cfg, "password": ("***" if cfg.get("password") else "")}
     return {"config": redacted}
+
+
+@router.get("/pool")
+def db_pool(reset: bool = Query(False, description="Reinicia contadores tras leerlos"),
+            top: int = Query(20, ge=1, le=200, description="Rutas con más tiempo de checkout")):
+    """Estado de los pools (psycopg_pool get_stats) y checkouts medidos por ruta."""
+    data = {"pools": pool_stats(reset), "checkout": pool_metrics.snapshot(top)}
+    if reset:
+        pool_metrics.reset()
+    return {"success": True, "data": data}
+
+
+@router.get("/statements")
+def db_statements():
+    """Configuración de sentencias preparadas y, por sentencia caliente, ejecuciones que
+    prepararon (primera en la conexión), reutilizaron la preparada o corrieron sin preparar."""
+    return {"success": True, "data": statement_stats()}
+
+
+@router.get("/audit")
+def db_audit():
+    """Cola de auditoría: encolados, escritos, descartados, esperas por cola llena y lotes."""
+    return {"success": True, "data": audit_sink.stats()}
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, HTTPException, Query, Depends, UploadFile, File
-from typing import Optional, List, Tuple
-from math import ceil
+from fastapi import APIRouter, HTTPException, Query, Depends, UploadFile, File, Response
+from typing import Callable, Optional, List, Tuple
+from functools import partial
 from psycopg.rows import dict_row
 from ..db import get_conn
 from ..security import get_current_user_claims
+from ..cache import bump_data_version
+from ..services.upload_jobs import submit_job, accepted_payload
+from ..services.evidencias_detalle_ingest import load_staging, merge
+from ..services.evidencia_definicion_ref import ref_disponible
+from ..services.aprobacion_diaria import pares, refresh_materias, refresh_pares
+from ..utils.pagination import Keyset, count_total, cursor_listado, pagination_meta, resolve_total_mode, TOTAL_PATTERN
+from ..utils.search import relevance_order, search_filter, search_info, trgm_disponible, trgm_indexado
+from ..utils.excel_stream import spool_to_tempfile, remove_quietly
 from pydantic import BaseModel, Field
 from fastapi.responses import StreamingResponse
 import io
+import os
+import numpy as np
 import pandas as pd
 import datetime
 
@@ -46,6 +56,20 @@ def _cols():
     )
 
 # -------------------- List --------------------
+_KEYSET = Keyset("evidencias_detalle", [
+    ("estudiante_nombre", "estudiante_nombre", "text"),
+    ("evidencia_nombre", "evidencia_nombre", "text"),
+    ("trimestre", "trimestre", "int"),
+    ("id", "id", "int"),
+])
+# Respaldo sobre la tabla base 'evidencias' (única por documento + evidencia)
+_KEYSET_BASE = Keyset("evidencias", [
+    ("e.documento", "documento", "text"),
+    ("e.evidencia_nombre", "evidencia_nombre", "text"),
+])
+_SEARCH_COLUMNS = ["estudiante_documento", "estudiante_nombre"]
+
+
 @router.get("")
 def list_evidencias(
     page: int = Query(1, ge=1),
@@ -56,15 +80,24 @@ def list_evidencias(
     trimestre: Optional[int] = Query(None, ge=1, le=4),
     evidenciaNombre: Optional[str] = Query(None),
     estado: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío = primera página; luego nextCursor"),
+    total: Optional[str] = Query(None, pattern=TOTAL_PATTERN),
+    orden: Optional[str] = Query(None, pattern="^relevancia$", description="Con search: ordenar por similitud (pg_trgm)"),
 ):
+    if orden and cursor is not None:
+        raise HTTPException(status_code=400, detail="orden=relevancia no admite cursor; usar page/pageSize")
     offset = (page - 1) * pageSize
+    total_mode = resolve_total_mode(total, cursor)
+    # Un cursor emitido por el respaldo continúa directamente sobre 'evidencias'
+    after_base = _KEYSET_BASE.decode(cursor) if cursor and cursor_listado(cursor) == "evidencias" else None
+    after = None if after_base is not None else _KEYSET.decode(cursor)
     filters: List[str] = []
     params: List = []
 
-    if search:
-        filters.append("(estudiante_documento ILIKE %s OR estudiante_nombre ILIKE %s)")
-        like = f"%{search}%"
-        params.extend([like, like])
+    if search and search.strip():
+        search_sql, search_params = search_filter(_SEARCH_COLUMNS, search)
+        filters.append(search_sql)
+        params.extend(search_params)
     if materiaId is not None:
         filters.append("materia_id = %s")
         params.append(materiaId)
@@ -75,82 +108,110 @@ def list_evidencias(
         filters.append("trimestre = %s")
         params.append(trimestre)
     if evidenciaNombre:
-        filters.append("evidencia_nombre ILIKE %s")
-        params.append(f"%{evidenciaNombre}%")
+        nombre_sql, nombre_params = search_filter(["evidencia_nombre"], evidenciaNombre)
+        filters.append(nombre_sql)
+        params.extend(nombre_params)
     if estado:
         filters.append("estado = %s")
         params.append(estado)
 
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
-
-    items_sql = f"""
-        SELECT {_cols()}
-        FROM evidencias_detalle
-        {where_clause}
-        ORDER BY estudiante_nombre, evidencia_nombre, trimestre
-        LIMIT %s OFFSET %s
-    """
-    count_sql = f"SELECT COUNT(*) AS total FROM evidencias_detalle {where_clause}"
-
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(count_sql, params)
-        total_row = cur.fetchone()
-        total = int(total_row["total"]) if total_row else 0
-        cur.execute(items_sql, [*params, pageSize, offset])
-        items = cur.fetchall() or []
+    page_params = [pageSize + 1] if cursor is not None else [pageSize, offset]
+    limit_sql = "LIMIT %s" if cursor is not None else "LIMIT %s OFFSET %s"
+
+    total_count: Optional[int] = None
+    exact = True
+    items: List = []
+    next_cursor = None
+    trgm = ranked = indexado = False
+    if after_base is None:
+        seek_sql, seek_params = _KEYSET.seek(after)
+        items_filters = filters + ([seek_sql] if seek_sql else [])
+        items_where = f"WHERE {' AND '.join(items_filters)}" if items_filters else ""
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            trgm = trgm_disponible(cur) if (search or evidenciaNombre) else False
+            indexado = trgm and trgm_indexado(
+                cur, "evidencias_detalle", (_SEARCH_COLUMNS if search else []) + (["evidencia_nombre"] if evidenciaNombre else [])
+            )
+            ranked = bool(orden and trgm and search and search.strip())
+            rank_sql, rank_params = relevance_order(_SEARCH_COLUMNS, search) if ranked else ("", [])
+            items_sql = f"""
+                SELECT {_cols()}
+                FROM evidencias_detalle
+                {items_where}
+                ORDER BY {rank_sql + ", " if rank_sql else ""}{_KEYSET.order_by()}
+                {limit_sql}
+            """
+            total_count, exact = count_total(cur, "evidencias_detalle", where_clause, params, total_mode, "evidencias_detalle")
+            cur.execute(items_sql, [*params, *seek_params, *rank_params, *page_params])
+            items = cur.fetchall() or []
+        if cursor is not None:
+            items, next_cursor = _KEYSET.page(items, pageSize)
+    # Sin total exacto: "vacío" = primera página sin filas
+    sin_detalle = after_base is not None or (
+        total_count == 0 if total_mode == "exact" else (not items and after is None and offset == 0)
+    )
     # Fallback: si no hay filas en evidencias_detalle y los filtros no requieren materia/ficha/trimestre,
     # devolver filas simples desde la tabla base 'evidencias' (como las que crea upload-columna).
-    if total == 0 and materiaId is None and fichaId is None and trimestre is None:
+    if sin_detalle and materiaId is None and fichaId is None and trimestre is None:
         base_filters: List[str] = []
         base_params: List = []
-        if search:
-            base_filters.append("(e.documento ILIKE %s)")
-            base_params.append(f"%{search}%")
+        if search and search.strip():
+            doc_sql, doc_params = search_filter(["e.documento"], search)
+            base_filters.append(doc_sql)
+            base_params.extend(doc_params)
         if evidenciaNombre:
-            base_filters.append("(e.evidencia_nombre ILIKE %s)")
-            base_params.append(f"%{evidenciaNombre}%")
+            nombre_sql, nombre_params = search_filter(["e.evidencia_nombre"], evidenciaNombre)
+            base_filters.append(nombre_sql)
+            base_params.extend(nombre_params)
         if estado:
             base_filters.append("(e.estado = %s)")
             base_params.append(estado)
         where2 = f"WHERE {' AND '.join(base_filters)}" if base_filters else ""
+        seek2_sql, seek2_params = _KEYSET_BASE.seek(after_base)
+        items_filters2 = base_filters + ([seek2_sql] if seek2_sql else [])
+        items_where2 = f"WHERE {' AND '.join(items_filters2)}" if items_filters2 else ""
         items_sql2 = (
             f"""
             SELECT e.id, e.documento, e.evidencia_nombre, e.letra, e.estado, e.observaciones, e.created_at, e.updated_at
             FROM evidencias e
-            {where2}
-            ORDER BY e.documento, e.evidencia_nombre
-            LIMIT %s OFFSET %s
+            {items_where2}
+            ORDER BY {_KEYSET_BASE.order_by()}
+            {limit_sql}
             """
         )
-        count_sql2 = f"SELECT COUNT(*) AS total FROM evidencias e {where2}"
+        next_cursor2 = None
         with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(count_sql2, base_params)
-            total_row2 = cur.fetchone()
-            total2 = int(total_row2["total"]) if total_row2 else 0
-            cur.execute(items_sql2, [*base_params, pageSize, offset])
+            trgm = trgm_disponible(cur) if (search or evidenciaNombre) else False
+            indexado = trgm and trgm_indexado(
+                cur, "evidencias", (["documento"] if search else []) + (["evidencia_nombre"] if evidenciaNombre else [])
+            )
+            total2, exact2 = count_total(cur, "evidencias e", where2, base_params, total_mode, "evidencias")
+            cur.execute(items_sql2, [*base_params, *seek2_params, *page_params])
             items2 = cur.fetchall() or []
+        if cursor is not None:
+            items2, next_cursor2 = _KEYSET_BASE.page(items2, pageSize)
         return {
             "success": True,
             "data": items2,
-            "pagination": {
-                "page": page,
-                "pageSize": pageSize,
-                "total": total2,
-                "totalPages": ceil(total2 / pageSize) if pageSize else 0,
-            },
+            "pagination": pagination_meta(page, pageSize, total2, total_mode, exact2, next_cursor2, cursor is not None),
+            "search": search_info(search or evidenciaNombre, indexado),
         }
 
     return {
         "success": True,
         "data": items,
-        "pagination": {
-            "page": page,
-            "pageSize": pageSize,
-            "total": total,
-            "totalPages": ceil(total / pageSize) if pageSize else 0,
-        },
+        "pagination": pagination_meta(page, pageSize, total_count, total_mode, exact, next_cursor, cursor is not None),
+        "search": search_info(search or evidenciaNombre, indexado, ranked),
     }
 
+def _refresh_aprobacion(cur, pares_) -> None:
+    # Rollup diario de tendencia-aprobacion (best-effort; ver services/aprobacion_diaria.py)
+    try:
+        refresh_pares(cur, pares_)
+    except Exception:
+        pass
+
 # -------------------- Detail --------------------
 @router.get("/{evidencia_id}")
 def get_evidencia(evidencia_id: int):
@@ -165,12 +226,17 @@ def get_evidencia(evidencia_id: int):
 @router.post("")
 def create_evidencia(payload: EvidenciaCreate, claims: dict = Depends(get_current_user_claims)):
     user_id = int(claims.get("sub")) if claims and claims.get("sub") else None
-    sql = f"""
-        INSERT INTO evidencias_detalle (materia_id, ficha_id, estudiante_nombre, estudiante_documento, evidencia_nombre, trimestre, nota, letra, estado, observaciones, cargado_por)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING {_cols()}
-    """
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        # Definición de su materia con ese nombre (FK entera, migrations/004)
+        ref_col, ref_val = (
+            (", evidencia_definicion_id", ", (SELECT id FROM evidencia_definicion WHERE materia_id = %s AND nombre = %s)")
+            if ref_disponible(cur, "evidencias_detalle") else ("", "")
+        )
+        sql = f"""
+            INSERT INTO evidencias_detalle (materia_id, ficha_id, estudiante_nombre, estudiante_documento, evidencia_nombre, trimestre, nota, letra, estado, observaciones, cargado_por{ref_col})
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s{ref_val})
+            RETURNING {_cols()}
+        """
         cur.execute(
             sql,
             [
@@ -185,9 +251,12 @@ def create_evidencia(payload: EvidenciaCreate, claims: dict = Depends(get_curren
                 payload.estado,
                 payload.observaciones,
                 user_id,
+                *([payload.materia_id, payload.evidencia_nombre] if ref_col else []),
             ],
         )
         row = cur.fetchone()
+        _refresh_aprobacion(cur, [(payload.ficha_id, payload.materia_id)])
+    bump_data_version(fichas=payload.ficha_id, materias=payload.materia_id)
     return {"success": True, "data": row}
 
 # -------------------- Update --------------------
@@ -229,23 +298,49 @@ def update_evidencia(evidencia_id: int, payload: EvidenciaUpdate, _: dict = Depe
     if not fields:
         raise HTTPException(status_code=400, detail="No hay campos para actualizar")
 
-    params.append(evidencia_id)
-    sql = f"UPDATE evidencias_detalle SET {', '.join(fields)} WHERE id = %s RETURNING {_cols()}"
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        # Alcance anterior del rollup diario si la fila puede cambiar de par o de conteo
+        previos = set()
+        if any(v is not None for v in (payload.ficha_id, payload.materia_id, payload.letra, payload.evidencia_nombre)):
+            try:
+                with conn.transaction():
+                    previos = pares(cur, "id = %s", [evidencia_id])
+            except Exception:
+                previos = set()
+        if (payload.materia_id is not None or payload.evidencia_nombre is not None) and ref_disponible(cur, "evidencias_detalle"):
+            # Re-vincular con la definición de la nueva (materia, nombre)
+            fields.append(
+                "evidencia_definicion_id = (SELECT d.id FROM evidencia_definicion d"
+                " WHERE d.materia_id = COALESCE(%s::int, evidencias_detalle.materia_id)"
+                " AND d.nombre = COALESCE(%s::text, evidencias_detalle.evidencia_nombre))"
+            )
+            params.extend([payload.materia_id, payload.evidencia_nombre])
+        params.append(evidencia_id)
+        sql = f"UPDATE evidencias_detalle SET {', '.join(fields)} WHERE id = %s RETURNING {_cols()}"
         cur.execute(sql, params)
         row = cur.fetchone()
+        if row and previos:
+            _refresh_aprobacion(cur, previos | {(row.get("ficha_id"), row.get("materia_id"))})
     if not row:
         raise HTTPException(status_code=404, detail="Evidencia no encontrada")
+    # Si cambió ficha/materia también quedó desactualizado el alcance anterior (desconocido)
+    bump_data_version(
+        fichas=None if payload.ficha_id is not None else row.get("ficha_id"),
+        materias=None if payload.materia_id is not None else row.get("materia_id"),
+    )
     return {"success": True, "data": row}
 
 # -------------------- Delete --------------------
 @router.delete("/{evidencia_id}")
 def delete_evidencia(evidencia_id: int, _: dict = Depends(get_current_user_claims)):
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("DELETE FROM evidencias_detalle WHERE id = %s RETURNING id", [evidencia_id])
+        cur.execute("DELETE FROM evidencias_detalle WHERE id = %s RETURNING id, ficha_id, materia_id", [evidencia_id])
         row = cur.fetchone()
+        if row:
+            _refresh_aprobacion(cur, [(row["ficha_id"], row["materia_id"])])
     if not row:
         raise HTTPException(status_code=404, detail="Evidencia no encontrada")
+    bump_data_version(fichas=row.pop("ficha_id"), materias=row.pop("materia_id"))
     return {"success": True, "data": row}
 
 # -------------------- Upload (Excel con upsert) --------------------
@@ -265,19 +360,44 @@ def _validate_df(df: pd.DataFrame) -> Tuple[List[str], List[str]]:
     unexpected = [c for c in df.columns if c.lower() not in allowed]
     return missing, unexpected
 
-@router.post("/upload")
-def upload_evidencias(
-    file: UploadFile = File(...),
-    claims: dict = Depends(get_current_user_claims),
-    dryRun: bool = Query(False),
-    notaA: float = Query(5.0, ge=0, le=5, description="Valor numérico asignado a A"),
-    notaF: float = Query(2.0, ge=0, le=5, description="Valor numérico asignado a F"),
-):
-    if not file.filename.lower().endswith((".xlsx", ".xls")):
+def _validate_rows(df: pd.DataFrame) -> List[str]:
+    """Validación vectorizada (máscaras); mensajes en orden de fila como en la versión fila a fila."""
+    checks: List[Tuple[pd.Series, str]] = []
+    t = pd.to_numeric(df["trimestre"], errors="coerce")
+    t_bad = t.isna()
+    checks.append((t_bad, "trimestre inválido"))
+    t_int = np.trunc(t)
+    checks.append((~t_bad & ((t_int < 1) | (t_int > 4)), "trimestre fuera de rango (1-4)"))
+    # Como antes, un trimestre ilegible detiene las demás validaciones de la fila
+    if "letra" in df.columns:
+        letra = df["letra"]
+        checks.append((~t_bad & (letra != "") & ~letra.isin(["A", "F"]), "letra inválida (solo A/F)"))
+    if "nota" in df.columns:
+        nota = pd.to_numeric(df["nota"], errors="coerce")
+        informada = df["nota"].notna()
+        checks.append((~t_bad & informada & nota.isna(), "nota inválida"))
+        checks.append((~t_bad & nota.notna() & ((nota < 0) | (nota > 5)), "nota fuera de rango (0-5)"))
+    any_bad = pd.Series(False, index=df.index)
+    for mask, _ in checks:
+        any_bad |= mask
+    errors: List[str] = []
+    for pos in np.flatnonzero(any_bad.to_numpy()):
+        idx = df.index[pos]
+        for mask, msg in checks:
+            if mask.iat[pos]:
+                errors.append(f"Fila {idx+2}: {msg}")
+    return errors
+
+
+def parse_evidencias(source, filename: str) -> dict:
+    """Lectura y validación (sin BD) del Excel de evidencias. Serializable para el pool de procesos.
+
+    `source` es una ruta (trabajos en background) o un archivo abierto.
+    """
+    if not filename.lower().endswith((".xlsx", ".xls")):
         raise HTTPException(status_code=400, detail="Formato no soportado, use .xlsx/.xls")
-    content = file.file.read()
     try:
-        df = pd.read_excel(io.BytesIO(content))
+        df = pd.read_excel(source)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
     if df.empty:
@@ -291,23 +411,112 @@ def upload_evidencias(
     df["estudiante_documento"] = df["estudiante_documento"].astype(str).str.strip()
     df["evidencia_nombre"] = df["evidencia_nombre"].astype(str).str.strip()
     if "letra" in df.columns:
-        df["letra"] = df["letra"].astype(str).str.strip().str.upper()
+        # Celda vacía = sin letra (antes astype(str) la convertía en 'NAN' y se rechazaba)
+        df["letra"] = df["letra"].where(df["letra"].notna(), "").astype(str).str.strip().str.upper()
+    validation_errors = _validate_rows(df)
+    return {"df": df, "unexpected": unexpected, "validation_errors": validation_errors}
 
-    validation_errors: List[str] = []
-    for idx, row in df.iterrows():
-        try:
-            t = int(row["trimestre"])
-            if t < 1 or t > 4:
-                validation_errors.append(f"Fila {idx+2}: trimestre fuera de rango (1-4)")
-            letra_val = str(row.get("letra") or "").upper()
-            if letra_val and letra_val not in ("A", "F"):
-                validation_errors.append(f"Fila {idx+2}: letra inválida (solo A/F)")
-            if pd.notna(row.get("nota")):
-                n = float(row["nota"])
-                if n < 0 or n > 5:
-                    validation_errors.append(f"Fila {idx+2}: nota fuera de rango (0-5)")
-        except Exception as e:
-            validation_errors.append(f"Fila {idx+2}: error validando - {e}")
+
+@router.post("/upload")
+def upload_evidencias(
+    response: Response,
+    file: UploadFile = File(...),
+    claims: dict = Depends(get_current_user_claims),
+    dryRun: bool = Query(False),
+    notaA: float = Query(5.0, ge=0, le=5, description="Valor numérico asignado a A"),
+    notaF: float = Query(2.0, ge=0, le=5, description="Valor numérico asignado a F"),
+    background: bool = Query(False, description="Si true encola la carga y retorna un id de trabajo (ver /api/v1/uploads/{id})"),
+):
+    if background:
+        if not file.filename.lower().endswith((".xlsx", ".xls")):
+            raise HTTPException(status_code=400, detail="Formato no soportado, use .xlsx/.xls")
+        path = spool_to_tempfile(file.file, suffix=os.path.splitext(file.filename)[1].lower())
+        job = submit_job(
+            "evidencias_detalle",
+            claims,
+            partial(_apply_evidencias, claims=claims, dryRun=dryRun, notaA=notaA, notaF=notaF, filename=file.filename),
+            parse_fn=parse_evidencias,
+            parse_args=(path, file.filename),
+            cleanup=partial(remove_quietly, path),
+            filename=file.filename,
+            parametros={"dryRun": dryRun, "notaA": notaA, "notaF": notaF},
+        )
+        response.status_code = 202
+        return accepted_payload(job)
+    parsed = parse_evidencias(file.file, file.filename)
+    return _apply_evidencias(parsed, None, claims=claims, dryRun=dryRun, notaA=notaA, notaF=notaF, filename=file.filename)
+
+
+def _resolve_ids(df: pd.DataFrame, materia_map: dict, ficha_map: dict) -> Tuple[pd.DataFrame, List[str]]:
+    """Resuelve materia/ficha con map() sobre los diccionarios precargados.
+
+    Prioridad por fila igual que antes: *_id numérico si viene, si no código/número.
+    Retorna las filas resueltas (con materia_id/ficha_id enteros) y los errores por fila.
+    """
+    def _resolve(id_col: str, key_col: str, mapping: dict) -> pd.Series:
+        out = pd.Series(np.nan, index=df.index, dtype="float64")
+        if key_col in df.columns:
+            keys = df[key_col]
+            out = keys.where(keys.notna()).astype(str).str.strip().str.lower().map(mapping).astype("float64")
+            out[keys.isna()] = np.nan
+        if id_col in df.columns:
+            direct = pd.to_numeric(df[id_col], errors="coerce")
+            out = direct.where(df[id_col].notna(), out)
+        return out.fillna(0)
+
+    materia = _resolve("materia_id", "materia_codigo", materia_map)
+    ficha = _resolve("ficha_id", "ficha_numero", ficha_map)
+    sin_materia = materia == 0
+    sin_ficha = ~sin_materia & (ficha == 0)
+    errors: List[str] = []
+    for pos in np.flatnonzero((sin_materia | sin_ficha).to_numpy()):
+        motivo = "materia no encontrada" if sin_materia.iat[pos] else "ficha no encontrada"
+        errors.append(f"Fila {df.index[pos]+2}: {motivo}")
+    ok = ~(sin_materia | sin_ficha)
+    resolved = df[ok].copy()
+    resolved["materia_id"] = materia[ok].astype("int64")
+    resolved["ficha_id"] = ficha[ok].astype("int64")
+    return resolved, errors
+
+
+def _normalize_rows(df: pd.DataFrame, notaA: float, notaF: float) -> pd.DataFrame:
+    """Columnas finales de evidencias_detalle: nota por letra (A/F) o numérica, estado derivado."""
+    letra = df["letra"] if "letra" in df.columns else pd.Series("", index=df.index)
+    es_af = letra.isin(["A", "F"])
+    if "nota" in df.columns:
+        nota = pd.to_numeric(df["nota"], errors="coerce")
+    else:
+        nota = pd.Series(np.nan, index=df.index)
+    nota = nota.mask(letra == "A", notaA).mask(letra == "F", notaF)
+    estado_letra = letra.map({"A": "Aprobado", "F": "Reprobado"}).fillna("Pendiente")
+    estado = df["estado"].where(df["estado"].notna(), estado_letra) if "estado" in df.columns else estado_letra
+    return pd.DataFrame({
+        "materia_id": df["materia_id"],
+        "ficha_id": df["ficha_id"],
+        "estudiante_nombre": df["estudiante_nombre"],
+        "estudiante_documento": df["estudiante_documento"],
+        "evidencia_nombre": df["evidencia_nombre"],
+        "trimestre": np.trunc(pd.to_numeric(df["trimestre"])).astype("int64"),
+        "nota": nota,
+        "letra": letra.where(es_af, None),
+        "estado": estado,
+        "observaciones": df["observaciones"] if "observaciones" in df.columns else None,
+    }, index=df.index)
+
+
+def _apply_evidencias(
+    parsed: dict,
+    progress: Optional[Callable[..., None]] = None,
+    claims: Optional[dict] = None,
+    dryRun: bool = False,
+    notaA: float = 5.0,
+    notaF: float = 2.0,
+    filename: Optional[str] = None,
+):
+    df = parsed["df"]
+    unexpected = parsed["unexpected"]
+    validation_errors: List[str] = parsed["validation_errors"]
+    progress = progress or (lambda *a, **k: None)
     if validation_errors and dryRun:
         return {
             "success": False,
@@ -331,110 +540,45 @@ def upload_evidencias(
             if r.get("numero"):
                 ficha_map[str(r["numero"]).strip().lower()] = r["id"]
 
-    resolution_errors: List[str] = []
-    resolved_rows = []
-    for idx, row in df.iterrows():
-        try:
-            materia_id = None
-            if "materia_id" in df.columns and pd.notna(row.get("materia_id")):
-                materia_id = int(row.get("materia_id"))
-            elif "materia_codigo" in df.columns and pd.notna(row.get("materia_codigo")):
-                materia_id = materia_map.get(str(row.get("materia_codigo")).strip().lower())
-            ficha_id = None
-            if "ficha_id" in df.columns and pd.notna(row.get("ficha_id")):
-                ficha_id = int(row.get("ficha_id"))
-            elif "ficha_numero" in df.columns and pd.notna(row.get("ficha_numero")):
-                ficha_id = ficha_map.get(str(row.get("ficha_numero")).strip().lower())
-            if not materia_id:
-                resolution_errors.append(f"Fila {idx+2}: materia no encontrada")
-                continue
-            if not ficha_id:
-                resolution_errors.append(f"Fila {idx+2}: ficha no encontrada")
-                continue
-            resolved_rows.append((materia_id, ficha_id, row))
-        except Exception as e:
-            resolution_errors.append(f"Fila {idx+2}: error resolviendo IDs - {e}")
+    resolved, resolution_errors = _resolve_ids(df, materia_map, ficha_map)
+    progress("resolucion", 10, resolution_errors)
 
     if dryRun:
         return {
             "success": True,
             "dryRun": True,
             "rows_total": len(df),
-            "resolvable": len(resolved_rows),
+            "resolvable": len(resolved),
             "resolution_errors": resolution_errors[:50],
             "unexpected_columns": unexpected,
         }
-    if not resolved_rows:
+    if resolved.empty:
         raise HTTPException(status_code=400, detail="No se pudo resolver ninguna fila: " + "; ".join(resolution_errors[:25]))
 
     user_id = int(claims.get("sub")) if claims and claims.get("sub") else None
-    processed = 0
-    inserted = 0
-    updated = 0
+    processed = len(resolved)
     now = datetime.date.today()
+    rows = _normalize_rows(resolved, notaA, notaF)
 
-    upsert_sql = (
-        "INSERT INTO evidencias_detalle (" 
-        "materia_id, ficha_id, estudiante_nombre, estudiante_documento, evidencia_nombre, trimestre, nota, letra, estado, observaciones, cargado_por, fecha_carga) "
-        "VALUES (%s,%s,%s,%s,%s,%s,%s,%s, "
-        "COALESCE(%s, CASE WHEN %s IN ('A','F') THEN CASE WHEN %s = 'A' THEN 'Aprobado' ELSE 'Reprobado' END ELSE 'Pendiente' END), "
-        "%s, %s, %s, %s) "
-        "ON CONFLICT (materia_id, estudiante_documento, evidencia_nombre, trimestre) DO UPDATE SET "
-        "ficha_id = EXCLUDED.ficha_id, "
-        "estudiante_nombre = EXCLUDED.estudiante_nombre, "
-        "nota = EXCLUDED.nota, "
-        "letra = EXCLUDED.letra, "
-        "estado = EXCLUDED.estado, "
-        "observaciones = EXCLUDED.observaciones, "
-        "cargado_por = EXCLUDED.cargado_por, "
-        "fecha_carga = EXCLUDED.fecha_carga, "
-        "updated_at = CURRENT_TIMESTAMP "
-        "RETURNING (xmax = 0) AS inserted"
-    )
-
+    # COPY a staging + un único upsert (services/evidencias_detalle_ingest.py). Las claves
+    # repetidas en el archivo cuentan como actualizaciones, igual que fila a fila.
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
         try:
-            for materia_id, ficha_id, r in resolved_rows:
-                processed += 1
-                letra_val = str(r.get("letra") or "").upper()
-                nota_val = None
-                if letra_val == "A":
-                    nota_val = notaA
-                elif letra_val == "F":
-                    nota_val = notaF
-                elif pd.notna(r.get("nota")):
-                    try:
-                        nota_val = float(r.get("nota"))
-                    except Exception:
-                        nota_val = None
-                cur.execute(
-                    upsert_sql,
-                    [
-                        materia_id,
-                        ficha_id,
-                        r["estudiante_nombre"],
-                        r["estudiante_documento"],
-                        r["evidencia_nombre"],
-                        int(r["trimestre"]),
-                        nota_val,
-                        letra_val if letra_val in ("A","F") else None,
-                        r.get("estado"),
-                        letra_val if letra_val in ("A","F") else None,
-                        letra_val if letra_val in ("A","F") else None,
-                        r.get("observaciones"),
-                        user_id,
-                        now,
-                    ],
-                )
-                row_ret = cur.fetchone()
-                if row_ret and row_ret.get("inserted"):
-                    inserted += 1
-                else:
-                    updated += 1
+            load_staging(cur, rows)
+            progress("escritura", 60)
+            result = merge(cur, user_id, now)
+            # El upsert puede reasignar ficha: se recalculan las materias completas
+            try:
+                refresh_materias(cur, set(rows["materia_id"].tolist()))
+            except Exception:
+                pass
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise HTTPException(status_code=400, detail=f"Error procesando batch: {e}")
+    inserted = result["inserted"]
+    updated = processed - inserted
+    bump_data_version(fichas=set(rows["ficha_id"].tolist()), materias=set(rows["materia_id"].tolist()))
 
     return {
         "success": True,
@@ -445,7 +589,7 @@ def upload_evidencias(
             "resolution_errors": resolution_errors[:50],
             "unexpected_columns": unexpected,
         },
-        "filename": file.filename,
+        "filename": filename,
     }
 
 # -------------------- Export --------------------
@@ -470,8 +614,9 @@ def export_evidencias(
         filters.append("trimestre = %s")
         params.append(trimestre)
     if evidenciaNombre:
-        filters.append("evidencia_nombre ILIKE %s")
-        params.append(f"%{evidenciaNombre}%")
+        nombre_sql, nombre_params = search_filter(["evidencia_nombre"], evidenciaNombre)
+        filters.append(nombre_sql)
+        params.extend(nombre_params)
     if estado:
         filters.append("estado = %s")
         params.append(estado)
@@ -3,6 +3,8 @@ from psycopg.rows import dict_row
 from typing import Optional, List, Dict, Any
 from ..db import get_conn
 from ..security import get_current_user_claims
+from ..cache import bump_data_version
+from ..services.evidencia_definicion_ref import repuntar_evidencias, vincular_definiciones
 
 router = APIRouter(prefix="/api/v1/evidencias/definiciones", tags=["evidencias-definiciones"])
 
@@ -12,6 +14,16 @@ def _row_to_dict(row: Any) -> Dict[str, Any]:
     # fallback positional
     return {}
 
+def _bump_for(rows: List[Dict[str, Any]]) -> None:
+    # Una definición sin ficha aplica a todas las fichas de la materia
+    if not rows:
+        return
+    fichas = [r.get("ficha_id") for r in rows]
+    bump_data_version(
+        fichas=None if any(f is None for f in fichas) else fichas,
+        materias=[r.get("materia_id") for r in rows],
+    )
+
 @router.get("")
 def listar_definiciones(
     materiaId: Optional[int] = Query(None),
@@ -60,10 +72,13 @@ def crear_definicion(
                 ]
             )
             row = cur.fetchone()
+            # Evidencias ya cargadas con ese nombre quedan vinculadas por id (migrations/004)
+            vincular_definiciones(cur, [row["id"]])
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise HTTPException(status_code=400, detail=f"Error creando definición: {e}")
+    _bump_for([row])
     return {"success": True, "data": row}
 
 @router.patch("/{definicion_id}")
@@ -85,12 +100,15 @@ def actualizar_definicion(definicion_id: int, payload: Dict[str, Any] = Body(...
             row = cur.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Definición no encontrada")
+            if "nombre" in payload:
+                vincular_definiciones(cur, [row["id"]])
             conn.commit()
         except HTTPException:
             raise
         except Exception as e:
             conn.rollback()
             raise HTTPException(status_code=400, detail=f"Error actualizando definición: {e}")
+    _bump_for([row])
     return {"success": True, "data": row}
 
 @router.patch("/activar")
@@ -98,9 +116,15 @@ def activar_definiciones(ids: List[int] = Body(..., embed=True)):
     if not ids:
         raise HTTPException(status_code=400, detail="Lista vacía")
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("UPDATE evidencia_definicion SET activa=TRUE WHERE id = ANY(%s) RETURNING id", [ids])
+        cur.execute("UPDATE evidencia_definicion SET activa=TRUE WHERE id = ANY(%s) RETURNING id, ficha_id, materia_id", [ids])
         updated = cur.fetchall() or []
+        # Filas de `evidencias` fijadas a una definición ya inactiva de ese nombre
+        movidas = repuntar_evidencias(cur, [r["id"] for r in updated])
         conn.commit()
+    _bump_for(updated)
+    if movidas:
+        # Filas de estudiantes de cualquier ficha cambiaron de definición
+        bump_data_version(everything=True)
     return {"success": True, "actualizados": [r["id"] for r in updated]}
 
 @router.patch("/desactivar")
@@ -108,9 +132,15 @@ def desactivar_definiciones(ids: List[int] = Body(..., embed=True)):
     if not ids:
         raise HTTPException(status_code=400, detail="Lista vacía")
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("UPDATE evidencia_definicion SET activa=FALSE WHERE id = ANY(%s) RETURNING id", [ids])
+        cur.execute("UPDATE evidencia_definicion SET activa=FALSE WHERE id = ANY(%s) RETURNING id, ficha_id, materia_id", [ids])
         updated = cur.fetchall() or []
+        # Filas de `evidencias` fijadas a una definición ya inactiva de ese nombre
+        movidas = repuntar_evidencias(cur, [r["id"] for r in updated])
         conn.commit()
+    _bump_for(updated)
+    if movidas:
+        # Filas de estudiantes de cualquier ficha cambiaron de definición
+        bump_data_version(everything=True)
     return {"success": True, "actualizados": [r["id"] for r in updated]}
 
 @router.get("/resumen")
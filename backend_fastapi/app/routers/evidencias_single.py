@@ -1,9 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from functools import partial
 from psycopg.rows import dict_row
 from ..db import get_conn
 from ..security import get_current_user_claims
+from ..cache import bump_data_version
+from ..services.evidencias_resumen import refresh_documentos
+from ..services.aprobacion_diaria import pares, refresh_pares
+from ..services.evidencia_definicion_ref import DEFINICION_POR_NOMBRE_SQL, ref_disponible, vincular_definiciones
+from ..services.upload_jobs import submit_job, accepted_payload
+from ..utils.prepared import execute_hot
+from ..utils.audit import record_event
 
 router = APIRouter(prefix="/api/v1/evidencias", tags=["evidencias-columna"])
 
@@ -20,13 +28,246 @@ class UploadColumnaPayload(BaseModel):
     rows: List[EvidenciaRow]
 
 @router.post("/upload-columna")
-def upload_columna(payload: UploadColumnaPayload, user: dict = Depends(get_current_user_claims)):
+def upload_columna(
+    payload: UploadColumnaPayload,
+    response: Response,
+    background: bool = Query(False, description="Si true encola la carga y retorna un id de trabajo (ver /api/v1/uploads/{id})"),
+    user: dict = Depends(get_current_user_claims),
+):
     evidencia_nombre = (payload.evidencia_nombre or "").strip()
     if not evidencia_nombre:
         raise HTTPException(status_code=400, detail="evidencia_nombre requerido")
     if not payload.rows:
         raise HTTPException(status_code=400, detail="rows vacío")
+    if background:
+        # Sin parseo de archivo: el trabajo va directo al pool de hilos
+        job = submit_job(
+            "evidencias_columna",
+            user,
+            partial(_apply_columna, user=user),
+            data=payload,
+            parametros={"ficha_id": payload.ficha_id or None, "materia_id": payload.materia_id or None, "evidencia_nombre": evidencia_nombre},
+        )
+        response.status_code = 202
+        return accepted_payload(job)
+    return _apply_columna(payload, None, user=user)
+
+
+def _normalize_val(v: Optional[str]) -> str:
+    s = (v or "").strip().upper()
+    if s in ("APROBADO", "A PROBADO"):
+        return "A"
+    if s in ("REPROBADO", "REPROBADA"):
+        return "D"
+    if s in ("NO ENTREGÓ", "NO ENTREGADO", "NO ENTREGADA", "NO ENTREGO"):
+        return "-"
+    if s in ("A", "D", "-"):
+        return s
+    return ""
+
+
+def _normalize_rows(rows: List[EvidenciaRow], counts: Dict[str, int], errores: List[str]) -> List[Dict[str, Any]]:
+    """Filas listas para escribir (una por fila válida del payload, en orden) y conteos de historial."""
     allowed = {"A", "D", "-", ""}
+    filas: List[Dict[str, Any]] = []
+    for r in rows:
+        doc = (r.documento or r.correo or "").strip()
+        if not doc:
+            errores.append("Documento vacío en fila")
+            continue
+        val = _normalize_val(r.valor)
+        if val not in allowed:
+            errores.append(f"Valor inválido '{r.valor}' para {doc}")
+            continue
+        # Acumular conteos para historial
+        if val == "":
+            counts["Pendiente"] += 1
+        else:
+            counts[val] += 1
+        counts["tot_registros"] += 1
+        # Derivar nombre desde 'estudiante' si viene, de lo contrario usar correo como placeholder
+        raw_name = (r.estudiante or "").strip()
+        filas.append({
+            "doc": doc,
+            "nombre": raw_name if raw_name else (r.correo or "").strip(),
+            "correo": (r.correo or "").strip(),
+            "letra": val if val != "" else None,
+            "estado": "Pendiente" if val == "" else ("Aprobado" if val == "A" else ("Reprobado" if val == "D" else "No entregó")),
+        })
+    return filas
+
+
+def _ref_sql(definicion_id: Optional[int], materia_id: Optional[int]) -> Dict[str, Any]:
+    """Fragmentos SQL para evidencia_definicion_id (migrations/004); vacíos si no aplica.
+
+    `evidencias`: con materia válida se fija la definición de la materia; sin materia
+    una fila existente conserva la suya. `evidencias_detalle`: siempre la de la materia.
+    """
+    if definicion_id is None:
+        return {"col": "", "val": "", "set": "", "detalle_set": "", "params": []}
+    keep = "EXCLUDED.evidencia_definicion_id" if materia_id else \
+        "COALESCE(evidencias.evidencia_definicion_id, EXCLUDED.evidencia_definicion_id)"
+    return {
+        "col": ", evidencia_definicion_id",
+        "val": ", %s",
+        "set": f", evidencia_definicion_id = {keep}",
+        "detalle_set": "evidencia_definicion_id = %s,",
+        "params": [definicion_id],
+    }
+
+
+def _write_batch(cur, filas: List[Dict[str, Any]], evidencia_nombre: str, ficha_id: Optional[int],
+                 materia_id: Optional[int], cargado_por: Optional[int],
+                 definicion_id: Optional[int] = None) -> Tuple[int, int]:
+    """Estudiantes, ficha, evidencias y evidencias_detalle en 4 sentencias multi-fila.
+
+    Ante documentos repetidos gana la última fila (como la escritura fila a fila).
+    Retorna (detalle_insertados, detalle_actualizados) contando por fila del payload.
+    """
+    if not filas:
+        return 0, 0
+    ultimas = list({f["doc"]: f for f in filas}.values())
+    docs = [f["doc"] for f in ultimas]
+    nombres = [f["nombre"] for f in ultimas]
+    letras = [f["letra"] for f in ultimas]
+    estados = [f["estado"] for f in ultimas]
+    # Asegurar nombre y correo (tabla requiere nombre NOT NULL, correo NOT NULL)
+    cur.execute(
+        """
+        INSERT INTO estudiantes (documento, nombre, correo)
+        SELECT * FROM unnest(%s::text[], %s::text[], %s::text[])
+        ON CONFLICT (documento) DO UPDATE SET nombre=EXCLUDED.nombre, correo=COALESCE(EXCLUDED.correo, estudiantes.correo), updated_at=CURRENT_TIMESTAMP
+        """,
+        [docs, nombres, [f["correo"] for f in ultimas]],
+    )
+    if ficha_id:
+        cur.execute(
+            "UPDATE estudiantes SET ficha_id=%s WHERE documento = ANY(%s) AND (ficha_id IS NULL OR ficha_id=0)",
+            [ficha_id, docs],
+        )
+    ref = _ref_sql(definicion_id, materia_id)
+    # Tabla base 'evidencias' (resumen por evidencia)
+    cur.execute(
+        f"""
+        INSERT INTO evidencias (documento, evidencia_nombre, letra, estado{ref["col"]})
+        SELECT t.doc, %s, t.letra, t.estado{ref["val"]} FROM unnest(%s::text[], %s::text[], %s::text[]) AS t(doc, letra, estado)
+        ON CONFLICT (documento, evidencia_nombre) DO UPDATE
+        SET letra = EXCLUDED.letra, estado = EXCLUDED.estado, updated_at = CURRENT_TIMESTAMP{ref["set"]}
+        """,
+        [evidencia_nombre, *ref["params"], docs, letras, estados],
+    )
+    # evidencias_detalle solo si materia_id es válido (FK): UPDATE de existentes + INSERT del resto
+    if not materia_id:
+        return 0, 0
+    cur.execute(
+        f"""
+        WITH src AS (
+            SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS t(doc, nombre, letra, estado)
+        ), upd AS (
+            UPDATE evidencias_detalle d
+            SET {ref["detalle_set"]}
+                letra = src.letra,
+                estado = src.estado,
+                materia_id = COALESCE(%s, d.materia_id),
+                ficha_id = COALESCE(%s, d.ficha_id),
+                estudiante_nombre = COALESCE(src.nombre, d.estudiante_nombre),
+                updated_at = CURRENT_TIMESTAMP
+            FROM src
+            WHERE d.estudiante_documento = src.doc AND d.evidencia_nombre = %s AND d.trimestre = 1
+            RETURNING d.estudiante_documento
+        ), ins AS (
+            INSERT INTO evidencias_detalle (
+                materia_id, ficha_id, estudiante_nombre, estudiante_documento,
+                evidencia_nombre, trimestre, letra, estado, observaciones, fecha_carga, cargado_por{ref["col"]}
+            )
+            SELECT %s, %s, src.nombre, src.doc, %s, 1, src.letra, src.estado, NULL, CURRENT_DATE, %s{ref["val"]}
+            FROM src
+            WHERE src.doc NOT IN (SELECT estudiante_documento FROM upd)
+            RETURNING 1
+        )
+        SELECT COUNT(*) AS insertados FROM ins
+        """,
+        [docs, nombres, letras, estados, *ref["params"], materia_id, ficha_id, evidencia_nombre,
+         materia_id, ficha_id, evidencia_nombre, cargado_por, *ref["params"]],
+    )
+    row = cur.fetchone() or {}
+    detalle_inserted = int(row.get("insertados") or 0)
+    return detalle_inserted, len(filas) - detalle_inserted
+
+
+def _write_rows(cur, filas: List[Dict[str, Any]], evidencia_nombre: str, ficha_id: Optional[int],
+                materia_id: Optional[int], cargado_por: Optional[int], errores: List[str],
+                progress: Callable[..., None], definicion_id: Optional[int] = None) -> Tuple[int, int, int]:
+    """Escritura fila a fila (respaldo de _write_batch): un savepoint por estudiante."""
+    ref = _ref_sql(definicion_id, materia_id)
+    inserted = detalle_inserted = detalle_updated = 0
+    total_rows = len(filas)
+    for i, f in enumerate(filas, start=1):
+        if i % 500 == 0:
+            progress("escritura", 20 + 75 * i / total_rows)
+        doc = f["doc"]
+        try:
+            with cur.connection.transaction():
+                execute_hot(
+                    cur, "evidencias_columna.estudiante",
+                    "INSERT INTO estudiantes (documento, nombre, correo) VALUES (%s,%s,%s) ON CONFLICT (documento) DO UPDATE SET nombre=EXCLUDED.nombre, correo=COALESCE(EXCLUDED.correo, estudiantes.correo), updated_at=CURRENT_TIMESTAMP",
+                    [doc, f["nombre"], f["correo"]]
+                )
+                if ficha_id:
+                    execute_hot(
+                        cur, "evidencias_columna.ficha",
+                        "UPDATE estudiantes SET ficha_id=%s WHERE documento=%s AND (ficha_id IS NULL OR ficha_id=0)",
+                        [ficha_id, doc]
+                    )
+                execute_hot(
+                    cur, "evidencias_columna.evidencia",
+                    f"""
+                    INSERT INTO evidencias (documento, evidencia_nombre, letra, estado{ref["col"]}) VALUES (%s,%s,%s,%s{ref["val"]})
+                    ON CONFLICT (documento, evidencia_nombre) DO UPDATE
+                    SET letra = EXCLUDED.letra, estado = EXCLUDED.estado, updated_at = CURRENT_TIMESTAMP{ref["set"]}
+                    """,
+                    [doc, evidencia_nombre, f["letra"], f["estado"], *ref["params"]],
+                )
+                if materia_id:
+                    execute_hot(
+                        cur, "evidencias_columna.detalle_update",
+                        f"""
+                        UPDATE evidencias_detalle
+                        SET {ref["detalle_set"]}
+                            letra = %s,
+                            estado = %s,
+                            materia_id = COALESCE(%s, materia_id),
+                            ficha_id = COALESCE(%s, ficha_id),
+                            estudiante_nombre = COALESCE(%s, estudiante_nombre),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE estudiante_documento = %s AND evidencia_nombre = %s AND trimestre = 1
+                        """,
+                        [*ref["params"], f["letra"], f["estado"], materia_id, ficha_id, f["nombre"], doc, evidencia_nombre],
+                    )
+                    if cur.rowcount == 0:
+                        execute_hot(
+                            cur, "evidencias_columna.detalle_insert",
+                            f"""
+                            INSERT INTO evidencias_detalle (
+                                materia_id, ficha_id, estudiante_nombre, estudiante_documento,
+                                evidencia_nombre, trimestre, letra, estado, observaciones, fecha_carga, cargado_por{ref["col"]}
+                            ) VALUES (%s,%s,%s,%s,%s,1,%s,%s,NULL, CURRENT_DATE, %s{ref["val"]})
+                            """,
+                            [materia_id, ficha_id, f["nombre"], doc, evidencia_nombre, f["letra"], f["estado"], cargado_por,
+                             *ref["params"]],
+                        )
+                        detalle_inserted += 1
+                    else:
+                        detalle_updated += 1
+            inserted += 1
+        except Exception as e:
+            errores.append(f"Error guardando {doc}: {e}")
+    return inserted, detalle_inserted, detalle_updated
+
+
+def _apply_columna(payload: UploadColumnaPayload, progress: Optional[Callable[..., None]] = None, user: Optional[dict] = None):
+    evidencia_nombre = (payload.evidencia_nombre or "").strip()
+    progress = progress or (lambda *a, **k: None)
     inserted = 0
     detalle_updated = 0
     detalle_inserted = 0
@@ -53,148 +294,92 @@ def upload_columna(payload: UploadColumnaPayload, user: dict = Depends(get_curre
                 materia_id_valid = bool(cur.fetchone())
             except Exception:
                 materia_id_valid = False
+        # Recálculos de vincular_definiciones: se hacen junto con los de la carga, al final
+        diferidos = {"documentos": set(), "pares": set()}
         # Asegurar definición de evidencia si materia válida
         if materia_id_valid:
             try:
                 cur.execute(
-                    "INSERT INTO evidencia_definicion (nombre, ficha_id, materia_id, activa, orden) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (materia_id, nombre) DO NOTHING",
+                    "INSERT INTO evidencia_definicion (nombre, ficha_id, materia_id, activa, orden) VALUES (%s,%s,%s,%s,%s) ON CONFLICT (materia_id, nombre) DO NOTHING RETURNING id",
                     [evidencia_nombre, resolved_ficha_id, materia_id, False, 0]
                 )
+                nueva = cur.fetchone()
+                if nueva:
+                    vincular_definiciones(cur, [nueva["id"]], diferidos)
             except Exception:
                 pass
-        # Procesar filas
-        for r in payload.rows:
-            doc = (r.documento or r.correo or "").strip()
-            if not doc:
-                errores.append("Documento vacío en fila")
-                continue
-            # Normalizar antes de validar
-            def normalize_val(v: Optional[str]) -> str:
-                s = (v or "").strip().upper()
-                if s in ("APROBADO", "A PROBADO"):
-                    return "A"
-                if s in ("REPROBADO", "REPROBADA"):
-                    return "D"
-                if s in ("NO ENTREGÓ", "NO ENTREGADO", "NO ENTREGADA", "NO ENTREGO"):
-                    return "-"
-                if s in ("A", "D", "-"):
-                    return s
-                return ""
-            val = normalize_val(r.valor)
-            if val not in allowed:
-                errores.append(f"Valor inválido '{r.valor}' para {doc}")
-                continue
-            # Acumular conteos para historial
-            if val == "":
-                counts["Pendiente"] += 1
-            elif val in ("A", "D", "-"):
-                counts[val] += 1
-            counts["tot_registros"] += 1
-            # Derivar nombre desde 'estudiante' si viene, de lo contrario usar correo como placeholder
-            raw_name = (r.estudiante or "").strip()
-            nombre = raw_name if raw_name else (r.correo or "").strip()
-            estado = "Pendiente" if val == "" else ("Aprobado" if val == "A" else ("Reprobado" if val == "D" else "No entregó"))
-            # Guardar letra original en detalle; tras migración, se admite 'D' también
-            letra_detalle = (val if val != "" else None)
+        # Definición a la que apuntan las filas (FK entera, migrations/004)
+        definicion_id = None
+        if ref_disponible(cur, "evidencias"):
             try:
-                # Asegurar nombre y correo (tabla requiere nombre NOT NULL, correo NOT NULL)
-                cur.execute(
-                    "INSERT INTO estudiantes (documento, nombre, correo) VALUES (%s,%s,%s) ON CONFLICT (documento) DO UPDATE SET nombre=EXCLUDED.nombre, correo=COALESCE(EXCLUDED.correo, estudiantes.correo), updated_at=CURRENT_TIMESTAMP",
-                    [doc, nombre, (r.correo or "").strip()]
-                )
-                # normalize_val definido arriba
-                if resolved_ficha_id:
-                    cur.execute(
-                        "UPDATE estudiantes SET ficha_id=%s WHERE documento=%s AND (ficha_id IS NULL OR ficha_id=0)",
-                        [resolved_ficha_id, doc]
+                if materia_id_valid:
+                    cur.execute("SELECT id FROM evidencia_definicion WHERE materia_id=%s AND nombre=%s", [materia_id, evidencia_nombre])
+                else:
+                    cur.execute(DEFINICION_POR_NOMBRE_SQL.format(nombre="%s", materia="%s"), [evidencia_nombre, None])
+                row = cur.fetchone()
+                definicion_id = row["id"] if row else None
+            except Exception:
+                definicion_id = None
+        # Normalizar en memoria y escribir en bloque (4 sentencias); si el bloque falla se
+        # reintenta fila a fila para reportar el error de cada estudiante como antes
+        filas = _normalize_rows(payload.rows, counts, errores)
+        progress("escritura", 20)
+        cargado_por = user.get("id") if isinstance(user, dict) else None
+        detalle_materia = materia_id if materia_id_valid else None
+        # Pares (ficha, materia) que las filas existentes tenían antes de la carga (rollup diario)
+        previos = set()
+        if detalle_materia:
+            try:
+                with conn.transaction():
+                    previos = pares(
+                        cur, "evidencia_nombre = %s AND trimestre = 1 AND estudiante_documento = ANY(%s)",
+                        [evidencia_nombre, [f["doc"] for f in filas]],
                     )
-                # Actualizar/insertar en tabla base 'evidencias' (resumen por evidencia)
-                val_norm = normalize_val(r.valor)
+            except Exception:
+                previos = set()
+        try:
+            with conn.transaction():
+                detalle_inserted, detalle_updated = _write_batch(
+                    cur, filas, evidencia_nombre, resolved_ficha_id, detalle_materia, cargado_por, definicion_id
+                )
+            inserted = len(filas)
+        except Exception:
+            inserted, detalle_inserted, detalle_updated = _write_rows(
+                cur, filas, evidencia_nombre, resolved_ficha_id, detalle_materia, cargado_por, errores, progress,
+                definicion_id,
+            )
+        # Resumen diario de dashboards (best-effort; ver services/evidencias_resumen.py).
+        # Siempre antes que el rollup: mismo orden de advisory locks en todas las rutas
+        documentos = {(r.documento or r.correo or "").strip() for r in payload.rows} | diferidos["documentos"]
+        try:
+            refresh_documentos(cur, documentos, incluir_sin_ficha=bool(resolved_ficha_id))
+        except Exception:
+            pass
+        # Rollup diario de tendencia-aprobacion (best-effort; ver services/aprobacion_diaria.py)
+        pares_rollup = set(diferidos["pares"])
+        if detalle_materia:
+            # Sin ficha resuelta las filas existentes conservan la suya (COALESCE)
+            fichas = {f for f, _ in previos} | {resolved_ficha_id}
+            pares_rollup |= previos | {(f, detalle_materia) for f in fichas}
+        try:
+            refresh_pares(cur, pares_rollup)
+        except Exception:
+            pass
+        # Caché: fichas de los estudiantes tocados (pueden no ser la de la carga) y de los
+        # pares del rollup; None (no se pudo leer) invalida todas las vistas por ficha
+        fichas_bump = {f for f, _ in pares_rollup if f} | ({resolved_ficha_id} if resolved_ficha_id else set())
+        try:
+            with conn.transaction():
                 cur.execute(
-                    """
-                    UPDATE evidencias
-                    SET letra = %s,
-                        estado = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE documento = %s AND evidencia_nombre = %s
-                    """,
-                    [
-                        (val_norm if val_norm != "" else None),
-                        estado,
-                        doc,
-                        evidencia_nombre,
-                    ],
+                    "SELECT DISTINCT ficha_id FROM estudiantes WHERE documento = ANY(%s) AND ficha_id IS NOT NULL",
+                    [sorted(documentos)],
                 )
-                if cur.rowcount == 0:
-                    cur.execute(
-                        """
-                        INSERT INTO evidencias (
-                            documento, evidencia_nombre, letra, estado
-                        ) VALUES (%s,%s,%s,%s)
-                        """,
-                        [
-                            doc,
-                            evidencia_nombre,
-                            (val_norm if val_norm != "" else None),
-                            estado,
-                        ],
-                    )
-                # Poblar/actualizar evidencias_detalle solo si materia_id es válido para cumplir FK
-                trimestre_val = 1
-                if materia_id_valid:
-                    # Intentar UPDATE primero
-                    cur.execute(
-                    """
-                    UPDATE evidencias_detalle
-                    SET letra = %s,
-                        estado = %s,
-                        observaciones = COALESCE(observaciones, NULL),
-                        materia_id = COALESCE(%s, materia_id),
-                        ficha_id = COALESCE(%s, ficha_id),
-                        estudiante_nombre = COALESCE(%s, estudiante_nombre),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE estudiante_documento = %s AND evidencia_nombre = %s AND trimestre = %s
-                    """,
-                    [
-                        letra_detalle,
-                        estado,
-                        materia_id,
-                        payload.ficha_id,
-                        nombre,
-                        doc,
-                        evidencia_nombre,
-                        trimestre_val,
-                    ],
-                    )
-                    if cur.rowcount == 0:
-                        # No existía -> INSERT
-                        cur.execute(
-                        """
-                        INSERT INTO evidencias_detalle (
-                            materia_id, ficha_id, estudiante_nombre, estudiante_documento,
-                            evidencia_nombre, trimestre, letra, estado, observaciones, fecha_carga, cargado_por
-                        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s, CURRENT_DATE, %s)
-                        """,
-                        [
-                            materia_id,
-                            payload.ficha_id,
-                            nombre,
-                            doc,
-                            evidencia_nombre,
-                            trimestre_val,
-                            letra_detalle,
-                            estado,
-                            None,
-                            (user.get("id") if isinstance(user, dict) else None),
-                        ],
-                        )
-                        detalle_inserted += 1
-                    else:
-                        detalle_updated += 1
-                inserted += 1
-            except Exception as e:
-                errores.append(f"Error guardando {doc}: {e}")
+                fichas_bump |= {r["ficha_id"] for r in cur.fetchall() or []}
+        except Exception:
+            fichas_bump = None
+        materias_bump = {m for _, m in pares_rollup if m} if detalle_materia else None
         conn.commit()
+        bump_data_version(fichas=fichas_bump, materias=materias_bump)
         # Registrar auditoría persistente del upload por columna
         try:
             ficha_numero_val = None
@@ -206,32 +391,25 @@ def upload_columna(payload: UploadColumnaPayload, user: dict = Depends(get_curre
                         ficha_numero_val = row.get("numero")
                 except Exception:
                     ficha_numero_val = None
-            cur.execute(
-                """
-                INSERT INTO audit_logs (user_id, user_email, user_rol, accion, modulo, entidad_tipo, entidad_id, detalles, metadata)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """,
-                [
-                    user.get("id") if isinstance(user, dict) else None,
-                    user.get("email") if isinstance(user, dict) else None,
-                    user.get("rol") if isinstance(user, dict) else None,
-                    "upload",  # usar mismo accion que wide para unificar historial
-                    "evidencias",
-                    "ficha",
-                    resolved_ficha_id,
-                    f"Carga por columna '{evidencia_nombre}'. Registros: {counts['tot_registros']}",
-                    {
-                        "modo": "single-column",
-                        "evidencia_nombre": evidencia_nombre,
-                        "ficha_numero": ficha_numero_val,
-                        "ficha_id": resolved_ficha_id,
-                        "materia_id": materia_id if materia_id_valid else None,
-                        "counts": counts,
-                        "insertados": inserted,
-                    },
-                ]
+            record_event(
+                accion="upload",  # usar mismo accion que wide para unificar historial
+                user_id=user.get("id") if isinstance(user, dict) else None,
+                user_email=user.get("email") if isinstance(user, dict) else None,
+                user_rol=user.get("rol") if isinstance(user, dict) else None,
+                modulo="evidencias",
+                entidad_tipo="ficha",
+                entidad_id=resolved_ficha_id,
+                detalles=f"Carga por columna '{evidencia_nombre}'. Registros: {counts['tot_registros']}",
+                metadata={
+                    "modo": "single-column",
+                    "evidencia_nombre": evidencia_nombre,
+                    "ficha_numero": ficha_numero_val,
+                    "ficha_id": resolved_ficha_id,
+                    "materia_id": materia_id if materia_id_valid else None,
+                    "counts": counts,
+                    "insertados": inserted,
+                },
             )
-            conn.commit()  # asegurar persistencia del log
         except Exception:
             # No bloquear por auditoría
             pass
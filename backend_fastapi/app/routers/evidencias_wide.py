@@ -1,11 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Depends, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Depends, Form, Response
 from psycopg.rows import dict_row
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
+from functools import partial
 import pandas as pd
 import io
+import os
 from ..db import get_conn
 from ..security import get_current_user_claims
-from math import ceil
+from ..cache import bump_data_version
+from ..services.wide_ingest import ingest_wide, create_wide_staging, append_staging, STAGING_TABLE
+from ..services.evidencias_resumen import por_evidencia
+from ..services.upload_jobs import submit_job, accepted_payload, list_open_jobs
+from ..utils.excel_stream import iter_excel_batches, ExcelTooLarge, spool_to_tempfile, remove_quietly
+from ..utils.export_stream import open_export, export_response, FORMAT_PATTERN
+from ..utils.pagination import Keyset, count_total, pagination_meta, resolve_total_mode, TOTAL_PATTERN
+from ..utils.search import search_filter, search_info, trgm_disponible, trgm_indexado
+from ..utils.audit import record_event
 
 router = APIRouter(prefix="/api/v1/evidencias-wide", tags=["evidencias-wide"])
 
@@ -79,23 +89,95 @@ def _truncate(s: Optional[str], max_len: int = 255) -> Optional[str]:
         return s
     return s[:max_len]
 
-def _process_wide(
-    file: UploadFile = File(...),
-    dryRun: bool = Query(False, description="Si true valida sin escribir"),
-    ficha_id: int = Form(0),
-    ficha_numero: Optional[str] = Form(None),
-    materia_id: int = Form(0),
-    docente_id: int = Form(0),
-    _: dict = Depends(get_current_user_claims),
-):
-    if not file.filename.lower().endswith((".xlsx", ".xls")):
+def evidencia_nombre_from_col(col: str) -> str:
+    return col.replace("(letra)", "").strip().replace("  ", " ")
+
+
+def melt_wide(df: pd.DataFrame, id_map: Dict[str, str], evidencia_cols: List[str]):
+    """Convierte la hoja wide a registros largos (estudiante x evidencia) de forma columnar.
+
+    Retorna (registros, preview_students, errores, counts) en el mismo orden que el
+    recorrido fila por fila: registros y errores ordenados por (fila, columna).
+    """
+    n = len(df)
+    filas = (df.index.to_numpy() + 2).tolist()
+    cor = df[id_map["correo"]].astype(str).str.strip()
+    nom = df[id_map["nombre"]].astype(str).str.strip()
+    ape = df[id_map["apellido"]].astype(str).str.strip() if "apellido" in id_map else pd.Series([""] * n, index=df.index)
+    doc_ok = (cor != "").to_numpy()
+
+    # (posición fila, posición columna, mensaje); columna -1 = error a nivel de fila
+    err_items = [(pos, -1, f"Fila {filas[pos]}: documento vacío") for pos in range(n) if not doc_ok[pos]]
+
+    preview_students = []  # primeras muestras de identidad para dryRun
+    for pos in [p for p in range(n) if doc_ok[p]][:5]:
+        preview_students.append({"documento": cor.iat[pos], "nombre": nom.iat[pos], "apellido": ape.iat[pos], "correo": cor.iat[pos]})
+
+    # Normalización vectorizada de letras y formato largo con melt
+    letras = pd.DataFrame(
+        {j: df[col].astype(str).str.strip().str.upper().to_numpy() for j, col in enumerate(evidencia_cols)}
+    )
+    letras["_pos"] = range(n)
+    letras = letras[doc_ok]
+    long = letras.melt(id_vars="_pos", var_name="_col", value_name="raw")
+    long = long.sort_values(["_pos", "_col"], kind="stable")
+    valid = long["raw"].isin(VALID_LETTERS)
+
+    invalid = long[~valid]
+    err_items.extend(
+        (pos, j, f"Fila {filas[pos]} Col '{evidencia_cols[j]}': valor inválido '{raw}' (permitido A,D,-, vacío)")
+        for pos, j, raw in zip(invalid["_pos"].tolist(), invalid["_col"].tolist(), invalid["raw"].tolist())
+    )
+    err_items.sort(key=lambda t: (t[0], t[1]))
+    errores: List[str] = [msg for _, _, msg in err_items]
+
+    ok = long[valid]
+    evid_names = [evidencia_nombre_from_col(c) for c in evidencia_cols]
+    estados = {l: derive_estado(l) for l in VALID_LETTERS}
+    cor_l, nom_l, ape_l = cor.tolist(), nom.tolist(), ape.tolist()
+    registros = [
+        {
+            "fila": filas[pos],
+            "documento": cor_l[pos],
+            "nombre": nom_l[pos],
+            "apellido": ape_l[pos],
+            "correo": cor_l[pos],
+            "evidencia": evid_names[j],
+            "letra": raw if raw != "" else None,
+            "estado": estados[raw],
+        }
+        for pos, j, raw in zip(ok["_pos"].tolist(), ok["_col"].tolist(), ok["raw"].tolist())
+    ]
+
+    vc = ok["raw"].value_counts()
+    counts = {
+        "A": int(vc.get("A", 0)),
+        "D": int(vc.get("D", 0)),
+        "-": int(vc.get("-", 0)),
+        "Pendiente": int(vc.get("", 0)),
+        "tot_registros": int(len(ok)),
+    }
+    return registros, preview_students, errores, counts
+
+
+def parse_wide(source, filename: str) -> Dict:
+    """Parseo puro (sin BD) de los encabezados de la hoja wide. Serializable para correr en el pool de procesos.
+
+    `source` es una ruta o un archivo abierto; la detección de columnas de identidad
+    se hace sobre el primer lote. Las filas se leen después, lote a lote, en _iter_wide.
+    """
+    if not filename.lower().endswith((".xlsx", ".xls")):
         raise HTTPException(status_code=400, detail="Formato inválido, use .xlsx/.xls")
-    content = file.file.read()
+    batches = iter_excel_batches(source, filename)
     try:
-        df = pd.read_excel(io.BytesIO(content))
+        df = next(batches, None)
+    except ExcelTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
-    if df.empty:
+    finally:
+        batches.close()
+    if df is None or df.empty:
         raise HTTPException(status_code=400, detail="Archivo vacío")
 
     # Normalizar headers
@@ -113,11 +195,10 @@ def _process_wide(
             series = df[col].astype(str).str.strip().str.upper()
         except Exception:
             return False
-        non_empty = [v for v in series if v != ""]
-        if not non_empty:
+        non_empty = series[series != ""]
+        if non_empty.empty:
             return False
-        letter_like = sum(1 for v in non_empty if v in VALID_LETTERS)
-        return (letter_like / len(non_empty)) > 0.8
+        return float(non_empty.isin(VALID_LETTERS).mean()) > 0.8
 
     for k in list(id_map.keys()):
         if k in id_map and mostly_letters(id_map[k]):
@@ -129,52 +210,54 @@ def _process_wide(
         raise HTTPException(status_code=400, detail="Columnas identificadoras faltantes (requiere correo y nombre): " + ", ".join(core_missing) + ". Columnas disponibles normalizadas: " + ", ".join(lower_cols))
     # Forzar documento = correo (cedula ignorada aunque exista)
     id_map["documento"] = id_map["correo"]
-    cedula_ignorada = True
 
     # Detectar evidencias: columnas que contienen '(letra)' tras normalizar
     evidencia_cols = [c for c in lower_cols if "(letra)" in c]
     if not evidencia_cols:
         raise HTTPException(status_code=400, detail="No se encontraron columnas de evidencias '(Letra)'. Columnas vistas: " + ", ".join(lower_cols))
 
-    registros = []
-    preview_students = []  # primeras muestras de identidad para dryRun
+    return {
+        "source": source,
+        "filename": filename,
+        "normalized_map": normalized_map,
+        "id_map": id_map,
+        "evidencia_cols": evidencia_cols,
+    }
+
+
+def _iter_wide(parsed: Dict):
+    """Lotes de la hoja ya en formato largo: (registros, preview_students, errores, counts) por lote."""
+    try:
+        for batch in iter_excel_batches(parsed["source"], parsed["filename"]):
+            batch = batch.rename(columns=parsed["normalized_map"])
+            yield melt_wide(batch, parsed["id_map"], parsed["evidencia_cols"])
+    except ExcelTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error leyendo Excel: {e}")
+
+
+def _apply_wide(
+    parsed: Dict,
+    progress: Optional[Callable[..., None]] = None,
+    dryRun: bool = False,
+    ficha_id: int = 0,
+    ficha_numero: Optional[str] = None,
+    materia_id: int = 0,
+    docente_id: int = 0,
+    _: Optional[dict] = None,
+):
+    id_map = parsed["id_map"]
+    evidencia_cols = parsed["evidencia_cols"]
+    # Las filas se procesan lote a lote: en memoria quedan solo contadores, errores y la vista previa
+    preview_students: List[Dict] = []
     errores: List[str] = []
-    counts = {"A":0, "D":0, "-":0, "Pendiente":0, "tot_registros":0}
-
-    for idx, row in df.iterrows():
-        cor = str(row[id_map["correo"]]).strip()
-        nom = str(row[id_map["nombre"]]).strip()
-        ape = str(row[id_map.get("apellido", "")]).strip() if "apellido" in id_map else ""
-        doc = cor  # documento forzado al correo
-        if not doc:
-            errores.append(f"Fila {idx+2}: documento vacío")
-            continue
-        # Guardar preview identidad (sin evidencias) hasta 5 ejemplos
-        if len(preview_students) < 5:
-            preview_students.append({"documento": doc, "nombre": nom, "apellido": ape, "correo": cor})
-        for col in evidencia_cols:
-            raw = str(row[col]).strip().upper()
-            letra = raw if raw in VALID_LETTERS else ("" if raw == "" else None)
-            if letra is None:
-                errores.append(f"Fila {idx+2} Col '{col}': valor inválido '{raw}' (permitido A,D,-, vacío)")
-                continue
-            evidencia_nombre = col.replace("(letra)", "").strip().replace("  ", " ")
-            estado = derive_estado(letra)
-            registros.append({
-                "documento": doc,
-                "nombre": nom,
-                "apellido": ape,
-                "correo": cor,
-                "evidencia": evidencia_nombre,
-                "letra": letra if letra != "" else None,
-                "estado": estado,
-            })
-            if letra == "":
-                counts["Pendiente"] += 1
-            elif letra in ("A","D","-"):
-                counts[letra] += 1
-            counts["tot_registros"] += 1
-        
+    counts = {"A": 0, "D": 0, "-": 0, "Pendiente": 0, "tot_registros": 0}
+    cedula_ignorada = True
+    progress = progress or (lambda *a, **k: None)
+
     # Resolver ficha: DEBE existir y ser proporcionada; no se crea automáticamente.
     resolved_ficha_id = ficha_id
     created_ficha = False
@@ -208,15 +291,30 @@ def _process_wide(
         return False
 
     invalid_docs = set()
-    for r in registros:
-        if _doc_invalido(r.get("documento")):
-            invalid_docs.add(r.get("documento") or "<vacío>")
-    if invalid_docs:
-        errores.append("Documentos inválidos detectados: " + ", ".join(sorted(invalid_docs)))
+
+    def _acumular(lote) -> List[Dict]:
+        """Suma el lote a contadores/errores/vista previa y retorna sus registros con documento válido."""
+        b_reg, b_prev, b_err, b_counts = lote
+        errores.extend(b_err)
+        preview_students.extend(b_prev[:max(0, 5 - len(preview_students))])
+        for k, v in b_counts.items():
+            counts[k] += v
+        for r in b_reg:
+            if _doc_invalido(r.get("documento")):
+                invalid_docs.add(r.get("documento") or "<vacío>")
+        if not invalid_docs:
+            return b_reg
         # Filtrar fuera los registros con documento inválido para no intentar insertar
-        registros = [r for r in registros if not _doc_invalido(r.get("documento"))]
+        return [r for r in b_reg if not _doc_invalido(r.get("documento"))]
+
+    def _cerrar_errores() -> None:
+        if invalid_docs:
+            errores.append("Documentos inválidos detectados: " + ", ".join(sorted(invalid_docs)))
 
     if dryRun:
+        for lote in _iter_wide(parsed):
+            _acumular(lote)
+        _cerrar_errores()
         # Respuesta enriquecida para diagnóstico
         return {
             "success": len(errores)==0,
@@ -242,216 +340,92 @@ def _process_wide(
                 materia_id_valid = bool(_curs.fetchone())
         except Exception:
             materia_id_valid = False
-        if not materia_id_valid:
-            errores.append(f"Materia especificada (id={materia_id}) no existe; se omite la creación de definiciones de evidencias para evitar errores de clave foránea.")
 
-    if registros:
-        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+    cargados = 0
+    rechazados = 0
+    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        # Cada lote se valida y se copia a staging al llegar; el merge se hace al final
+        try:
+            create_wide_staging(cur)
+            for lote in _iter_wide(parsed):
+                registros = _acumular(lote)
+                progress("staging", 20, lote[2])
+                if registros:
+                    cargados += append_staging(cur, registros, seq_start=cargados)
+        except HTTPException:
+            conn.rollback()
+            raise
+        except Exception as e:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=f"Error guardando registros (stage=staging): {e}")
+        _cerrar_errores()
+        if materia_id > 0 and not materia_id_valid:
+            errores.append(f"Materia especificada (id={materia_id}) no existe; se omite la creación de definiciones de evidencias para evitar errores de clave foránea.")
+        if not cargados:
+            conn.rollback()
+        else:
             try:
                 # Validación: detectar estudiantes ya asociados a otra ficha distinta
                 if resolved_ficha_id > 0:
                     try:
-                        documentos = list({r["documento"] for r in registros})
-                        if documentos:
+                        with conn.transaction():
                             cur.execute(
-                                """
-                                SELECT documento, ficha_id FROM estudiantes
-                                WHERE documento = ANY(%s) AND ficha_id IS NOT NULL AND ficha_id <> %s
+                                f"""
+                                SELECT DISTINCT e.documento, e.ficha_id FROM estudiantes e
+                                JOIN {STAGING_TABLE} s ON s.documento = e.documento
+                                WHERE e.ficha_id IS NOT NULL AND e.ficha_id <> %s
                                 """,
-                                [documentos, resolved_ficha_id]
+                                [resolved_ficha_id]
                             )
                             conflicts = cur.fetchall() or []
-                            if conflicts:
-                                detalles = [f"{row['documento']} (ficha_id={row['ficha_id']})" for row in conflicts]
-                                raise HTTPException(status_code=400, detail="Conflictos de ficha: algunos estudiantes ya pertenecen a otra ficha. "
-                                                                            + "Registros: " + ", ".join(detalles))
+                        if conflicts:
+                            detalles = [f"{row['documento']} (ficha_id={row['ficha_id']})" for row in conflicts]
+                            raise HTTPException(status_code=400, detail="Conflictos de ficha: algunos estudiantes ya pertenecen a otra ficha. "
+                                                                        + "Registros: " + ", ".join(detalles))
                     except HTTPException:
                         raise
                     except Exception:
                         # Si la validación falla por error técnico, continuar sin bloquear
                         pass
 
-                # asegurar definiciones de evidencias (creación pasiva inactivas)
-                # calcular orden base existente por materia
-                if materia_id_valid:
-                    try:
-                        cur.execute("SELECT COUNT(*) AS cnt FROM evidencia_definicion WHERE materia_id=%s", [materia_id])
-                        row_cnt = cur.fetchone() or {}
-                        base_count = int(row_cnt.get("cnt", 0))
-                    except Exception:
-                        base_count = 0
-                else:
-                    base_count = 0
-                def_cache = set()
-                for r in registros:
-                    # Aislar errores por registro con SAVEPOINT
-                    try:
-                        cur.execute("SAVEPOINT sp_reg")
-                    except Exception:
-                        pass
-                    nombre_evid = r["evidencia"]
-                    if materia_id_valid and nombre_evid not in def_cache:
-                        try:
-                            stage = "evidencia_def_select"
-                            cur.execute(
-                                "SELECT id FROM evidencia_definicion WHERE materia_id=%s AND nombre=%s",
-                                [materia_id, nombre_evid]
-                            )
-                            found = cur.fetchone()
-                            if not found:
-                                cur.execute(
-                                    """
-                                    INSERT INTO evidencia_definicion (nombre, ficha_id, materia_id, docente_id, activa, orden)
-                                    VALUES (%s,%s,%s,%s,%s,%s)
-                                    ON CONFLICT (materia_id, nombre) DO NOTHING
-                                    """,
-                                    [nombre_evid, resolved_ficha_id if resolved_ficha_id>0 else None, materia_id, docente_id if docente_id>0 else None, False, base_count]
-                                )
-                                base_count += 1
-                            def_cache.add(nombre_evid)
-                        except Exception as e_def:
-                            # Revertir cambios de este registro y continuar con siguiente
-                            try:
-                                cur.execute("ROLLBACK TO SAVEPOINT sp_reg")
-                            except Exception:
-                                pass
-                            errores.append(f"Advertencia al asegurar definición '{nombre_evid}': {e_def}")
-                            try:
-                                cur.execute("RELEASE SAVEPOINT sp_reg")
-                            except Exception:
-                                pass
-                            continue
-                    # Actualización de correo si coincide nombre+apellido con un estudiante existente
-                    try:
-                        stage = "heuristica_update_correo_select"
-                        cur.execute(
-                            "SELECT documento FROM estudiantes WHERE LOWER(nombre)=LOWER(%s) AND LOWER(apellido)=LOWER(%s) LIMIT 2",
-                            [r["nombre"], r["apellido"]]
-                        )
-                        matches = cur.fetchall() or []
-                        if len(matches) == 1:
-                            old_doc = matches[0]["documento"]
-                            new_doc = r["documento"]
-                            if old_doc != new_doc:
-                                # Verificar que el nuevo correo no existe ya como documento
-                                stage = "heuristica_update_correo_exists_new"
-                                cur.execute("SELECT 1 FROM estudiantes WHERE documento=%s", [new_doc])
-                                exists_new = cur.fetchone()
-                                if not exists_new:
-                                    # Migrar evidencias al nuevo documento y actualizar estudiante
-                                    stage = "heuristica_update_correo_update_evidencias"
-                                    cur.execute(
-                                        "UPDATE evidencias SET documento=%s, updated_at=CURRENT_TIMESTAMP WHERE documento=%s",
-                                        [new_doc, old_doc]
-                                    )
-                                    stage = "heuristica_update_correo_update_estudiante"
-                                    cur.execute(
-                                        "UPDATE estudiantes SET documento=%s, correo=%s, updated_at=CURRENT_TIMESTAMP WHERE documento=%s",
-                                        [new_doc, new_doc, old_doc]
-                                    )
-                    except Exception as e_h:
-                        # Revertir solo cambios de este registro y continuar
-                        try:
-                            cur.execute("ROLLBACK TO SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        errores.append(f"Advertencia heurística de correo para '{r['documento']}': {e_h}")
-                        try:
-                            cur.execute("RELEASE SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        continue
-                    # Insertar estudiante si no existe (después de posible migración)
-                    stage = "insert_estudiante"
-                    try:
-                        cur.execute(
-                            "INSERT INTO estudiantes (documento, nombre, apellido, correo) VALUES (%s,%s,%s,%s) ON CONFLICT (documento) DO NOTHING",
-                            [
-                                _truncate(r["documento"]),
-                                _truncate(r["nombre"]),
-                                _truncate(r.get("apellido", "")),
-                                _truncate(r.get("correo", None)),
-                            ]
-                        )
-                    except Exception as e_ins:
-                        try:
-                            cur.execute("ROLLBACK TO SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        errores.append(f"Fallo al insertar estudiante documento={r['documento']}: {e_ins}")
-                        try:
-                            cur.execute("RELEASE SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        continue
-                    # Asociar ficha si existe ficha resuelta y estudiante sin ficha
-                    if resolved_ficha_id > 0:
-                        # Solo asignar si el estudiante no tiene ficha; nunca reemplazar ficha existente distinta.
-                        try:
-                            stage = "update_estudiante_set_ficha"
-                            cur.execute(
-                                "UPDATE estudiantes SET ficha_id=%s WHERE documento=%s AND (ficha_id IS NULL OR ficha_id=0)",
-                                [resolved_ficha_id, r["documento"]]
-                            )
-                        except Exception:
-                            pass
-                    # Upsert evidencia (actualiza calificación siempre)
-                    stage = "upsert_evidencia"
-                    try:
-                        cur.execute(
-                            "INSERT INTO evidencias (documento, evidencia_nombre, letra, estado) VALUES (%s,%s,%s,%s) ON CONFLICT (documento, evidencia_nombre) DO UPDATE SET letra=EXCLUDED.letra, estado=EXCLUDED.estado, updated_at=CURRENT_TIMESTAMP",
-                            [
-                                _truncate(r["documento"]),
-                                _truncate(r["evidencia"], 255),
-                                r["letra"],
-                                r["estado"],
-                            ]
-                        )
-                        try:
-                            cur.execute("RELEASE SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                    except Exception as e_up:
-                        try:
-                            cur.execute("ROLLBACK TO SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        errores.append(f"Fallo al guardar evidencia '{nombre_evid}' para {r['documento']}: {e_up}")
-                        try:
-                            cur.execute("RELEASE SAVEPOINT sp_reg")
-                        except Exception:
-                            pass
-                        continue
+                # Ingesta set-based: staging ya cargada + INSERT ... SELECT por tabla destino.
+                # Los rechazos (restricciones violadas) se reportan por fila desde staging.
+                stage = "ingesta_bulk"
+                progress("ingesta", 30)
+                result = ingest_wide(
+                    cur,
+                    None,
+                    ficha_id=resolved_ficha_id if resolved_ficha_id > 0 else None,
+                    materia_id=materia_id if materia_id_valid else None,
+                    docente_id=docente_id if docente_id > 0 else None,
+                )
+                errores.extend(result["errores"])
+                rechazados = result["stats"].get("rechazados", 0)
                 conn.commit()
-                # Registrar auditoría persistente del upload
-                try:
-                    cur.execute(
-                        """
-                        INSERT INTO audit_logs (user_id, user_email, user_rol, accion, modulo, entidad_tipo, entidad_id, detalles, metadata)
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        """,
-                        [
-                            _["id"] if isinstance(_, dict) and _ and "id" in _ else None,
-                            _["email"] if isinstance(_, dict) and _ and "email" in _ else None,
-                            _["rol"] if isinstance(_, dict) and _ and "rol" in _ else None,
-                            "upload",
-                            "evidencias",
-                            "ficha",
-                            resolved_ficha_id if resolved_ficha_id>0 else None,
-                            f"Carga de evidencias wide. Registros: {len(registros)}",
-                            {
-                                "ficha_numero": ficha_numero_norm or None,
-                                "ficha_id": resolved_ficha_id if resolved_ficha_id>0 else None,
-                                "materia_id": materia_id,
-                                "docente_id": docente_id if docente_id>0 else None,
-                                "counts": counts,
-                            },
-                        ]
-                    )
-                    conn.commit()  # asegurar persistencia del log
-                except Exception:
-                    # No bloquear por auditoría
-                    pass
+                bump_data_version(
+                    fichas=resolved_ficha_id if resolved_ficha_id > 0 else None,
+                    materias=materia_id if materia_id_valid else None,
+                )
+                progress("auditoria", 90)
+                # Registrar auditoría persistente del upload (cola de auditoría, sin commit extra)
+                claims = _ if isinstance(_, dict) else {}
+                record_event(
+                    accion="upload",
+                    user_id=claims.get("id"),
+                    user_email=claims.get("email"),
+                    user_rol=claims.get("rol"),
+                    modulo="evidencias",
+                    entidad_tipo="ficha",
+                    entidad_id=resolved_ficha_id if resolved_ficha_id > 0 else None,
+                    detalles=f"Carga de evidencias wide. Registros: {cargados}",
+                    metadata={
+                        "ficha_numero": ficha_numero_norm or None,
+                        "ficha_id": resolved_ficha_id if resolved_ficha_id > 0 else None,
+                        "materia_id": materia_id,
+                        "docente_id": docente_id if docente_id > 0 else None,
+                        "counts": counts,
+                    },
+                )
             except Exception as e:
                 conn.rollback()
                 # Propagar mensaje enriquecido si stage disponible
@@ -460,7 +434,7 @@ def _process_wide(
                 raise HTTPException(status_code=400, detail=f"Error guardando registros: {e}")
     return {
         "success": len(errores)==0,
-        "insertados_actualizados": len(registros),
+        "insertados_actualizados": cargados - rechazados,
         "errores": errores[:50],
         "counts": counts,
         "ficha_id": resolved_ficha_id if resolved_ficha_id>0 else None,
@@ -468,27 +442,66 @@ def _process_wide(
         "ficha_creada": created_ficha,
     }
 
+def _process_wide(
+    file: UploadFile,
+    dryRun: bool = False,
+    ficha_id: int = 0,
+    ficha_numero: Optional[str] = None,
+    materia_id: int = 0,
+    docente_id: int = 0,
+    _: Optional[dict] = None,
+):
+    parsed = parse_wide(file.file, file.filename)
+    return _apply_wide(parsed, None, dryRun=dryRun, ficha_id=ficha_id, ficha_numero=ficha_numero, materia_id=materia_id, docente_id=docente_id, _=_)
+
+
+def _submit_wide(file: UploadFile, response: Response, user: dict, dryRun: bool, ficha_id: int, ficha_numero: Optional[str], materia_id: int, docente_id: int):
+    if not file.filename.lower().endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=400, detail="Formato inválido, use .xlsx/.xls")
+    path = spool_to_tempfile(file.file, suffix=os.path.splitext(file.filename)[1].lower())
+    job = submit_job(
+        "evidencias_wide",
+        user,
+        partial(_apply_wide, dryRun=dryRun, ficha_id=ficha_id, ficha_numero=ficha_numero, materia_id=materia_id, docente_id=docente_id, _=user),
+        parse_fn=parse_wide,
+        parse_args=(path, file.filename),
+        cleanup=partial(remove_quietly, path),
+        filename=file.filename,
+        parametros={"ficha_id": ficha_id or None, "ficha_numero": ficha_numero, "materia_id": materia_id or None, "docente_id": docente_id or None, "dryRun": dryRun},
+    )
+    response.status_code = 202
+    return accepted_payload(job)
+
+
 @router.post("/upload-wide")
 def upload_wide(
+    response: Response,
     file: UploadFile = File(...),
     dryRun: bool = Query(False, description="Si true valida sin escribir"),
+    background: bool = Query(False, description="Si true encola la carga y retorna un id de trabajo (ver /api/v1/uploads/{id})"),
     ficha_id: int = Form(0),
     ficha_numero: Optional[str] = Form(None),
     materia_id: int = Form(0),
     docente_id: int = Form(0),
     user: dict = Depends(get_current_user_claims)
 ):
+    if background:
+        return _submit_wide(file, response, user, dryRun, ficha_id, ficha_numero, materia_id, docente_id)
     return _process_wide(file=file, dryRun=dryRun, ficha_id=ficha_id, ficha_numero=ficha_numero, materia_id=materia_id, docente_id=docente_id, _=user)
 
 @router.post("/upload")
 def upload_frontend(
+    response: Response,
     file: UploadFile = File(...),
+    background: bool = Query(False, description="Si true encola la carga y retorna un id de trabajo (ver /api/v1/uploads/{id})"),
     ficha_id: int = Form(0),
     ficha_numero: Optional[str] = Form(None),
     materia_id: int = Form(0),
     docente_id: int = Form(0),
     user: dict = Depends(get_current_user_claims)
 ):
+    if background:
+        return _submit_wide(file, response, user, False, ficha_id, ficha_numero, materia_id, docente_id)
     result = _process_wide(file=file, dryRun=False, ficha_id=ficha_id, ficha_numero=ficha_numero, materia_id=materia_id, docente_id=docente_id, _=user)
     # Normalizar payload (cuando no es dryRun retorna estructura distinta)
     if "insertados_actualizados" in result:
@@ -503,6 +516,11 @@ def upload_frontend(
         }
     return result
 
+_KEYSET = Keyset("evidencias_wide", [
+    ("e.documento", "documento", "text"),
+    ("e.evidencia_nombre", "evidencia_nombre", "text"),
+])
+
 @router.get("")
 def list_evidencias_wide(
     page: int = Query(1, ge=1),
@@ -511,16 +529,21 @@ def list_evidencias_wide(
     evidencia: Optional[str] = Query(None),
     letra: Optional[str] = Query(None),
     estado: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío = primera página; luego nextCursor"),
+    total: Optional[str] = Query(None, pattern=TOTAL_PATTERN),
 ):
     offset = (page-1)*pageSize
+    after = _KEYSET.decode(cursor)
+    total_mode = resolve_total_mode(total, cursor)
     filters: List[str] = []
     params: List = []
     if documento:
         filters.append("e.documento = %s")
         params.append(documento)
-    if evidencia:
-        filters.append("e.evidencia_nombre ILIKE %s")
-        params.append(f"%{evidencia}%")
+    if evidencia and evidencia.strip():
+        search_sql, search_params = search_filter(["e.evidencia_nombre"], evidencia)
+        filters.append(search_sql)
+        params.extend(search_params)
     if letra:
         filters.append("e.letra = %s")
         params.append(letra)
@@ -529,45 +552,134 @@ def list_evidencias_wide(
         params.append(estado)
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
 
-    sql = f"SELECT e.id, e.documento, s.nombre, s.apellido, s.correo, e.evidencia_nombre, e.letra, e.estado, e.created_at, e.updated_at FROM evidencias e JOIN estudiantes s ON s.documento = e.documento {where_clause} ORDER BY e.documento, e.evidencia_nombre LIMIT %s OFFSET %s"
-    count_sql = f"SELECT COUNT(*) AS total FROM evidencias e {where_clause}"
+    seek_sql, seek_params = _KEYSET.seek(after)
+    items_filters = filters + ([seek_sql] if seek_sql else [])
+    items_where = f"WHERE {' AND '.join(items_filters)}" if items_filters else ""
+    limit_sql = "LIMIT %s" if cursor is not None else "LIMIT %s OFFSET %s"
+    page_params = [pageSize + 1] if cursor is not None else [pageSize, offset]
+    sql = f"SELECT e.id, e.documento, s.nombre, s.apellido, s.correo, e.evidencia_nombre, e.letra, e.estado, e.created_at, e.updated_at FROM evidencias e JOIN estudiantes s ON s.documento = e.documento {items_where} ORDER BY {_KEYSET.order_by()} {limit_sql}"
+    next_cursor = None
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(count_sql, params)
-        total_row = cur.fetchone()
-        total = int(total_row['total']) if total_row else 0
-        cur.execute(sql, [*params, pageSize, offset])
+        indexado = trgm_disponible(cur) and trgm_indexado(cur, "evidencias", ["evidencia_nombre"]) if evidencia else False
+        total_count, exact = count_total(cur, "evidencias e", where_clause, params, total_mode, "evidencias")
+        cur.execute(sql, [*params, *seek_params, *page_params])
         rows = cur.fetchall() or []
-    return {"success": True, "data": rows, "pagination": {"page": page, "pageSize": pageSize, "total": total, "totalPages": ceil(total/pageSize) if pageSize else 0}}
+    if cursor is not None:
+        rows, next_cursor = _KEYSET.page(rows, pageSize)
+    return {"success": True, "data": rows, "pagination": pagination_meta(page, pageSize, total_count, total_mode, exact, next_cursor, cursor is not None), "search": search_info(evidencia, indexado)}
 
 @router.get("/stats")
 def stats_evidencias():
+    by_evidence = None
+    try:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            by_evidence = por_evidencia(cur, solo_activas=False)
+    except Exception:
+        by_evidence = None
     sql = "SELECT evidencia_nombre, COUNT(*) total, SUM(CASE WHEN letra='A' THEN 1 ELSE 0 END) aprobadas, SUM(CASE WHEN letra='D' THEN 1 ELSE 0 END) reprobadas, SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) no_entrego, SUM(CASE WHEN letra IS NULL THEN 1 ELSE 0 END) pendientes FROM evidencias GROUP BY evidencia_nombre ORDER BY evidencia_nombre"
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(sql)
-        by_evidence = cur.fetchall() or []
+    if by_evidence is None:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(sql)
+            by_evidence = cur.fetchall() or []
     sql2 = "SELECT documento, COUNT(*) total, SUM(CASE WHEN letra='A' THEN 1 ELSE 0 END) aprobadas, SUM(CASE WHEN letra='D' THEN 1 ELSE 0 END) reprobadas, SUM(CASE WHEN letra='-' THEN 1 ELSE 0 END) no_entrego, SUM(CASE WHEN letra IS NULL THEN 1 ELSE 0 END) pendientes FROM evidencias GROUP BY documento ORDER BY documento"
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
         cur.execute(sql2)
         by_student = cur.fetchall() or []
     return {"success": True, "by_evidence": by_evidence, "by_student": by_student}
 
+def _wide_export_evidencias(cur, ficha_id: Optional[int], materia_id: Optional[int]) -> List[str]:
+    """Columnas de evidencia del export wide, en el orden de evidencia_definicion.orden."""
+    conds: List[str] = []
+    params: List = []
+    if materia_id:
+        conds.append("materia_id = %s")
+        params.append(materia_id)
+    if ficha_id:
+        # Con materia se aceptan también definiciones generales (sin ficha)
+        conds.append("(ficha_id = %s OR ficha_id IS NULL)" if materia_id else "ficha_id = %s")
+        params.append(ficha_id)
+    cur.execute(
+        f"""
+        SELECT nombre FROM (
+            SELECT nombre, MIN(orden) AS orden, MIN(id) AS id
+            FROM evidencia_definicion
+            WHERE {' AND '.join(conds)}
+            GROUP BY nombre
+        ) d
+        ORDER BY d.orden NULLS LAST, d.id
+        """,
+        params,
+    )
+    nombres = [r["nombre"] for r in cur.fetchall() or []]
+    if nombres or not ficha_id or materia_id:
+        return nombres
+    # Ficha sin definiciones registradas: usar las evidencias cargadas para sus estudiantes
+    cur.execute(
+        """
+        SELECT DISTINCT e.evidencia_nombre AS nombre
+        FROM evidencias e JOIN estudiantes s ON s.documento = e.documento
+        WHERE s.ficha_id = %s
+        ORDER BY 1
+        """,
+        [ficha_id],
+    )
+    return [r["nombre"] for r in cur.fetchall() or []]
+
+
+def _export_wide_layout(format: str, ficha_id: Optional[int], materia_id: Optional[int]):
+    """Export con el mismo layout que acepta la carga wide: Correo, Nombre, Apellido, '<evidencia> (Letra)'.
+    El pivote se hace en SQL con agregados FILTER (una columna por evidencia) y se transmite por lotes."""
+    if not ficha_id and not materia_id:
+        raise HTTPException(status_code=400, detail="layout=wide requiere ficha_id o materia_id")
+    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+        evidencias = _wide_export_evidencias(cur, ficha_id, materia_id)
+    if not evidencias:
+        raise HTTPException(status_code=404, detail="Sin evidencias definidas para exportar")
+    pivots = ",\n".join(
+        f"MAX(e.letra) FILTER (WHERE e.evidencia_nombre = %s) AS ev_{i}" for i in range(len(evidencias))
+    )
+    params: List = list(evidencias) + [list(evidencias)]
+    where = []
+    if ficha_id:
+        where.append("s.ficha_id = %s")
+        params.append(ficha_id)
+    else:
+        where.append("EXISTS (SELECT 1 FROM evidencias x WHERE x.documento = s.documento AND x.evidencia_nombre = ANY(%s))")
+        params.append(list(evidencias))
+    sql = f"""
+    SELECT s.correo, s.nombre, s.apellido,
+    {pivots}
+    FROM estudiantes s
+    LEFT JOIN evidencias e ON e.documento = s.documento AND e.evidencia_nombre = ANY(%s)
+    WHERE {' AND '.join(where)}
+    GROUP BY s.documento, s.correo, s.nombre, s.apellido
+    ORDER BY s.apellido, s.nombre, s.documento
+    """
+    batches = open_export(sql, params, name="export_evidencias_pivot")
+    if batches is None:
+        raise HTTPException(status_code=404, detail="Sin datos para exportar")
+    columns = [("correo", "Correo"), ("nombre", "Nombre"), ("apellido", "Apellido")]
+    columns += [(f"ev_{i}", f"{nombre} (Letra)") for i, nombre in enumerate(evidencias)]
+    suffix = f"_ficha_{ficha_id}" if ficha_id else f"_materia_{materia_id}"
+    return export_response(batches, columns, format, "evidencias_wide" + suffix, sheet_name="EvidenciasWide")
+
+
 @router.get("/export")
-def export_evidencias(_: dict = Depends(get_current_user_claims)):
-    import pandas as pd
-    import io
-    from fastapi.responses import StreamingResponse
+def export_evidencias(
+    format: str = Query("xlsx", pattern=FORMAT_PATTERN, description="xlsx | csv | ndjson (csv/ndjson se transmiten por lotes)"),
+    layout: str = Query("long", pattern="^(long|wide)$", description="long: una fila por estudiante x evidencia; wide: mismo formato que la plantilla de carga"),
+    ficha_id: Optional[int] = Query(None, description="Filtro de ficha (layout=wide)"),
+    materia_id: Optional[int] = Query(None, description="Filtro de materia (layout=wide)"),
+    _: dict = Depends(get_current_user_claims),
+):
+    if layout == "wide":
+        return _export_wide_layout(format, ficha_id, materia_id)
     sql = "SELECT e.documento, s.nombre, s.apellido, s.correo, e.evidencia_nombre, e.letra, e.estado, e.created_at FROM evidencias e JOIN estudiantes s ON s.documento = e.documento ORDER BY e.documento, e.evidencia_nombre"
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(sql)
-        rows = cur.fetchall() or []
-    if not rows:
+    batches = open_export(sql, name="export_evidencias_wide")
+    if batches is None:
         raise HTTPException(status_code=404, detail="Sin datos para exportar")
-    df = pd.DataFrame(rows)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="EvidenciasWide")
-    output.seek(0)
-    return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": "attachment; filename=evidencias_wide.xlsx"})
+    cols = ["documento", "nombre", "apellido", "correo", "evidencia_nombre", "letra", "estado", "created_at"]
+    return export_response(batches, [(c, c) for c in cols], format, "evidencias_wide", sheet_name="EvidenciasWide")
 
 @router.get("/template")
 def template_evidencias(evidencias: int = Query(2, ge=1, le=50), _: dict = Depends(get_current_user_claims)):
@@ -598,13 +710,13 @@ def template_evidencias(evidencias: int = Query(2, ge=1, le=50), _: dict = Depen
 def uploads_history(limit: int = Query(25, ge=1, le=200), _: dict = Depends(get_current_user_claims)):
     """Historial persistente de cargas wide (desde audit_logs)."""
     sql = """
-    SELECT id, created_at, metadata, detalles,
+    SELECT id, created_at, detalles,
            (metadata->>'ficha_numero') AS ficha_numero,
            (metadata->>'ficha_id') AS ficha_id,
            (metadata->>'materia_id') AS materia_id,
-        (metadata->>'counts') AS counts_json,
-        (metadata->>'modo') AS modo,
-        (metadata->>'evidencia_nombre') AS evidencia_nombre
+           (metadata->'counts') AS counts,
+           (metadata->>'modo') AS modo,
+           (metadata->>'evidencia_nombre') AS evidencia_nombre
     FROM audit_logs
     WHERE accion='upload' AND modulo='evidencias'
     ORDER BY created_at DESC
@@ -616,15 +728,10 @@ def uploads_history(limit: int = Query(25, ge=1, le=200), _: dict = Depends(get_
             rows = cur.fetchall() or []
         except Exception:
             rows = []
-    # Normalizar counts
+    # counts llega como jsonb (dict) sin pasar por texto
     normalized = []
-    import json as _json
     for r in rows:
-        raw_counts = r.get('counts_json')
-        try:
-            counts = _json.loads(raw_counts) if raw_counts else {}
-        except Exception:
-            counts = {}
+        counts = r.get('counts') if isinstance(r.get('counts'), dict) else {}
         normalized.append({
             'id': r.get('id'),
             'fecha': r.get('created_at'),
@@ -637,4 +744,29 @@ def uploads_history(limit: int = Query(25, ge=1, le=200), _: dict = Depends(get_
             'counts': counts,
             'registros': counts.get('tot_registros') if isinstance(counts, dict) else None
         })
+    # Cargas en background aún en curso o fallidas (las completadas ya quedan en audit_logs)
+    jobs = list_open_jobs(["evidencias_wide", "evidencias_columna"], limit)
+    if jobs:
+        for j in jobs:
+            params = j.get('parametros') or {}
+            normalized.append({
+                'id': j.get('id'),
+                'fecha': j.get('created_at'),
+                'fichaNumero': params.get('ficha_numero'),
+                'fichaId': params.get('ficha_id'),
+                'materiaId': params.get('materia_id'),
+                'detalles': j.get('error') or j.get('filename'),
+                'modo': 'background',
+                'evidenciaNombre': params.get('evidencia_nombre'),
+                'counts': {},
+                'registros': None,
+                'jobId': j.get('id'),
+                'estado': j.get('estado'),
+                'porcentaje': j.get('porcentaje'),
+            })
+        try:
+            normalized.sort(key=lambda x: x['fecha'], reverse=True)
+        except TypeError:
+            pass
+        normalized = normalized[:limit]
     return {'success': True, 'data': normalized}
@@ -1,64 +1,74 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import Optional, List, Dict
-from math import ceil
 from psycopg.rows import dict_row
 from psycopg import errors
 from ..db import get_conn
+from ..utils.pagination import Keyset, count_total, pagination_meta, resolve_total_mode, TOTAL_PATTERN
+from ..utils.search import relevance_order, search_filter, search_info, trgm_disponible, trgm_indexado
 from ..security import get_current_user_claims
 from pydantic import BaseModel, Field
 
 router = APIRouter(prefix="/api/v1/fichas", tags=["fichas"])
 
 
+_KEYSET = Keyset("fichas", [("id", "id", "int")], descending=True)
+_SEARCH_COLUMNS = ["numero", "nombre"]
+
+
 @router.get("")
 def list_fichas(
     page: int = Query(1, ge=1),
     pageSize: int = Query(10, ge=1, le=100),
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío = primera página; luego nextCursor"),
+    total: Optional[str] = Query(None, pattern=TOTAL_PATTERN),
+    orden: Optional[str] = Query(None, pattern="^relevancia$", description="Con search: ordenar por similitud (pg_trgm)"),
 ):
+    if orden and cursor is not None:
+        raise HTTPException(status_code=400, detail="orden=relevancia no admite cursor; usar page/pageSize")
     offset = (page - 1) * pageSize
+    after = _KEYSET.decode(cursor)
+    total_mode = resolve_total_mode(total, cursor)
 
     filters = []
     params = []
 
-    if search:
-        filters.append("(numero ILIKE %s OR nombre ILIKE %s)")
-        like = f"%{search}%"
-        params.extend([like, like])
+    if search and search.strip():
+        search_sql, search_params = search_filter(_SEARCH_COLUMNS, search)
+        filters.append(search_sql)
+        params.extend(search_params)
 
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
+    seek_sql, seek_params = _KEYSET.seek(after)
+    items_filters = filters + ([seek_sql] if seek_sql else [])
+    items_where = f"WHERE {' AND '.join(items_filters)}" if items_filters else ""
 
-    items_sql = f"""
-        SELECT id, numero, nombre, descripcion, estado, created_at
-        FROM fichas
-        {where_clause}
-        ORDER BY id DESC
-        LIMIT %s OFFSET %s
-    """
-
-    count_sql = f"""
-        SELECT COUNT(*) AS total
-        FROM fichas
-        {where_clause}
-    """
+    page_params = [pageSize + 1] if cursor is not None else [pageSize, offset]
 
+    next_cursor = None
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(count_sql, params)
-        total_row = cur.fetchone()
-        total = int(total_row["total"]) if total_row else 0
-
-        cur.execute(items_sql, [*params, pageSize, offset])
+        trgm = trgm_disponible(cur) if search else False
+        indexado = trgm and trgm_indexado(cur, "fichas", _SEARCH_COLUMNS)
+        ranked = bool(orden and trgm and search and search.strip())
+        rank_sql, rank_params = relevance_order(_SEARCH_COLUMNS, search) if ranked else ("", [])
+        items_sql = f"""
+            SELECT id, numero, nombre, descripcion, estado, created_at
+            FROM fichas
+            {items_where}
+            ORDER BY {rank_sql + ", " if rank_sql else ""}{_KEYSET.order_by()}
+            LIMIT %s {"" if cursor is not None else "OFFSET %s"}
+        """
+        total_count, exact = count_total(cur, "fichas", where_clause, params, total_mode, "fichas")
+        cur.execute(items_sql, [*params, *seek_params, *rank_params, *page_params])
         items = cur.fetchall() or []
+    if cursor is not None:
+        items, next_cursor = _KEYSET.page(items, pageSize)
 
     return {
         "success": True,
         "data": items,
-        "pagination": {
-            "page": page,
-            "pageSize": pageSize,
-            "total": total,
-            "totalPages": ceil(total / pageSize) if pageSize else 0,
-        },
+        "pagination": pagination_meta(page, pageSize, total_count, total_mode, exact, next_cursor, cursor is not None),
+        "search": search_info(search, indexado, ranked),
     }
 
 
@@ -1,12 +1,24 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 import time
+from ..db import pool_health
 
 router = APIRouter()
 
 @router.get("/health")
 def health():
+    # Estado del pool sin consultar la base (ver db.pool_health)
+    db = pool_health()
     return {
-        "status": "ok",
+        "status": "ok" if db["ready"] else "degraded",
         "timestamp": time.time(),
         "uptime_hint": "FastAPI app responding",
+        "db": db,
     }
+
+
+@router.get("/health/ready")
+def health_ready():
+    """Readiness: 503 mientras los pools no tengan conexiones (arranque o caída de la base)."""
+    db = pool_health()
+    return JSONResponse(status_code=200 if db["ready"] else 503, content={"ready": db["ready"], "db": db})
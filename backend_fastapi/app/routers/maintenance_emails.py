@@ -58,18 +58,16 @@ def pending_evidencias_trigger(limit: int = Query(50, ge=1, le=200), claims: dic
             destinatarios = []
     email_obj = build_email(resumenes, destinatarios)
     sent = send_email(email_obj)
-    with get_conn() as conn:
-        try:
-            record_event(conn,
-                         accion="trigger_pending_evidencias_email",
-                         user_id=int(claims.get("sub")) if claims.get("sub") else None,
-                         user_email=claims.get("email"),
-                         user_rol=claims.get("rol"),
-                         modulo="maintenance",
-                         entidad_tipo="email_batch",
-                         detalles={"destinatarios": len(destinatarios), "sent": sent, "pendientes": len(resumenes)})
-        except Exception:
-            pass
+    try:
+        record_event(accion="trigger_pending_evidencias_email",
+                     user_id=int(claims.get("sub")) if claims.get("sub") else None,
+                     user_email=claims.get("email"),
+                     user_rol=claims.get("rol"),
+                     modulo="maintenance",
+                     entidad_tipo="email_batch",
+                     detalles={"destinatarios": len(destinatarios), "sent": sent, "pendientes": len(resumenes)})
+    except Exception:
+        pass
     return {"success": True, "data": {"sent": sent, "email": {"to": email_obj.to, "subject": email_obj.subject}, "enabled": email_status().get("enabled")}}
 
 # Envío de correos por umbrales de 'D' (reprobadas) por materia/ficha
@@ -174,15 +172,13 @@ def absence_by_materia_ficha(materia_id: int = Query(..., ge=1),
             attempts.append({"documento": doc, "to": to_list, "count": d_count, "escalation": False, "sent": bool(sent)})
             sent_any = sent_any or sent
     try:
-        with get_conn() as conn:
-            record_event(conn,
-                         accion="absence_threshold_emails",
-                         user_id=int(claims.get("sub")) if claims.get("sub") else None,
-                         user_email=claims.get("email"),
-                         user_rol=claims.get("rol"),
-                         modulo="maintenance",
-                         entidad_tipo="absence_batch",
-                         detalles={"rows": len(rows), "sent": bool(sent_any), "materia_id": materia_id, "ficha_id": ficha_id})
+        record_event(accion="absence_threshold_emails",
+                     user_id=int(claims.get("sub")) if claims.get("sub") else None,
+                     user_email=claims.get("email"),
+                     user_rol=claims.get("rol"),
+                     modulo="maintenance",
+                     entidad_tipo="absence_batch",
+                     detalles={"rows": len(rows), "sent": bool(sent_any), "materia_id": materia_id, "ficha_id": ficha_id})
     except Exception:
         pass
     return {"success": True, "data": {"rows": len(rows), "sent_any": bool(sent_any), "enabled": email_status().get("enabled"), "attempts": attempts, "include_pending": include_pending}}
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException, Depends
+from ..security import get_current_user_claims
+from ..services.upload_jobs import get_job, public_view
+
+router = APIRouter(prefix="/api/v1/uploads", tags=["uploads"])
+
+
+@router.get("/{job_id}")
+def get_upload_job(job_id: str, claims: dict = Depends(get_current_user_claims)):
+    """Estado de una carga en background: etapa, porcentaje, errores parciales y resultado."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de carga no encontrado")
+    owner = job.get("user_id")
+    caller = (claims or {}).get("id") or (claims or {}).get("sub")
+    rol = (claims or {}).get("rol")
+    if owner is not None and rol != "administrador" and str(owner) != str(caller):
+        raise HTTPException(status_code=404, detail="Trabajo de carga no encontrado")
+    return {"success": True, "data": public_view(job)}
@@ -1,22 +1,29 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import Optional
-from math import ceil
 from psycopg.rows import dict_row
 from psycopg import errors
 from ..db import get_conn
+from ..utils.pagination import Keyset, count_total, pagination_meta, resolve_total_mode, TOTAL_PATTERN
 from ..security import get_current_user_claims, pwd_context
 from ..utils.audit import record_event
 
 router = APIRouter(prefix="/api/v1/users", tags=["users"])
 
 
+_KEYSET = Keyset("users", [("id", "id", "int")], descending=True)
+
+
 @router.get("")
 def list_users(
     page: int = Query(1, ge=1),
     pageSize: int = Query(10, ge=1, le=100),  # camelCase to match frontend client
     search: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío = primera página; luego nextCursor"),
+    total: Optional[str] = Query(None, pattern=TOTAL_PATTERN),
 ):
     offset = (page - 1) * pageSize
+    after = _KEYSET.decode(cursor)
+    total_mode = resolve_total_mode(total, cursor)
 
     filters = []
     params = []
@@ -27,42 +34,32 @@ def list_users(
         params.extend([like, like, like])
 
     where_clause = f"WHERE {' AND '.join(filters)}" if filters else ""
+    seek_sql, seek_params = _KEYSET.seek(after)
+    items_filters = filters + ([seek_sql] if seek_sql else [])
+    items_where = f"WHERE {' AND '.join(items_filters)}" if items_filters else ""
 
     # Query items
     items_sql = f"""
         SELECT id, email, nombre, apellido, rol, activo
         FROM users
-        {where_clause}
-        ORDER BY id DESC
-        LIMIT %s OFFSET %s
-    """
-
-    # Query total count
-    count_sql = f"""
-        SELECT COUNT(*) as total
-        FROM users
-        {where_clause}
+        {items_where}
+        ORDER BY {_KEYSET.order_by()}
+        LIMIT %s {"" if cursor is not None else "OFFSET %s"}
     """
+    page_params = [pageSize + 1] if cursor is not None else [pageSize, offset]
 
+    next_cursor = None
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        # total count first
-        cur.execute(count_sql, params)
-        total_row = cur.fetchone()
-        total = int(total_row["total"]) if total_row else 0
-
-        # items
-        cur.execute(items_sql, [*params, pageSize, offset])
+        total_count, exact = count_total(cur, "users", where_clause, params, total_mode, "users")
+        cur.execute(items_sql, [*params, *seek_params, *page_params])
         items = cur.fetchall() or []
+    if cursor is not None:
+        items, next_cursor = _KEYSET.page(items, pageSize)
 
     return {
         "success": True,
         "data": items,
-        "pagination": {
-            "page": page,
-            "pageSize": pageSize,
-            "total": total,
-            "totalPages": ceil(total / pageSize) if pageSize else 0,
-        },
+        "pagination": pagination_meta(page, pageSize, total_count, total_mode, exact, next_cursor, cursor is not None),
     }
 
 
@@ -122,8 +119,7 @@ def create_user(payload: UserCreate, _: dict = Depends(get_current_user_claims))
             user = cur.fetchone()
             # Audit
             try:
-                record_event(conn,
-                             accion="crear_usuario",
+                record_event(accion="crear_usuario",
                              user_email=payload.email,
                              user_rol=payload.rol,
                              modulo="users",
@@ -181,8 +177,7 @@ def update_user(user_id: int, payload: UserUpdate, _: dict = Depends(get_current
             if not row:
                 raise HTTPException(status_code=404, detail="Usuario no encontrado")
             try:
-                record_event(conn,
-                             accion="actualizar_usuario",
+                record_event(accion="actualizar_usuario",
                              modulo="users",
                              entidad_tipo="usuario",
                              entidad_id=str(user_id),
@@ -206,8 +201,7 @@ def toggle_user(user_id: int, _: dict = Depends(get_current_user_claims)):
         cur.execute(sql, [user_id])
         row = cur.fetchone()
         try:
-            record_event(conn,
-                         accion="toggle_usuario",
+            record_event(accion="toggle_usuario",
                          modulo="users",
                          entidad_tipo="usuario",
                          entidad_id=str(user_id),
@@ -227,8 +221,7 @@ def delete_user(user_id: int, _: dict = Depends(get_current_user_claims)):
         cur.execute(sql, [user_id])
         row = cur.fetchone()
         try:
-            record_event(conn,
-                         accion="baja_usuario",
+            record_event(accion="baja_usuario",
                          modulo="users",
                          entidad_tipo="usuario",
                          entidad_id=str(user_id))
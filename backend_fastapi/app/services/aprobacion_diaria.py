@@ -0,0 +1,197 @@
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .evidencia_definicion_ref import aactive_join
+
+# Rollup diario de evidencias_detalle (migrations/009_evidencias_detalle_diario.sql).
+# Las escrituras de evidencias_detalle recalculan, en su misma transacción, las filas
+# de los pares (ficha, materia) afectados; /analytics/tendencia-aprobacion arma la
+# serie de cualquier ventana sumando días del rollup. La serie se completa en SQL
+# con generate_series: los periodos sin evidencias salen con total 0. El filtro de
+# definiciones activas se aplica al leer, como en evidencias_resumen.
+
+TABLE = "evidencias_detalle_diario"
+
+GRANULARIDADES = ("day", "week", "month")
+
+# Advisory locks (_LOCK_KEY, materia_id): serializan hasta el commit los recálculos
+# (DELETE + INSERT) de una misma materia, el alcance del DELETE; materias distintas
+# no se esperan. Se toman en orden de id y siempre después de los del resumen
+# diario (vincular_definiciones, cargas). La reconstrucción completa bloquea la tabla.
+_LOCK_KEY = 742_031_010
+
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(%s, k) FROM unnest(%s::int[]) AS t(k) ORDER BY k"
+
+_available = False
+
+_INSERT_SQL = f"""
+    INSERT INTO {TABLE}
+        (dia, ficha_id, materia_id, evidencia_definicion_id, total, aprobadas, reprobadas, no_entrego, pendientes)
+    SELECT (e.created_at AT TIME ZONE 'UTC')::date,
+           e.ficha_id,
+           e.materia_id,
+           e.evidencia_definicion_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE e.letra = 'A'),
+           COUNT(*) FILTER (WHERE e.letra IN ('F', 'D')),
+           COUNT(*) FILTER (WHERE e.letra = '-'),
+           COUNT(*) FILTER (WHERE e.letra IS NULL)
+    FROM evidencias_detalle e
+"""
+
+_GROUP_BY = " GROUP BY 1, 2, 3, 4"
+
+# Pares (ficha, materia); ficha NULL se compara como 0. El primer término usa el índice por materia.
+_PARES_WHERE = (
+    "{t}.materia_id = ANY(%s) AND (COALESCE({t}.ficha_id, 0), {t}.materia_id) IN "
+    "(SELECT f, m FROM unnest(%s::int[], %s::int[]) AS p(f, m))"
+)
+
+_SERIE_SQL = """
+    WITH serie AS (
+        SELECT g::date AS periodo
+        FROM generate_series(date_trunc(%(unidad)s::text, %(desde)s::timestamp), %(hasta)s::timestamp,
+                             ('1 ' || %(unidad)s::text)::interval) AS g
+    ), datos AS (
+        SELECT date_trunc(%(unidad)s::text, x.dia::timestamp)::date AS periodo,
+               SUM(x.total) AS total,
+               SUM(x.aprobadas) AS aprobadas
+        FROM ({datos}) x
+        GROUP BY 1
+    )
+    SELECT s.periodo,
+           (s.periodo + ('1 ' || %(unidad)s::text)::interval - interval '1 day')::date AS fecha_fin,
+           COALESCE(d.total, 0) AS total,
+           COALESCE(d.aprobadas, 0) AS aprobadas,
+           COALESCE(ROUND(100.0 * d.aprobadas / NULLIF(d.total, 0), 2), 0) AS aprobacion
+    FROM serie s
+    LEFT JOIN datos d ON d.periodo = s.periodo
+    ORDER BY s.periodo
+"""
+
+
+def _first(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return list(row.values())[0]
+    return row[0]
+
+
+def disponible(cur) -> bool:
+    """True si la migración del rollup está aplicada (se recuerda una vez confirmada)."""
+    global _available
+    if _available:
+        return True
+    try:
+        cur.execute("SELECT to_regclass(%s)", [TABLE])
+        _available = _first(cur.fetchone()) is not None
+    except Exception:
+        return False
+    return _available
+
+
+async def adisponible(cur) -> bool:
+    """disponible() para cursores async."""
+    global _available
+    if _available:
+        return True
+    try:
+        await cur.execute("SELECT to_regclass(%s)", [TABLE])
+        _available = _first(await cur.fetchone()) is not None
+    except Exception:
+        return False
+    return _available
+
+
+def pares(cur, condicion: str, params: List[Any]) -> Set[Tuple[Optional[int], int]]:
+    """(ficha_id, materia_id) de las filas de evidencias_detalle que cumplen `condicion`.
+
+    Para leer el alcance anterior de una escritura que puede mover filas de par.
+    """
+    if not disponible(cur):
+        return set()
+    cur.execute(f"SELECT DISTINCT ficha_id, materia_id FROM evidencias_detalle WHERE {condicion}", params)
+    out = set()
+    for r in cur.fetchall() or []:
+        ficha, materia = (r["ficha_id"], r["materia_id"]) if isinstance(r, dict) else (r[0], r[1])
+        out.add((ficha, materia))
+    return out
+
+
+def refresh_pares(cur, pares_: Iterable[Tuple[Optional[int], Optional[int]]]) -> int:
+    """Recalcula el rollup de los pares (ficha_id, materia_id) dados. Sin commit.
+
+    Corre en un savepoint: ante error se deshace solo el recálculo y se propaga la excepción.
+    """
+    claves = sorted({(int(f or 0), int(m)) for f, m in pares_ if m})
+    if not claves or not disponible(cur):
+        return 0
+    fichas = [f for f, _ in claves]
+    materias = [m for _, m in claves]
+    params = [sorted(set(materias)), fichas, materias]
+    # Savepoint: si falla, la escritura que lo invoca sigue siendo válida (el script reconstruye)
+    with cur.connection.transaction():
+        cur.execute(_LOCK_SQL, [_LOCK_KEY, params[0]])
+        cur.execute(f"DELETE FROM {TABLE} r WHERE " + _PARES_WHERE.format(t="r"), params)
+        cur.execute(_INSERT_SQL + " WHERE " + _PARES_WHERE.format(t="e") + _GROUP_BY, params)
+        return cur.rowcount
+
+
+def refresh_materias(cur, materias: Iterable[Optional[int]]) -> int:
+    """Recalcula todas las fichas de las materias dadas (cargas masivas que reasignan ficha). Sin commit."""
+    ids = sorted({int(m) for m in materias if m})
+    if not ids or not disponible(cur):
+        return 0
+    with cur.connection.transaction():
+        cur.execute(_LOCK_SQL, [_LOCK_KEY, ids])
+        cur.execute(f"DELETE FROM {TABLE} WHERE materia_id = ANY(%s)", [ids])
+        cur.execute(_INSERT_SQL + " WHERE e.materia_id = ANY(%s)" + _GROUP_BY, [ids])
+        return cur.rowcount
+
+
+def refresh_all(cur) -> int:
+    """Reconstrucción completa (script / mantenimiento). Sin commit."""
+    if not disponible(cur):
+        return 0
+    # Espera a los recálculos en curso y bloquea los nuevos (las lecturas siguen)
+    cur.execute(f"LOCK TABLE {TABLE} IN EXCLUSIVE MODE")
+    cur.execute(f"DELETE FROM {TABLE}")
+    cur.execute(_INSERT_SQL + _GROUP_BY)
+    return cur.rowcount
+
+
+# ---- Serie para /analytics/tendencia-aprobacion ----
+
+def serie_sql(datos: str, granularidad: str, desde: datetime.date, hasta: datetime.date,
+              params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Serie completa [desde, hasta] por `granularidad` sobre `datos` (columnas dia, total, aprobadas).
+
+    `datos` usa parámetros con nombre; los periodos sin filas salen con total 0.
+    """
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f"granularidad inválida: {granularidad}")
+    return _SERIE_SQL.format(datos=datos), {**params, "unidad": granularidad, "desde": desde, "hasta": hasta}
+
+
+async def aserie(cur, granularidad: str, desde: datetime.date, hasta: datetime.date,
+                 ficha_id: Optional[int] = None, materia_id: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """Serie de aprobación desde el rollup (None = rollup no disponible: usar la consulta original)."""
+    if not await adisponible(cur):
+        return None
+    join_activas = await aactive_join(cur, "r", TABLE)
+    filtros = ""
+    params: Dict[str, Any] = {}
+    if ficha_id is not None:
+        filtros += " AND r.ficha_id = %(ficha_id)s"
+        params["ficha_id"] = ficha_id
+    if materia_id is not None:
+        filtros += " AND r.materia_id = %(materia_id)s"
+        params["materia_id"] = materia_id
+    datos = f"""
+        SELECT r.dia, r.total, r.aprobadas
+        FROM {TABLE} r
+        {join_activas}
+        WHERE r.dia BETWEEN %(desde)s AND %(hasta)s{filtros}
+    """
+    await cur.execute(*serie_sql(datos, granularidad, desde, hasta, params))
+    return [dict(r) for r in await cur.fetchall() or []]
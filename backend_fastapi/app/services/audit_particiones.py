@@ -0,0 +1,90 @@
+import datetime
+import gzip
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Particiones mensuales de audit_logs (migrations/007_audit_logs_particionado.sql).
+# Cada mes es audit_logs_YYYYMM; audit_logs_default recibe lo que no tenga partición.
+# La retención desvincula (DETACH) meses completos, opcionalmente los archiva como
+# CSV comprimido y los elimina: sin DELETE masivo ni VACUUM posterior.
+
+PREFIJO = "audit_logs_"
+
+_PARTICIONES_SQL = """
+    SELECT c.relname AS nombre,
+           pg_get_expr(c.relpartbound, c.oid) AS limites,
+           c.reltuples::bigint AS filas_estimadas,
+           pg_total_relation_size(c.oid) AS bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('audit_logs')
+    ORDER BY c.relname
+"""
+
+
+def _first(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return list(row.values())[0]
+    return row[0]
+
+
+def particionado(cur) -> bool:
+    """True si audit_logs ya es una tabla particionada (migración 007 aplicada)."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('audit_logs')")
+    return _first(cur.fetchone()) == "p"
+
+
+def mes_de(nombre: str) -> Optional[datetime.date]:
+    """Primer día del mes de una partición audit_logs_YYYYMM (None para default u otras)."""
+    sufijo = nombre[len(PREFIJO):] if nombre.startswith(PREFIJO) else ""
+    if len(sufijo) != 6 or not sufijo.isdigit():
+        return None
+    return datetime.date(int(sufijo[:4]), int(sufijo[4:]), 1)
+
+
+def crear_particiones(cur, meses_adelante: int = 3) -> int:
+    """Crea las particiones del mes actual y los siguientes; retorna cuántas creó."""
+    cur.execute("SELECT audit_logs_crear_particiones(CURRENT_DATE, %s)", [meses_adelante])
+    return int(_first(cur.fetchone()) or 0)
+
+
+def listar_particiones(cur) -> List[Dict[str, Any]]:
+    cur.execute(_PARTICIONES_SQL)
+    out = []
+    for r in cur.fetchall() or []:
+        row = r if isinstance(r, dict) else dict(zip(("nombre", "limites", "filas_estimadas", "bytes"), r))
+        out.append({**row, "mes": mes_de(row["nombre"])})
+    return out
+
+
+def corte_retencion(meses: int, hoy: Optional[datetime.date] = None) -> datetime.date:
+    """Primer mes que se conserva: el actual menos `meses` completos."""
+    hoy = hoy or datetime.date.today()
+    total = hoy.year * 12 + (hoy.month - 1) - meses
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def vencidas(cur, meses: int) -> List[Dict[str, Any]]:
+    """Particiones mensuales enteramente anteriores al corte de retención."""
+    corte = corte_retencion(meses)
+    return [p for p in listar_particiones(cur) if p["mes"] is not None and p["mes"] < corte]
+
+
+def archivar(cur, nombre: str, destino: Path) -> Path:
+    """Exporta la partición a DESTINO/nombre.csv.gz (COPY ... TO STDOUT) y retorna la ruta."""
+    destino.mkdir(parents=True, exist_ok=True)
+    path = destino / f"{nombre}.csv.gz"
+    with gzip.open(path, "wb") as fh:
+        with cur.copy(f'COPY "{nombre}" TO STDOUT WITH (FORMAT csv, HEADER true)') as copy:
+            for chunk in copy:
+                fh.write(chunk)
+    return path
+
+
+def desvincular(cur, nombre: str, eliminar: bool = False) -> None:
+    """DETACH de la partición (queda como tabla suelta); con `eliminar`, DROP."""
+    cur.execute(f'ALTER TABLE audit_logs DETACH PARTITION "{nombre}"')
+    if eliminar:
+        cur.execute(f'DROP TABLE "{nombre}"')
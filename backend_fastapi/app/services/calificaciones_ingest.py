@@ -0,0 +1,113 @@
+import datetime
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+import pandas as pd
+from ..utils.bulk import create_staging, copy_rows, analyze_staging
+
+# Carga masiva de calificaciones: COPY a una tabla temporal y un único
+# INSERT ... SELECT ... ON CONFLICT, en lugar de un upsert + fetchone por fila.
+
+STAGING_TABLE = "stg_calificaciones"
+
+STAGING_COLUMNS = [
+    ("seq", "integer"),  # orden en el archivo: ante claves repetidas gana la última
+    ("materia_id", "integer"),
+    ("ficha_id", "integer"),
+    ("estudiante_nombre", "text"),
+    ("estudiante_documento", "text"),
+    ("trimestre", "integer"),
+    ("nota", "numeric"),
+    ("estado", "text"),
+    ("observaciones", "text"),
+]
+
+_COPY_COLUMNS = [c for c, _ in STAGING_COLUMNS]
+
+
+def _clean(v: Any) -> Any:
+    return None if v is None or (not isinstance(v, str) and pd.isna(v)) else v
+
+
+def derive_nota_estado(nota: Any, estado: Any) -> Tuple[Optional[float], str]:
+    """A/F -> 5.0/2.0; numérico -> Aprobado si >= 3.0; vacío o inválido -> Cursando."""
+    raw = str(_clean(nota) or "").strip().upper()
+    estado_val = _clean(estado) or "Cursando"
+    if raw in ("A", "F"):
+        return (5.0 if raw == "A" else 2.0), ("Aprobado" if raw == "A" else "Reprobado")
+    if raw:
+        try:
+            fval = float(raw)
+        except Exception:
+            # dejar nota None y estado cursando
+            return None, "Cursando"
+        return fval, ("Aprobado" if fval >= 3.0 else "Reprobado")
+    return None, estado_val
+
+
+def create_calificaciones_staging(cur) -> None:
+    create_staging(cur, STAGING_TABLE, STAGING_COLUMNS)
+
+
+def append_staging(cur, resolved_rows: Sequence[Tuple[int, int, Any]], seq_start: int = 0) -> int:
+    """COPY de un lote (sin ANALYZE); `seq` sigue desde `seq_start` para conservar el orden del archivo."""
+
+    def _rows() -> Iterable[tuple]:
+        for seq, (materia_id, ficha_id, r) in enumerate(resolved_rows, start=seq_start):
+            nota_val, estado_val = derive_nota_estado(r.get("nota"), r.get("estado"))
+            yield (
+                seq,
+                materia_id,
+                ficha_id,
+                r["estudiante_nombre"],
+                r["estudiante_documento"],
+                int(r["trimestre"]),
+                nota_val,
+                estado_val,
+                _clean(r.get("observaciones")),
+            )
+
+    return copy_rows(cur, STAGING_TABLE, _COPY_COLUMNS, _rows(), analyze=False)
+
+
+def load_staging(cur, resolved_rows: Sequence[Tuple[int, int, Any]]) -> int:
+    """`resolved_rows`: (materia_id, ficha_id, fila) con la fila como Series/dict."""
+    create_calificaciones_staging(cur)
+    written = append_staging(cur, resolved_rows)
+    analyze_staging(cur, STAGING_TABLE)
+    return written
+
+
+def merge(cur, cargado_por: Optional[int], fecha_carga: datetime.date) -> Dict[str, int]:
+    """Upsert desde staging. Retorna {"merged": claves distintas, "inserted": nuevas}."""
+    cur.execute(
+        f"""
+        WITH src AS (
+            SELECT DISTINCT ON (materia_id, estudiante_documento, trimestre) *
+            FROM {STAGING_TABLE}
+            ORDER BY materia_id, estudiante_documento, trimestre, seq DESC
+        ), up AS (
+            INSERT INTO calificaciones (
+                materia_id, ficha_id, estudiante_nombre, estudiante_documento, trimestre,
+                nota, estado, observaciones, cargado_por, fecha_carga
+            )
+            SELECT materia_id, ficha_id, estudiante_nombre, estudiante_documento, trimestre,
+                   nota, estado, observaciones, %s, %s
+            FROM src
+            ON CONFLICT (materia_id, estudiante_documento, trimestre) DO UPDATE SET
+                ficha_id = EXCLUDED.ficha_id,
+                estudiante_nombre = EXCLUDED.estudiante_nombre,
+                nota = EXCLUDED.nota,
+                estado = EXCLUDED.estado,
+                observaciones = EXCLUDED.observaciones,
+                cargado_por = EXCLUDED.cargado_por,
+                fecha_carga = EXCLUDED.fecha_carga,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) AS merged, COUNT(*) FILTER (WHERE inserted) AS inserted FROM up
+        """,
+        [cargado_por, fecha_carga],
+    )
+    row = cur.fetchone()
+    if isinstance(row, dict):
+        return {"merged": int(row["merged"] or 0), "inserted": int(row["inserted"] or 0)}
+    return {"merged": int(row[0] or 0), "inserted": int(row[1] or 0)}
@@ -0,0 +1,74 @@
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from ..cache import analytics_cache, adata_version_tag
+from ..db import get_aconn
+
+# GET /api/v1/dashboard/{rol}/bootstrap: todos los widgets de un rol sobre una
+# sola conexión del pool, dentro de una transacción REPEATABLE READ READ ONLY
+# (mismo snapshot para todos). Cada widget corre en su savepoint: los widgets
+# atrapan sus propios errores y devuelven valores por defecto, pero una consulta
+# fallida deja la transacción abortada; se revierte el savepoint para que el
+# siguiente widget pueda seguir consultando. La respuesta se cachea por rol y
+# usuario con la versión de datos global (TTL corto: la actividad llega a
+# audit_logs por la cola de auditoría).
+
+Widget = Callable[[Any], Awaitable[Any]]
+
+
+class _Abortada(Exception):
+    pass
+
+
+async def _run(cur, widget: Widget) -> Tuple[Any, Optional[str]]:
+    conn = cur.connection
+    data = None
+    try:
+        async with conn.transaction():
+            data = await widget(cur)
+            if conn.info.transaction_status == TransactionStatus.INERROR:
+                raise _Abortada()
+    except _Abortada:
+        return data, "consulta fallida: valores por defecto"
+    except Exception as e:
+        return data, str(e)
+    return data, None
+
+
+async def abootstrap(rol: str, claims: Optional[dict], widgets: Dict[str, Widget]) -> Dict[str, Any]:
+    """Payload {widgets, meta} con tiempos por widget; cacheado por rol y usuario."""
+    user_id = (claims or {}).get("sub")
+
+    async def _compute():
+        started = time.perf_counter()
+        data: Dict[str, Any] = {}
+        timings: Dict[str, float] = {}
+        errores: Dict[str, str] = {}
+        async with get_aconn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            async with conn.transaction():
+                await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                for name, widget in widgets.items():
+                    t0 = time.perf_counter()
+                    data[name], error = await _run(cur, widget)
+                    timings[name] = round((time.perf_counter() - t0) * 1000.0, 2)
+                    if error:
+                        errores[name] = error
+        return {
+            "widgets": data,
+            "meta": {
+                "rol": rol,
+                "generadoEn": datetime.utcnow().isoformat(),
+                "snapshot": "repeatable read",
+                "timingsMs": timings,
+                "totalMs": round((time.perf_counter() - started) * 1000.0, 2),
+                "errores": errores,
+            },
+        }
+
+    key = f"dashboard_bootstrap|{rol}|{await adata_version_tag()}|user={user_id}"
+    payload = await analytics_cache.aget_or_compute(key, _compute)
+    if payload["meta"]["errores"]:
+        await analytics_cache.adelete(key)  # no retener un payload parcial
+    return payload
@@ -0,0 +1,80 @@
+from typing import Any, Dict, Tuple
+from .evidencias_resumen import RESUMEN_TABLE, aresumen_disponible
+
+# KPIs del dashboard docente en una sola consulta.
+# calificaciones: un recorrido de `cargado_por = uid` con COUNT(*) FILTER
+# (idx_calificaciones_cargado_por, migrations/008). Cargas wide: CTE sobre
+# audit_logs (idx_audit_logs_uploads_user, migrations/007) reutilizada para
+# fichas, estudiantes y pendientes. Los pendientes salen del resumen diario si
+# está disponible (misma unión evidencias -> estudiantes.ficha_id).
+
+_PENDIENTES_RESUMEN = f"""
+    SELECT COALESCE(SUM(r.pendientes), 0) FROM {RESUMEN_TABLE} r
+    JOIN fichas_wide f ON f.ficha_id = r.ficha_id
+"""
+
+_PENDIENTES_EVIDENCIAS = """
+    SELECT COUNT(*) FROM evidencias e
+    JOIN estudiantes s ON s.documento = e.documento
+    JOIN fichas_wide f ON f.ficha_id = s.ficha_id
+    WHERE e.letra IS NULL
+"""
+
+_STATS_SQL = """
+    WITH cal AS (
+        SELECT COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE nota IS NOT NULL) AS calificadas,
+               COUNT(*) FILTER (WHERE nota IS NOT NULL AND estado <> 'Cursando') AS entregadas,
+               AVG(nota) AS promedio
+        FROM calificaciones
+        WHERE cargado_por = %(uid)s
+    ), cargas AS (
+        SELECT entidad_id FROM audit_logs
+        WHERE accion = 'upload' AND modulo = 'evidencias' AND user_id = %(uid)s
+    ), fichas_wide AS (
+        SELECT DISTINCT entidad_id AS ficha_id FROM cargas WHERE entidad_id IS NOT NULL
+    )
+    SELECT cal.total, cal.calificadas, cal.entregadas, cal.promedio,
+           (SELECT COUNT(*) FROM cargas) AS cargas_wide,
+           (SELECT COUNT(*) FROM fichas_wide) AS fichas_wide,
+           (SELECT COUNT(DISTINCT s.documento) FROM estudiantes s
+              JOIN fichas_wide f ON f.ficha_id = s.ficha_id) AS estudiantes_wide,
+           ({pendientes}) AS pendientes_wide
+    FROM cal
+"""
+
+
+def vacias() -> Dict[str, Any]:
+    return {"totalRegistros": 0, "calificacionesCargadas": 0, "entregadas": 0, "pendientes": 0,
+            "promedioHeuristico": 0.0, "fichasWide": 0, "estudiantesWide": 0, "cargasWide": 0,
+            "pendientesWide": 0}
+
+
+def _stats_sql(con_resumen: bool, user_id: int) -> Tuple[str, Dict[str, Any]]:
+    pendientes = _PENDIENTES_RESUMEN if con_resumen else _PENDIENTES_EVIDENCIAS
+    return _STATS_SQL.format(pendientes=pendientes.strip()), {"uid": user_id}
+
+
+def _stats_row(row: Any) -> Dict[str, Any]:
+    row = dict(row or {})
+    total = int(row.get("total") or 0)
+    calificadas = int(row.get("calificadas") or 0)
+    promedio = row.get("promedio")
+    return {
+        "totalRegistros": total,
+        "calificacionesCargadas": calificadas,
+        "entregadas": int(row.get("entregadas") or 0),
+        "pendientes": max(total - calificadas, 0),
+        "promedioHeuristico": round(float(promedio), 2) if promedio is not None else 0.0,
+        "fichasWide": int(row.get("fichas_wide") or 0),
+        "estudiantesWide": int(row.get("estudiantes_wide") or 0),
+        "cargasWide": int(row.get("cargas_wide") or 0),
+        "pendientesWide": int(row.get("pendientes_wide") or 0),
+    }
+
+
+async def aestadisticas(cur, user_id: int) -> Dict[str, Any]:
+    """KPIs del docente `user_id` (cursor async con dict_row)."""
+    con_resumen = await aresumen_disponible(cur)
+    await cur.execute(*_stats_sql(con_resumen, user_id))
+    return _stats_row(await cur.fetchone())
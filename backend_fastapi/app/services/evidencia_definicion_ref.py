@@ -0,0 +1,167 @@
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Vínculo entero evidencias / evidencias_detalle / resumen diario -> evidencia_definicion
+# (migrations/004_evidencia_definicion_id.sql). Las consultas agregadas filtran
+# definiciones activas con `d.id = x.evidencia_definicion_id` (índice parcial sobre
+# las activas) en lugar de unir por nombre; si la migración no está aplicada se
+# mantiene la unión por nombre.
+
+COLUMN = "evidencia_definicion_id"
+
+_ACTIVE_JOIN_ID = "JOIN evidencia_definicion d ON d.id = {alias}.evidencia_definicion_id AND d.activa"
+_ACTIVE_JOIN_NOMBRE = "JOIN evidencia_definicion d ON d.nombre = {alias}.evidencia_nombre AND d.activa"
+
+# Definición para una fila de `evidencias` (sin materia): la de la materia de la carga
+# si existe; si no, una activa con ese nombre; si no, la más antigua.
+DEFINICION_POR_NOMBRE_SQL = """
+    SELECT dn.id FROM evidencia_definicion dn
+    WHERE dn.nombre = {nombre}
+    ORDER BY dn.materia_id = {materia} DESC NULLS LAST, dn.activa DESC, dn.id
+    LIMIT 1
+"""
+
+_disponibles: Set[str] = set()
+
+
+_COLUMN_SQL = (
+    "SELECT 1 FROM information_schema.columns "
+    "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s"
+)
+
+
+def ref_disponible(cur, tabla: str = "evidencias") -> bool:
+    """True si `tabla` ya tiene la columna evidencia_definicion_id (se recuerda una vez confirmada)."""
+    if tabla in _disponibles:
+        return True
+    if cur is None:
+        return False
+    try:
+        cur.execute(_COLUMN_SQL, [tabla, COLUMN])
+        if cur.fetchone():
+            _disponibles.add(tabla)
+    except Exception:
+        return False
+    return tabla in _disponibles
+
+
+async def aref_disponible(cur, tabla: str = "evidencias") -> bool:
+    """ref_disponible() para cursores async."""
+    if tabla in _disponibles:
+        return True
+    if cur is None:
+        return False
+    try:
+        await cur.execute(_COLUMN_SQL, [tabla, COLUMN])
+        if await cur.fetchone():
+            _disponibles.add(tabla)
+    except Exception:
+        return False
+    return tabla in _disponibles
+
+
+def active_join(cur, alias: str = "e", tabla: str = "evidencias") -> str:
+    """JOIN con definiciones activas para `alias` (por id si la columna existe; si no, por nombre)."""
+    plantilla = _ACTIVE_JOIN_ID if ref_disponible(cur, tabla) else _ACTIVE_JOIN_NOMBRE
+    return plantilla.format(alias=alias)
+
+
+async def aactive_join(cur, alias: str = "e", tabla: str = "evidencias") -> str:
+    """active_join() para cursores async."""
+    plantilla = _ACTIVE_JOIN_ID if await aref_disponible(cur, tabla) else _ACTIVE_JOIN_NOMBRE
+    return plantilla.format(alias=alias)
+
+
+def vincular_definiciones(cur, definicion_ids: Iterable[Optional[int]],
+                          diferidos: Optional[Dict[str, Set[Any]]] = None) -> int:
+    """Asigna las definiciones dadas a las filas con su nombre que aún no tienen definición.
+
+    Para definiciones creadas después de cargar evidencias; recalcula el resumen diario
+    de las fichas cuyas filas de `evidencias` cambiaron y luego el rollup de los pares
+    (ficha, materia) de `evidencias_detalle` (siempre en ese orden: advisory locks).
+    Con `diferidos` ({"documentos": set, "pares": set}) solo acumula lo afectado: las
+    cargas lo suman a su propio recálculo, que hacen una sola vez al final. Sin commit.
+    """
+    ids: List[int] = sorted({int(i) for i in definicion_ids if i})
+    if not ids or not ref_disponible(cur, "evidencias_detalle"):
+        return 0
+    cur.execute(
+        """
+        UPDATE evidencias_detalle e SET evidencia_definicion_id = d.id
+        FROM evidencia_definicion d
+        WHERE d.id = ANY(%s) AND e.materia_id = d.materia_id AND e.evidencia_nombre = d.nombre
+          AND e.evidencia_definicion_id IS NULL
+        RETURNING e.ficha_id, e.materia_id
+        """,
+        [ids],
+    )
+    pares = {(r["ficha_id"], r["materia_id"]) if isinstance(r, dict) else (r[0], r[1]) for r in cur.fetchall() or []}
+    n = cur.rowcount
+    docs: List[str] = []
+    if ref_disponible(cur, "evidencias"):
+        cur.execute(
+            """
+            UPDATE evidencias e SET evidencia_definicion_id = d.id
+            FROM (SELECT DISTINCT ON (nombre) nombre, id FROM evidencia_definicion
+                  WHERE id = ANY(%s) ORDER BY nombre, activa DESC, id) d
+            WHERE e.evidencia_nombre = d.nombre AND e.evidencia_definicion_id IS NULL
+            RETURNING e.documento
+            """,
+            [ids],
+        )
+        docs = [r["documento"] if isinstance(r, dict) else r[0] for r in cur.fetchall() or []]
+        n += len(docs)
+    if diferidos is not None:
+        diferidos.setdefault("documentos", set()).update(docs)
+        diferidos.setdefault("pares", set()).update(pares)
+        return n
+    # Best-effort (savepoint propio: la lectura de fichas también queda dentro); los scripts reconstruyen
+    if docs:
+        from .evidencias_resumen import refresh_documentos  # evita import circular
+        try:
+            with cur.connection.transaction():
+                refresh_documentos(cur, docs)
+        except Exception:
+            pass
+    if pares:
+        from .aprobacion_diaria import refresh_pares  # evita import circular
+        try:
+            refresh_pares(cur, pares)
+        except Exception:
+            pass
+    return n
+
+
+def repuntar_evidencias(cur, definicion_ids: Iterable[Optional[int]]) -> int:
+    """Tras activar/desactivar definiciones: re-apunta filas de `evidencias` (sin materia).
+
+    Una fila de `evidencias` queda fijada a una sola definición; si esa está inactiva y
+    hay otra activa con el mismo nombre (otra materia), pasa a la activa. Así cuenta en
+    dashboards igual que con la unión por nombre. Recalcula el resumen diario de los
+    documentos movidos (best-effort). Sin commit.
+    """
+    ids: List[int] = sorted({int(i) for i in definicion_ids if i})
+    if not ids or not ref_disponible(cur, "evidencias"):
+        return 0
+    cur.execute(
+        """
+        UPDATE evidencias e SET evidencia_definicion_id = a.id
+        FROM (SELECT DISTINCT ON (nombre) nombre, id FROM evidencia_definicion
+              WHERE activa AND nombre IN (SELECT nombre FROM evidencia_definicion WHERE id = ANY(%s))
+              ORDER BY nombre, id) a
+        WHERE e.evidencia_nombre = a.nombre
+          AND e.evidencia_definicion_id IS DISTINCT FROM a.id
+          AND NOT EXISTS (SELECT 1 FROM evidencia_definicion p
+                          WHERE p.id = e.evidencia_definicion_id AND p.activa)
+        RETURNING e.documento
+        """,
+        [ids],
+    )
+    docs = [r["documento"] if isinstance(r, dict) else r[0] for r in cur.fetchall() or []]
+    if docs:
+        from .evidencias_resumen import refresh_documentos  # evita import circular
+        try:
+            with cur.connection.transaction():
+                refresh_documentos(cur, docs)
+        except Exception:
+            pass
+    return len(docs)
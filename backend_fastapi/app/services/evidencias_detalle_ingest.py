@@ -0,0 +1,88 @@
+import datetime
+from typing import Dict, Optional
+import pandas as pd
+from ..utils.bulk import create_staging, copy_rows
+from .evidencia_definicion_ref import ref_disponible
+
+# Carga masiva de evidencias_detalle: COPY del DataFrame ya resuelto a una tabla
+# temporal y un único INSERT ... SELECT ... ON CONFLICT (ver calificaciones_ingest).
+
+STAGING_TABLE = "stg_evidencias_detalle"
+
+STAGING_COLUMNS = [
+    ("seq", "integer"),  # orden en el archivo: ante claves repetidas gana la última
+    ("materia_id", "integer"),
+    ("ficha_id", "integer"),
+    ("estudiante_nombre", "text"),
+    ("estudiante_documento", "text"),
+    ("evidencia_nombre", "text"),
+    ("trimestre", "integer"),
+    ("nota", "numeric"),
+    ("letra", "text"),
+    ("estado", "text"),
+    ("observaciones", "text"),
+]
+
+_COPY_COLUMNS = [c for c, _ in STAGING_COLUMNS]
+
+
+def load_staging(cur, frame: pd.DataFrame) -> int:
+    """`frame` debe traer las columnas de STAGING_COLUMNS salvo `seq` (orden de filas)."""
+    create_staging(cur, STAGING_TABLE, STAGING_COLUMNS)
+    out = frame[_COPY_COLUMNS[1:]].copy()
+    out.insert(0, "seq", range(len(out)))
+    # object + None: COPY necesita tipos de Python (int, float, str) y NULL en lugar de NaN
+    out = out.astype(object).where(out.notna(), None)
+    return copy_rows(cur, STAGING_TABLE, _COPY_COLUMNS, out.itertuples(index=False, name=None))
+
+
+def merge(cur, cargado_por: Optional[int], fecha_carga: datetime.date) -> Dict[str, int]:
+    """Upsert desde staging. Retorna {"merged": claves distintas, "inserted": nuevas}.
+
+    Con migrations/004 aplicada también fija evidencia_definicion_id por (materia_id, nombre).
+    """
+    if ref_disponible(cur, "evidencias_detalle"):
+        ref_col, ref_val, ref_join = (
+            ", evidencia_definicion_id",
+            ", d.id AS evidencia_definicion_id",
+            "LEFT JOIN evidencia_definicion d ON d.materia_id = s.materia_id AND d.nombre = s.evidencia_nombre",
+        )
+        ref_set = "evidencia_definicion_id = EXCLUDED.evidencia_definicion_id,"
+    else:
+        ref_col = ref_val = ref_join = ref_set = ""
+    cur.execute(
+        f"""
+        WITH src AS (
+            SELECT DISTINCT ON (s.materia_id, s.estudiante_documento, s.evidencia_nombre, s.trimestre) s.*{ref_val}
+            FROM {STAGING_TABLE} s
+            {ref_join}
+            ORDER BY s.materia_id, s.estudiante_documento, s.evidencia_nombre, s.trimestre, s.seq DESC
+        ), up AS (
+            INSERT INTO evidencias_detalle (
+                materia_id, ficha_id, estudiante_nombre, estudiante_documento, evidencia_nombre,
+                trimestre, nota, letra, estado, observaciones, cargado_por, fecha_carga{ref_col}
+            )
+            SELECT materia_id, ficha_id, estudiante_nombre, estudiante_documento, evidencia_nombre,
+                   trimestre, nota, letra, estado, observaciones, %s, %s{ref_col}
+            FROM src
+            ON CONFLICT (materia_id, estudiante_documento, evidencia_nombre, trimestre) DO UPDATE SET
+                {ref_set}
+                ficha_id = EXCLUDED.ficha_id,
+                estudiante_nombre = EXCLUDED.estudiante_nombre,
+                nota = EXCLUDED.nota,
+                letra = EXCLUDED.letra,
+                estado = EXCLUDED.estado,
+                observaciones = EXCLUDED.observaciones,
+                cargado_por = EXCLUDED.cargado_por,
+                fecha_carga = EXCLUDED.fecha_carga,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) AS merged, COUNT(*) FILTER (WHERE inserted) AS inserted FROM up
+        """,
+        [cargado_por, fecha_carga],
+    )
+    row = cur.fetchone()
+    if isinstance(row, dict):
+        return {"merged": int(row["merged"] or 0), "inserted": int(row["inserted"] or 0)}
+    return {"merged": int(row[0] or 0), "inserted": int(row[1] or 0)}
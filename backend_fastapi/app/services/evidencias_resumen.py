@@ -0,0 +1,267 @@
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .evidencia_definicion_ref import aactive_join, active_join, ref_disponible
+
+# Resumen diario de la tabla `evidencias` (migrations/002_evidencias_resumen_diario.sql).
+# Las cargas que escriben `evidencias` recalculan, en su misma transacción, las
+# filas de las fichas afectadas; los dashboards leen conteos del resumen en lugar
+# de recorrer evidencias JOIN evidencia_definicion en cada request. El filtro
+# `evidencia_definicion.activa` se aplica al leer (por evidencia_definicion_id si
+# migrations/004 está aplicada; si no, por nombre), así activar/desactivar no
+# requiere recalcular.
+
+RESUMEN_TABLE = "evidencias_resumen_diario"
+
+# Advisory locks (_LOCK_KEY, ficha_id; 0 = sin ficha): serializan los recálculos
+# (DELETE + INSERT) de una misma ficha hasta el commit; fichas distintas no se esperan.
+# Se toman en orden de id. La reconstrucción completa bloquea la tabla.
+_LOCK_KEY = 742_031_009
+
+_LOCK_SQL = "SELECT pg_advisory_xact_lock(%s, k) FROM unnest(%s::int[]) AS t(k) ORDER BY k"
+
+_available = False
+
+_SELECT_SQL = """
+    SELECT NULLIF(s.ficha_id, 0) AS ficha_id,
+           e.evidencia_nombre,
+           {ref_col}(e.created_at AT TIME ZONE 'UTC')::date AS dia,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE e.letra = 'A'),
+           COUNT(*) FILTER (WHERE e.letra = 'D'),
+           COUNT(*) FILTER (WHERE e.letra = '-'),
+           COUNT(*) FILTER (WHERE e.letra IS NULL)
+    FROM evidencias e
+    JOIN estudiantes s ON s.documento = e.documento
+"""
+
+_INSERT_PREFIX = (
+    f"INSERT INTO {RESUMEN_TABLE} "
+    "(ficha_id, evidencia_nombre, {ref_col}dia, total, aprobadas, reprobadas, no_entrego, pendientes) "
+)
+
+
+def _insert_select(cur) -> Tuple[str, str]:
+    """(INSERT ... SELECT ... FROM, GROUP BY) con evidencia_definicion_id si ambas tablas lo tienen."""
+    con_ref = ref_disponible(cur, RESUMEN_TABLE) and ref_disponible(cur, "evidencias")
+    sql = _INSERT_PREFIX.format(ref_col="evidencia_definicion_id, " if con_ref else "") + _SELECT_SQL.format(
+        ref_col="e.evidencia_definicion_id, " if con_ref else ""
+    )
+    return sql, (" GROUP BY 1, 2, 3, 4" if con_ref else " GROUP BY 1, 2, 3")
+
+
+def _first(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return list(row.values())[0]
+    return row[0]
+
+
+def resumen_disponible(cur) -> bool:
+    """True si la migración del resumen está aplicada (se recuerda una vez confirmada)."""
+    global _available
+    if _available:
+        return True
+    try:
+        cur.execute("SELECT to_regclass(%s)", [RESUMEN_TABLE])
+        _available = _first(cur.fetchone()) is not None
+    except Exception:
+        return False
+    return _available
+
+
+async def aresumen_disponible(cur) -> bool:
+    """resumen_disponible() para cursores async."""
+    global _available
+    if _available:
+        return True
+    try:
+        await cur.execute("SELECT to_regclass(%s)", [RESUMEN_TABLE])
+        _available = _first(await cur.fetchone()) is not None
+    except Exception:
+        return False
+    return _available
+
+
+def _split(fichas: Iterable[Optional[int]]) -> Tuple[List[int], bool]:
+    ids: Set[int] = set()
+    sin_ficha = False
+    for f in fichas:
+        if f is None or f == 0:
+            sin_ficha = True
+        else:
+            ids.add(int(f))
+    return sorted(ids), sin_ficha
+
+
+def refresh_fichas(cur, fichas: Iterable[Optional[int]]) -> int:
+    """Recalcula el resumen de las fichas dadas (None = estudiantes sin ficha). Sin commit.
+
+    Corre en un savepoint: ante error se deshace solo el recálculo y se propaga la excepción.
+    """
+    ids, sin_ficha = _split(fichas)
+    if not ids and not sin_ficha:
+        return 0
+    if not resumen_disponible(cur):
+        return 0
+    # Savepoint: si falla, la carga que lo invoca sigue siendo válida (el script reconstruye)
+    with cur.connection.transaction():
+        cur.execute(_LOCK_SQL, [_LOCK_KEY, ([0] if sin_ficha else []) + ids])
+        cur.execute(
+            f"DELETE FROM {RESUMEN_TABLE} WHERE ficha_id = ANY(%s) OR (%s AND ficha_id IS NULL)",
+            [ids, sin_ficha],
+        )
+        insert_sql, group_by = _insert_select(cur)
+        cur.execute(
+            insert_sql
+            + " WHERE NULLIF(s.ficha_id, 0) = ANY(%s) OR (%s AND NULLIF(s.ficha_id, 0) IS NULL)" + group_by,
+            [ids, sin_ficha],
+        )
+        return cur.rowcount
+
+
+def refresh_documentos(cur, documentos: Iterable[str], incluir_sin_ficha: bool = False) -> int:
+    """Recalcula las fichas a las que pertenecen `documentos` (estado posterior a la carga).
+
+    `incluir_sin_ficha` debe ser True si la carga pudo asignar ficha a estudiantes
+    que no tenían: sus evidencias salen del grupo sin ficha.
+    """
+    docs = sorted({d for d in documentos if d})
+    if not docs or not resumen_disponible(cur):
+        return 0
+    cur.execute("SELECT DISTINCT NULLIF(ficha_id, 0) FROM estudiantes WHERE documento = ANY(%s)", [docs])
+    fichas: List[Optional[int]] = [_first(r) for r in cur.fetchall() or []]
+    if incluir_sin_ficha:
+        fichas.append(None)
+    return refresh_fichas(cur, fichas)
+
+
+def refresh_all(cur) -> int:
+    """Reconstrucción completa (script / mantenimiento). Sin commit."""
+    if not resumen_disponible(cur):
+        return 0
+    # Espera a los recálculos en curso y bloquea los nuevos (las lecturas siguen)
+    cur.execute(f"LOCK TABLE {RESUMEN_TABLE} IN EXCLUSIVE MODE")
+    cur.execute(f"DELETE FROM {RESUMEN_TABLE}")
+    insert_sql, group_by = _insert_select(cur)
+    cur.execute(insert_sql + group_by)
+    return cur.rowcount
+
+
+# ---- Lecturas para dashboards (None = resumen no disponible: usar la consulta original) ----
+# Cada lectura tiene variante async (prefijo `a`) para las rutas `async def`; el SQL es el mismo.
+
+def _join_activas(cur) -> str:
+    return active_join(cur, "r", RESUMEN_TABLE)
+
+
+def _conteos_activos_sql(join_activas: str, actual_desde: datetime.date,
+                         previo_desde: datetime.date) -> Tuple[str, List[Any]]:
+    sql = f"""
+        SELECT COALESCE(SUM(r.total), 0) AS total,
+               COALESCE(SUM(r.total - r.pendientes), 0) AS calificadas,
+               COALESCE(SUM(r.aprobadas + r.reprobadas), 0) AS entregadas,
+               COALESCE(SUM(r.pendientes), 0) AS pendientes,
+               COUNT(DISTINCT r.evidencia_nombre) AS distintas,
+               COALESCE(SUM(r.total - r.pendientes) FILTER (WHERE r.dia >= %s), 0) AS calificadas_actual,
+               COALESCE(SUM(r.total - r.pendientes) FILTER (WHERE r.dia >= %s AND r.dia < %s), 0) AS calificadas_previo,
+               COALESCE(SUM(r.aprobadas + r.reprobadas) FILTER (WHERE r.dia >= %s), 0) AS entregadas_actual,
+               COALESCE(SUM(r.aprobadas + r.reprobadas) FILTER (WHERE r.dia >= %s AND r.dia < %s), 0) AS entregadas_previo
+        FROM {RESUMEN_TABLE} r
+        {join_activas}
+        """
+    return sql, [actual_desde, previo_desde, actual_desde, actual_desde, previo_desde, actual_desde]
+
+
+def _conteos_activos_row(row: Any) -> Dict[str, int]:
+    return {k: int(v or 0) for k, v in dict(row or {}).items()}
+
+
+def conteos_activos(cur, actual_desde: datetime.date, previo_desde: datetime.date) -> Optional[Dict[str, int]]:
+    """Conteos sobre evidencias con definición activa, totales y por periodo, en una consulta.
+
+    Periodo actual: dia >= actual_desde; previo: previo_desde <= dia < actual_desde.
+    """
+    if not resumen_disponible(cur):
+        return None
+    cur.execute(*_conteos_activos_sql(_join_activas(cur), actual_desde, previo_desde))
+    return _conteos_activos_row(cur.fetchone())
+
+
+async def aconteos_activos(cur, actual_desde: datetime.date, previo_desde: datetime.date) -> Optional[Dict[str, int]]:
+    if not await aresumen_disponible(cur):
+        return None
+    join_activas = await aactive_join(cur, "r", RESUMEN_TABLE)
+    await cur.execute(*_conteos_activos_sql(join_activas, actual_desde, previo_desde))
+    return _conteos_activos_row(await cur.fetchone())
+
+
+_CONTEOS_LETRAS_SQL = (
+    f"SELECT COALESCE(SUM(aprobadas), 0) AS a, COALESCE(SUM(reprobadas), 0) AS d, "
+    f"COALESCE(SUM(no_entrego), 0) AS guion, COALESCE(SUM(pendientes), 0) AS pendientes FROM {RESUMEN_TABLE}"
+)
+
+
+def _conteos_letras_row(row: Any) -> Dict[str, int]:
+    row = dict(row or {})
+    return {"A": int(row.get("a") or 0), "D": int(row.get("d") or 0),
+            "-": int(row.get("guion") or 0), "pendientes": int(row.get("pendientes") or 0)}
+
+
+def conteos_letras(cur) -> Optional[Dict[str, int]]:
+    """Totales por letra sobre todas las evidencias (sin filtro de definición)."""
+    if not resumen_disponible(cur):
+        return None
+    cur.execute(_CONTEOS_LETRAS_SQL)
+    return _conteos_letras_row(cur.fetchone())
+
+
+async def aconteos_letras(cur) -> Optional[Dict[str, int]]:
+    if not await aresumen_disponible(cur):
+        return None
+    await cur.execute(_CONTEOS_LETRAS_SQL)
+    return _conteos_letras_row(await cur.fetchone())
+
+
+def _por_evidencia_sql(join_activas: str, limit: Optional[int], orden: str) -> Tuple[str, List[Any]]:
+    order_by = "SUM(r.total) DESC" if orden == "total" else "r.evidencia_nombre"
+    sql = f"""
+        SELECT r.evidencia_nombre,
+               SUM(r.total) AS total,
+               SUM(r.aprobadas) AS aprobadas,
+               SUM(r.reprobadas) AS reprobadas,
+               SUM(r.no_entrego) AS no_entrego,
+               SUM(r.pendientes) AS pendientes
+        FROM {RESUMEN_TABLE} r
+        {join_activas}
+        GROUP BY r.evidencia_nombre
+        ORDER BY {order_by}
+    """
+    params: List[Any] = []
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+def _por_evidencia_rows(rows: Any) -> List[Dict[str, Any]]:
+    return [
+        {k: (int(v) if k != "evidencia_nombre" and v is not None else v) for k, v in dict(r).items()}
+        for r in rows or []
+    ]
+
+
+def por_evidencia(cur, solo_activas: bool, limit: Optional[int] = None, orden: str = "nombre") -> Optional[List[Dict[str, Any]]]:
+    """Conteos agrupados por evidencia_nombre (orden: 'nombre' o 'total' desc)."""
+    if not resumen_disponible(cur):
+        return None
+    cur.execute(*_por_evidencia_sql(_join_activas(cur) if solo_activas else "", limit, orden))
+    return _por_evidencia_rows(cur.fetchall())
+
+
+async def apor_evidencia(cur, solo_activas: bool, limit: Optional[int] = None, orden: str = "nombre") -> Optional[List[Dict[str, Any]]]:
+    if not await aresumen_disponible(cur):
+        return None
+    join_activas = await aactive_join(cur, "r", RESUMEN_TABLE) if solo_activas else ""
+    await cur.execute(*_por_evidencia_sql(join_activas, limit, orden))
+    return _por_evidencia_rows(await cur.fetchall())
@@ -2,6 +2,7 @@ from typing import List, Dict, Any
 from psycopg.rows import dict_row
 from ..db import get_conn
 from ..utils.email import OutgoingEmail
+from .evidencia_definicion_ref import active_join
 
 # Thresholds
 FALTAS_THRESHOLD = 5  # evidencias con letra '-' o NULL
@@ -20,7 +21,7 @@ def fetch_pendientes(limit: int = 50) -> List[PendingResumen]:
       SELECT documento AS estudiante,
              SUM(CASE WHEN letra='-' OR letra IS NULL THEN 1 ELSE 0 END) AS faltas
       FROM evidencias e
-      JOIN evidencia_definicion d ON d.nombre = e.evidencia_nombre AND d.activa
+      {activas}
       GROUP BY documento
       HAVING SUM(CASE WHEN letra='-' OR letra IS NULL THEN 1 ELSE 0 END) >= %s
       ORDER BY faltas DESC
@@ -29,7 +30,7 @@ def fetch_pendientes(limit: int = 50) -> List[PendingResumen]:
     resultados: List[PendingResumen] = []
     with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
         try:
-            cur.execute(sql, [FALTAS_THRESHOLD, limit])
+            cur.execute(sql.format(activas=active_join(cur)), [FALTAS_THRESHOLD, limit])
             for r in cur.fetchall() or []:
                 resultados.append(PendingResumen(r.get("estudiante"), int(r.get("faltas") or 0)))
         except Exception:
@@ -0,0 +1,357 @@
+"""Cola local de trabajos de carga (uploads) con progreso consultable.
+
+El parseo con pandas corre en un pool de procesos y la escritura en BD en un pool
+de hilos, fuera del hilo de la petición. El estado vive en memoria para un polling
+rápido y se persiste (best-effort) en la tabla `upload_jobs` para el historial y
+para consultas atendidas por otro worker de uvicorn.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import HTTPException
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from ..db import get_conn
+
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+# 0 = parsear en el mismo hilo del trabajo (sin pool de procesos)
+UPLOAD_PARSE_PROCESSES = int(os.getenv("UPLOAD_PARSE_PROCESSES", "2"))
+# Segundos que un trabajo terminado permanece en memoria antes de leerse solo desde BD
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))
+
+MAX_ERRORES = 200
+_PERSIST_INTERVAL = 1.0  # s entre escrituras de progreso a BD
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_PROCESANDO = "procesando"
+ESTADO_COMPLETADO = "completado"
+ESTADO_FALLIDO = "fallido"
+
+_jobs: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+_threads: Optional[ThreadPoolExecutor] = None
+_procs: Optional[ProcessPoolExecutor] = None
+
+_dumps = partial(json.dumps, default=str)
+
+# Firma de las funciones de aplicación: (parsed, progress) -> resultado
+ApplyFn = Callable[[Any, Callable[..., None]], Dict[str, Any]]
+
+
+def _thread_pool() -> ThreadPoolExecutor:
+    global _threads
+    with _lock:
+        if _threads is None:
+            _threads = ThreadPoolExecutor(max_workers=max(1, UPLOAD_JOB_WORKERS), thread_name_prefix="upload-job")
+        return _threads
+
+
+def _process_pool() -> Optional[ProcessPoolExecutor]:
+    global _procs
+    if UPLOAD_PARSE_PROCESSES <= 0:
+        return None
+    with _lock:
+        if _procs is None:
+            # spawn: no heredar hilos ni conexiones del pool de BD del proceso padre
+            _procs = ProcessPoolExecutor(
+                max_workers=UPLOAD_PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _procs
+
+
+def _reset_process_pool(pool: ProcessPoolExecutor) -> None:
+    global _procs
+    with _lock:
+        if _procs is pool:
+            _procs = None
+    pool.shutdown(wait=False)
+
+
+def run_parse(fn: Callable[..., Any], *args: Any) -> Any:
+    """Ejecuta un parser en el proceso hijo. Las HTTPException se devuelven como valor
+    (no siempre son serializables) y se relanzan en el hilo del trabajo."""
+    try:
+        return fn(*args)
+    except HTTPException as e:
+        return {"_http_error": [e.status_code, e.detail]}
+
+
+def _parse(fn: Callable[..., Any], args: tuple) -> Any:
+    pool = _process_pool()
+    if pool is not None:
+        try:
+            parsed = pool.submit(run_parse, fn, *args).result()
+        except HTTPException:
+            raise
+        except BrokenProcessPool:
+            # Proceso hijo terminado: descartar el pool (se recrea en el próximo trabajo)
+            # y reintentar en el hilo actual
+            _reset_process_pool(pool)
+            parsed = run_parse(fn, *args)
+    else:
+        parsed = run_parse(fn, *args)
+    if isinstance(parsed, dict) and "_http_error" in parsed:
+        status, detail = parsed["_http_error"]
+        raise HTTPException(status_code=status, detail=detail)
+    return parsed
+
+
+def _snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (list(v) if isinstance(v, list) else v) for k, v in job.items()}
+
+
+def _persist(job: Dict[str, Any]) -> None:
+    try:
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO upload_jobs (id, tipo, estado, etapa, porcentaje, filename, user_id, user_email,
+                                         parametros, errores, resultado, error, created_at, updated_at, finished_at)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, to_timestamp(%s), CURRENT_TIMESTAMP,
+                        CASE WHEN %s THEN CURRENT_TIMESTAMP END)
+                ON CONFLICT (id) DO UPDATE SET
+                    estado = EXCLUDED.estado, etapa = EXCLUDED.etapa, porcentaje = EXCLUDED.porcentaje,
+                    errores = EXCLUDED.errores, resultado = EXCLUDED.resultado, error = EXCLUDED.error,
+                    updated_at = CURRENT_TIMESTAMP, finished_at = EXCLUDED.finished_at
+                """,
+                [
+                    job["id"], job["tipo"], job["estado"], job["etapa"], job["porcentaje"], job.get("filename"),
+                    job.get("user_id"), job.get("user_email"),
+                    Jsonb(job.get("parametros") or {}, dumps=_dumps),
+                    Jsonb(job.get("errores") or [], dumps=_dumps),
+                    Jsonb(job["resultado"], dumps=_dumps) if job.get("resultado") is not None else None,
+                    job.get("error"),
+                    job["created_at"],
+                    job["estado"] in (ESTADO_COMPLETADO, ESTADO_FALLIDO),
+                ],
+            )
+            conn.commit()
+    except Exception:
+        # Sin tabla upload_jobs (migración no aplicada) el estado sigue disponible en memoria
+        pass
+
+
+class JobProgress:
+    """Callback de progreso entregado a las funciones de aplicación."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._last_persist = 0.0
+
+    def __call__(self, etapa: Optional[str] = None, porcentaje: Optional[float] = None,
+                 errores: Optional[List[str]] = None) -> None:
+        with _lock:
+            job = _jobs.get(self.job_id)
+            if job is None:
+                return
+            if etapa:
+                job["etapa"] = etapa
+            if porcentaje is not None:
+                job["porcentaje"] = max(0, min(100, int(porcentaje)))
+            if errores:
+                room = MAX_ERRORES - len(job["errores"])
+                if room > 0:
+                    job["errores"].extend(errores[:room])
+            job["updated_at"] = time.time()
+            snap = _snapshot(job)
+        now = time.monotonic()
+        if now - self._last_persist >= _PERSIST_INTERVAL:
+            self._last_persist = now
+            _persist(snap)
+
+
+def _prune() -> None:
+    limit = time.time() - UPLOAD_JOB_TTL
+    with _lock:
+        for jid in [j for j, job in _jobs.items() if job.get("finished_at") and job["finished_at"] < limit]:
+            _jobs.pop(jid, None)
+
+
+def _finish(job_id: str, estado: str, resultado: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    with _lock:
+        job = _jobs[job_id]
+        job["estado"] = estado
+        job["etapa"] = "fin" if estado == ESTADO_COMPLETADO else job["etapa"]
+        if estado == ESTADO_COMPLETADO:
+            job["porcentaje"] = 100
+        job["resultado"] = resultado
+        job["error"] = error
+        if resultado and isinstance(resultado.get("errores"), list):
+            # Los errores del resultado final reemplazan a los parciales (son su superconjunto)
+            job["errores"] = list(resultado["errores"][:MAX_ERRORES])
+        job["finished_at"] = job["updated_at"] = time.time()
+        snap = _snapshot(job)
+    _persist(snap)
+
+
+def _run(job_id: str, apply_fn: ApplyFn, parse_fn: Optional[Callable[..., Any]], parse_args: tuple, data: Any,
+         cleanup: Optional[Callable[[], None]] = None) -> None:
+    progress = JobProgress(job_id)
+    try:
+        with _lock:
+            _jobs[job_id]["estado"] = ESTADO_PROCESANDO
+        parsed = data
+        if parse_fn is not None:
+            progress("parseo", 0)
+            parsed = _parse(parse_fn, parse_args)
+        progress("escritura", 10)
+        resultado = apply_fn(parsed, progress)
+        _finish(job_id, ESTADO_COMPLETADO, resultado=resultado)
+    except HTTPException as e:
+        _finish(job_id, ESTADO_FALLIDO, error=str(e.detail))
+    except Exception as e:
+        _finish(job_id, ESTADO_FALLIDO, error=str(e))
+    finally:
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception:
+                pass
+
+
+def submit_job(
+    tipo: str,
+    user: Optional[Dict[str, Any]],
+    apply_fn: ApplyFn,
+    parse_fn: Optional[Callable[..., Any]] = None,
+    parse_args: tuple = (),
+    data: Any = None,
+    cleanup: Optional[Callable[[], None]] = None,
+    filename: Optional[str] = None,
+    parametros: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Registra un trabajo y lo encola. `parse_fn` (top-level, serializable) corre en el
+    pool de procesos con `parse_args`; `apply_fn(parsed, progress)` corre en el pool de hilos.
+    Sin `parse_fn`, `apply_fn` recibe `data` tal cual (p.ej. un payload JSON ya validado).
+    `cleanup` se ejecuta al terminar (p.ej. borrar el archivo temporal del upload)."""
+    _prune()
+    user = user if isinstance(user, dict) else {}
+    now = time.time()
+    job = {
+        "id": str(uuid.uuid4()),
+        "tipo": tipo,
+        "estado": ESTADO_PENDIENTE,
+        "etapa": "en_cola",
+        "porcentaje": 0,
+        "filename": filename,
+        "user_id": _user_id(user),
+        "user_email": user.get("email"),
+        "parametros": parametros or {},
+        "errores": [],
+        "resultado": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    with _lock:
+        _jobs[job["id"]] = job
+        snap = _snapshot(job)
+    _persist(snap)
+    _thread_pool().submit(_run, job["id"], apply_fn, parse_fn, parse_args, data, cleanup)
+    return snap
+
+
+def _user_id(user: Dict[str, Any]) -> Optional[int]:
+    raw = user.get("id") or user.get("sub")
+    try:
+        return int(raw) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return _snapshot(job)
+    try:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            # Columnas TIMESTAMPTZ: el epoch no depende de la zona horaria de la sesión
+            cur.execute(
+                """
+                SELECT id, tipo, estado, etapa, porcentaje, filename, user_id, user_email, parametros,
+                       errores, resultado, error,
+                       EXTRACT(EPOCH FROM created_at) AS created_at,
+                       EXTRACT(EPOCH FROM updated_at) AS updated_at,
+                       EXTRACT(EPOCH FROM finished_at) AS finished_at
+                FROM upload_jobs WHERE id = %s
+                """,
+                [job_id],
+            )
+            row = cur.fetchone()
+    except Exception:
+        row = None
+    if not row:
+        return None
+    for k in ("created_at", "updated_at", "finished_at"):
+        if row.get(k) is not None:
+            row[k] = float(row[k])
+    row["errores"] = row.get("errores") or []
+    return row
+
+
+def list_open_jobs(tipos: List[str], limit: int) -> List[Dict[str, Any]]:
+    """Trabajos no completados (en cola, en curso o fallidos) para el historial de cargas."""
+    try:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(
+                """
+                SELECT id, tipo, estado, etapa, porcentaje, filename, parametros, error, created_at
+                FROM upload_jobs
+                WHERE tipo = ANY(%s) AND estado <> %s
+                ORDER BY created_at DESC
+                LIMIT %s
+                """,
+                [tipos, ESTADO_COMPLETADO, limit],
+            )
+            return cur.fetchall() or []
+    except Exception:
+        return []
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": job["id"],
+        "tipo": job.get("tipo"),
+        "estado": job.get("estado"),
+        "etapa": job.get("etapa"),
+        "porcentaje": job.get("porcentaje", 0),
+        "filename": job.get("filename"),
+        "errores": (job.get("errores") or [])[:50],
+        "totalErrores": len(job.get("errores") or []),
+        "resultado": job.get("resultado"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+
+def accepted_payload(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta 202 de los endpoints de carga en modo background."""
+    return {
+        "success": True,
+        "background": True,
+        "jobId": job["id"],
+        "estado": job["estado"],
+        "statusUrl": f"/api/v1/uploads/{job['id']}",
+    }
+
+
+def shutdown(wait: bool = False) -> None:
+    global _threads, _procs
+    with _lock:
+        threads, procs = _threads, _procs
+        _threads = _procs = None
+    if threads is not None:
+        threads.shutdown(wait=wait)
+    if procs is not None:
+        procs.shutdown(wait=wait)
@@ -0,0 +1,356 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from ..utils.bulk import create_staging, copy_rows, analyze_staging
+from .evidencias_resumen import refresh_documentos
+from .aprobacion_diaria import refresh_pares
+from .evidencia_definicion_ref import DEFINICION_POR_NOMBRE_SQL, ref_disponible, vincular_definiciones
+
+# Motor de ingesta set-based para la carga wide de evidencias.
+# Los registros parseados se cargan con COPY en una tabla temporal y las
+# definiciones, estudiantes, vínculo de ficha y evidencias se aplican con unas
+# pocas sentencias INSERT ... SELECT / UPDATE ... FROM, en lugar de 5-8 round
+# trips y un SAVEPOINT por celda.
+
+STAGING_TABLE = "stg_evidencias_wide"
+
+STAGING_COLUMNS = [
+    ("seq", "integer"),        # posición en `registros` (orden de aparición)
+    ("fila", "integer"),       # fila Excel (para reportar errores)
+    ("documento", "text"),
+    ("nombre", "text"),
+    ("apellido", "text"),
+    ("correo", "text"),
+    ("evidencia", "text"),
+    ("letra", "text"),
+    ("estado", "text"),
+    ("motivo", "text"),        # NULL = fila válida; texto = rechazo
+]
+
+_COPY_COLUMNS = [c for c, _ in STAGING_COLUMNS if c != "motivo"]
+
+MAX_LEN = 255
+
+
+def _truncate(s: Optional[str], max_len: int = MAX_LEN) -> Optional[str]:
+    if s is None:
+        return None
+    s = str(s)
+    return s if len(s) <= max_len else s[:max_len]
+
+
+def create_wide_staging(cur) -> None:
+    create_staging(cur, STAGING_TABLE, STAGING_COLUMNS)
+
+
+def append_staging(cur, registros: List[Dict[str, Any]], seq_start: int = 0) -> int:
+    """COPY de un lote de registros a staging (sin ANALYZE); `seq` sigue desde `seq_start`."""
+    rows = (
+        (
+            seq,
+            r.get("fila"),
+            r.get("documento"),
+            _truncate(r.get("nombre")),
+            _truncate(r.get("apellido", "")),
+            _truncate(r.get("correo")),
+            _truncate(r.get("evidencia")),
+            r.get("letra"),
+            r.get("estado"),
+        )
+        for seq, r in enumerate(registros, start=seq_start)
+    )
+    return copy_rows(cur, STAGING_TABLE, _COPY_COLUMNS, rows, analyze=False)
+
+
+def load_staging(cur, registros: List[Dict[str, Any]]) -> int:
+    create_wide_staging(cur)
+    written = append_staging(cur, registros)
+    analyze_staging(cur, STAGING_TABLE)
+    return written
+
+
+def mark_invalid(cur) -> None:
+    """Marca rechazos que violarían restricciones de las tablas destino."""
+    cur.execute(
+        f"""
+        UPDATE {STAGING_TABLE} SET motivo = CASE
+            WHEN documento IS NULL OR btrim(documento) = '' THEN 'documento vacío'
+            WHEN length(documento) > {MAX_LEN} THEN 'documento excede {MAX_LEN} caracteres'
+            WHEN evidencia IS NULL OR btrim(evidencia) = '' THEN 'nombre de evidencia vacío'
+            WHEN letra IS NOT NULL AND letra NOT IN ('A','D','-') THEN 'letra inválida ' || quote_literal(letra)
+            WHEN nombre IS NULL THEN 'nombre de estudiante vacío'
+        END
+        WHERE motivo IS NULL
+        """
+    )
+
+
+def apply_definiciones(cur, materia_id: int, ficha_id: Optional[int], docente_id: Optional[int],
+                       diferidos: Optional[Dict[str, Set[Any]]] = None) -> int:
+    """Crea definiciones faltantes (inactivas) con `orden` incremental según primera aparición.
+
+    Las nuevas se asignan a filas previas con su nombre que no tenían definición
+    (recálculos acumulados en `diferidos`, ver vincular_definiciones).
+    """
+    cur.execute(
+        f"""
+        INSERT INTO evidencia_definicion (nombre, ficha_id, materia_id, docente_id, activa, orden)
+        SELECT n.evidencia, %s, %s, %s, FALSE,
+               base.cnt + ROW_NUMBER() OVER (ORDER BY n.pos) - 1
+        FROM (
+            SELECT evidencia, MIN(seq) AS pos
+            FROM {STAGING_TABLE}
+            WHERE motivo IS NULL
+            GROUP BY evidencia
+        ) n
+        CROSS JOIN (SELECT COUNT(*) AS cnt FROM evidencia_definicion WHERE materia_id = %s) base
+        WHERE NOT EXISTS (
+            SELECT 1 FROM evidencia_definicion d WHERE d.materia_id = %s AND d.nombre = n.evidencia
+        )
+        ORDER BY n.pos
+        ON CONFLICT (materia_id, nombre) DO NOTHING
+        RETURNING id
+        """,
+        [ficha_id, materia_id, docente_id, materia_id, materia_id],
+    )
+    ids = [r["id"] if isinstance(r, dict) else r[0] for r in cur.fetchall() or []]
+    # Filas cargadas antes de existir la definición (migrations/004)
+    vincular_definiciones(cur, ids, diferidos)
+    return len(ids)
+
+
+_MIGRAR_SQL = """
+    WITH m AS (
+        SELECT * FROM unnest(%s::text[], %s::text[]) AS t(old_doc, new_doc)
+    ), ev AS (
+        UPDATE evidencias e SET documento = m.new_doc, updated_at = CURRENT_TIMESTAMP
+        FROM m WHERE e.documento = m.old_doc
+    )
+    UPDATE estudiantes s SET documento = m.new_doc, correo = m.new_doc, updated_at = CURRENT_TIMESTAMP
+    FROM m WHERE s.documento = m.old_doc
+"""
+
+
+def resolver_migraciones(candidatos: List[Dict[str, Any]], identidades: List[Dict[str, Any]],
+                         existentes: Set[str]) -> Dict[str, str]:
+    """Decide en memoria las migraciones de documento (documento_actual -> nuevo).
+
+    `candidatos`: estudiantes distintos de la carga (documento, n, a normalizados), en el
+    orden en que se evaluaban uno a uno. `identidades`: estudiantes existentes con esas
+    mismas claves (nombre, apellido). `existentes`: documentos de la carga que ya existen.
+    Reproduce la evaluación secuencial: una migración aplicada cambia el índice que ven
+    los candidatos siguientes, y las cadenas a->b->c se colapsan en a->c.
+    """
+    indice: Dict[Tuple[str, str], List[str]] = {}
+    for r in identidades:
+        indice.setdefault((r["n"], r["a"]), []).append(r["documento"])
+    conocidos = set(existentes) | {r["documento"] for r in identidades}
+    origen: Dict[str, str] = {}  # documento actual -> documento original en BD
+    for c in candidatos:
+        if c["n"] is None or c["a"] is None:
+            continue
+        new_doc = c["documento"]
+        matches = indice.get((c["n"], c["a"]), [])
+        if len(matches) != 1 or matches[0] == new_doc or new_doc in conocidos:
+            continue
+        old_doc = matches[0]
+        matches[0] = new_doc
+        conocidos.discard(old_doc)
+        conocidos.add(new_doc)
+        origen[new_doc] = origen.pop(old_doc, old_doc)
+    return {old: new for new, old in origen.items()}
+
+
+def migrar_correos_por_nombre(cur) -> List[str]:
+    """Heurística de cambio de correo: si nombre+apellido coincide con un único estudiante
+    existente con otro documento, migra sus evidencias al nuevo documento (correo).
+
+    Índice de identidades precargado una vez por carga (usa el índice funcional
+    lower(nombre), lower(apellido)); las migraciones se resuelven en memoria y se
+    aplican en una sola sentencia. Si esa sentencia falla se reintenta por estudiante
+    para reportar la advertencia de cada uno.
+    """
+    cur.execute(
+        f"""
+        SELECT DISTINCT ON (documento) documento, LOWER(nombre) AS n, LOWER(apellido) AS a
+        FROM {STAGING_TABLE}
+        WHERE motivo IS NULL
+        ORDER BY documento, seq
+        """
+    )
+    candidatos = cur.fetchall() or []
+    if not candidatos:
+        return []
+    cur.execute(
+        """
+        SELECT s.documento, LOWER(s.nombre) AS n, LOWER(s.apellido) AS a
+        FROM estudiantes s
+        WHERE (LOWER(s.nombre), LOWER(s.apellido)) IN (
+            SELECT t.n, t.a FROM unnest(%s::text[], %s::text[]) AS t(n, a)
+        )
+        ORDER BY s.id
+        """,
+        [[c["n"] for c in candidatos], [c["a"] for c in candidatos]],
+    )
+    identidades = cur.fetchall() or []
+    cur.execute(
+        "SELECT documento FROM estudiantes WHERE documento = ANY(%s)",
+        [[c["documento"] for c in candidatos]],
+    )
+    existentes = {r["documento"] for r in cur.fetchall() or []}
+    migraciones = resolver_migraciones(candidatos, identidades, existentes)
+    if not migraciones:
+        return []
+    advertencias: List[str] = []
+    try:
+        with cur.connection.transaction():
+            cur.execute(_MIGRAR_SQL, [list(migraciones.keys()), list(migraciones.values())])
+    except Exception:
+        for old_doc, new_doc in migraciones.items():
+            try:
+                with cur.connection.transaction():
+                    cur.execute(_MIGRAR_SQL, [[old_doc], [new_doc]])
+            except Exception as e_h:
+                advertencias.append(f"Advertencia heurística de correo para '{new_doc}': {e_h}")
+    return advertencias
+
+
+def apply_estudiantes(cur) -> int:
+    """Inserta estudiantes nuevos (primera aparición gana) y rechaza filas sin estudiante."""
+    cur.execute(
+        f"""
+        INSERT INTO estudiantes (documento, nombre, apellido, correo)
+        SELECT DISTINCT ON (documento) documento, nombre, apellido, correo
+        FROM {STAGING_TABLE}
+        WHERE motivo IS NULL
+        ORDER BY documento, seq
+        ON CONFLICT (documento) DO NOTHING
+        """
+    )
+    inserted = cur.rowcount
+    cur.execute(
+        f"""
+        UPDATE {STAGING_TABLE} t SET motivo = 'estudiante no registrado'
+        WHERE t.motivo IS NULL
+          AND NOT EXISTS (SELECT 1 FROM estudiantes s WHERE s.documento = t.documento)
+        """
+    )
+    return inserted
+
+
+def apply_ficha(cur, ficha_id: int) -> int:
+    """Asocia la ficha solo a estudiantes sin ficha; nunca reemplaza una ficha existente."""
+    cur.execute(
+        f"""
+        UPDATE estudiantes s SET ficha_id = %s
+        FROM (SELECT DISTINCT documento FROM {STAGING_TABLE} WHERE motivo IS NULL) t
+        WHERE s.documento = t.documento AND (s.ficha_id IS NULL OR s.ficha_id = 0)
+        """,
+        [ficha_id],
+    )
+    return cur.rowcount
+
+
+def apply_evidencias(cur, materia_id: Optional[int] = None) -> int:
+    """Upsert de evidencias. Ante duplicados (documento, evidencia) gana la última aparición.
+
+    Con migrations/004 aplicada fija evidencia_definicion_id (preferencia: definición
+    de `materia_id`); una fila existente conserva la suya si la carga no trae materia.
+    """
+    if not ref_disponible(cur, "evidencias"):
+        cur.execute(
+            f"""
+            INSERT INTO evidencias (documento, evidencia_nombre, letra, estado)
+            SELECT DISTINCT ON (documento, evidencia) documento, evidencia, letra, estado
+            FROM {STAGING_TABLE}
+            WHERE motivo IS NULL
+            ORDER BY documento, evidencia, seq DESC
+            ON CONFLICT (documento, evidencia_nombre) DO UPDATE
+            SET letra = EXCLUDED.letra, estado = EXCLUDED.estado, updated_at = CURRENT_TIMESTAMP
+            """
+        )
+        return cur.rowcount
+    cur.execute(
+        f"""
+        WITH u AS (
+            SELECT DISTINCT ON (documento, evidencia) documento, evidencia, letra, estado
+            FROM {STAGING_TABLE}
+            WHERE motivo IS NULL
+            ORDER BY documento, evidencia, seq DESC
+        ), defs AS (
+            SELECT n.evidencia, ({DEFINICION_POR_NOMBRE_SQL.format(nombre="n.evidencia", materia="%s")}) AS id
+            FROM (SELECT DISTINCT evidencia FROM u) n
+        )
+        INSERT INTO evidencias (documento, evidencia_nombre, letra, estado, evidencia_definicion_id)
+        SELECT u.documento, u.evidencia, u.letra, u.estado, defs.id
+        FROM u, defs
+        WHERE defs.evidencia = u.evidencia
+        ON CONFLICT (documento, evidencia_nombre) DO UPDATE
+        SET letra = EXCLUDED.letra, estado = EXCLUDED.estado, updated_at = CURRENT_TIMESTAMP,
+            evidencia_definicion_id = CASE WHEN %s::int IS NULL
+                THEN COALESCE(evidencias.evidencia_definicion_id, EXCLUDED.evidencia_definicion_id)
+                ELSE EXCLUDED.evidencia_definicion_id END
+        """,
+        [materia_id, materia_id],
+    )
+    return cur.rowcount
+
+
+def collect_rejects(cur) -> List[str]:
+    cur.execute(
+        f"SELECT fila, documento, evidencia, motivo FROM {STAGING_TABLE} WHERE motivo IS NOT NULL ORDER BY seq"
+    )
+    errores = []
+    for r in cur.fetchall() or []:
+        if isinstance(r, dict):
+            fila, doc, evid, motivo = r["fila"], r["documento"], r["evidencia"], r["motivo"]
+        else:
+            fila, doc, evid, motivo = r
+        errores.append(f"Fila {fila}: no se guardó evidencia '{evid}' para {doc or '<vacío>'}: {motivo}")
+    return errores
+
+
+def ingest_wide(
+    cur,
+    registros: Optional[List[Dict[str, Any]]],
+    ficha_id: Optional[int],
+    materia_id: Optional[int],
+    docente_id: Optional[int],
+) -> Dict[str, Any]:
+    """Aplica una carga wide completa sobre el cursor (sin commit).
+
+    `materia_id` solo debe pasarse si la materia existe (FK de evidencia_definicion).
+    El cursor debe usar dict_row. Retorna contadores, advertencias de la heurística
+    de correo y los rechazos por fila ya formateados. Con `registros=None` la staging
+    ya fue cargada por lotes (create_wide_staging + append_staging) en esta transacción.
+    """
+    stats: Dict[str, Any] = {"staging": 0, "definiciones": 0, "estudiantes": 0, "fichas": 0, "evidencias": 0, "resumen": 0}
+    if registros is None:
+        analyze_staging(cur, STAGING_TABLE)
+        cur.execute(f"SELECT COUNT(*) AS n FROM {STAGING_TABLE}")
+        stats["staging"] = int(cur.fetchone()["n"] or 0)
+    else:
+        stats["staging"] = load_staging(cur, registros)
+    mark_invalid(cur)
+    # Recálculos de vincular_definiciones: se hacen junto con los de la carga, al final
+    diferidos: Dict[str, Set[Any]] = {"documentos": set(), "pares": set()}
+    if materia_id:
+        stats["definiciones"] = apply_definiciones(cur, materia_id, ficha_id, docente_id, diferidos)
+    advertencias = migrar_correos_por_nombre(cur)
+    stats["estudiantes"] = apply_estudiantes(cur)
+    if ficha_id:
+        stats["fichas"] = apply_ficha(cur, ficha_id)
+    stats["evidencias"] = apply_evidencias(cur, materia_id)
+    # Resumen diario de dashboards: fichas de los estudiantes cargados (y el grupo
+    # sin ficha si se les asignó una). Antes que el rollup: mismo orden de locks en todas partes
+    try:
+        cur.execute(f"SELECT DISTINCT documento FROM {STAGING_TABLE}")
+        documentos = {r["documento"] for r in cur.fetchall() or []} | diferidos["documentos"]
+        stats["resumen"] = refresh_documentos(cur, documentos, incluir_sin_ficha=bool(stats["fichas"]))
+    except Exception:
+        stats["resumen"] = -1
+    try:
+        refresh_pares(cur, diferidos["pares"])
+    except Exception:
+        pass
+    rechazos = collect_rejects(cur)
+    stats["rechazados"] = len(rechazos)
+    return {"stats": stats, "errores": advertencias + rechazos}
@@ -1,17 +1,223 @@
-from typing import Any, Optional, Dict
-from psycopg import Connection
+"""Auditoría en audit_logs con escritura diferida y por lotes.
+
+`record_event` ya no escribe en la conexión del llamador: arma la fila y la deja en
+una cola en memoria acotada (AUDIT_QUEUE_MAX). Un hilo escritor la vacía con COPY
+cada AUDIT_BATCH_SIZE eventos o cada AUDIT_FLUSH_INTERVAL segundos, en su propia
+conexión del pool; la request no paga el round trip ni un segundo commit.
+
+Con la cola llena el llamador espera hasta AUDIT_ENQUEUE_TIMEOUT_MS y, si sigue
+llena, el evento se descarta (contador `dropped`). Al apagar (lifespan / atexit)
+se escribe lo pendiente. Si un lote falla se reintenta fila a fila para aislar la
+fila inválida; si la base no responde el lote se reintenta en el siguiente ciclo.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg.types.json import Jsonb
+
+logger = logging.getLogger("app.audit")
 
 AUDIT_ENABLED = True
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2"))
+AUDIT_ENQUEUE_TIMEOUT_MS = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_MS", "50"))
+
+COLUMNS = (
+    "user_id", "user_email", "user_rol", "accion", "modulo", "entidad_tipo", "entidad_id",
+    "detalles", "metadata", "metodo_http", "ruta", "estado_http", "duracion_ms",
+    "ip_address", "user_agent", "created_at",
+)
+_COPY_SQL = f"COPY audit_logs ({', '.join(COLUMNS)}) FROM STDIN"
+_INSERT_SQL = f"INSERT INTO audit_logs ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+def _entidad_id(value: Any) -> Optional[int]:
+    # audit_logs.entidad_id es INTEGER; los llamadores pasan str(id)
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AuditSink:
+    """Cola acotada + hilo escritor. Seguro entre hilos; el hilo arranca con el primer evento."""
+
+    def __init__(self, maxsize: int = AUDIT_QUEUE_MAX, batch_size: int = AUDIT_BATCH_SIZE,
+                 interval: float = AUDIT_FLUSH_INTERVAL):
+        self._queue: "queue.Queue[Tuple[Any, ...]]" = queue.Queue(maxsize=maxsize)
+        self._batch_size = max(1, batch_size)
+        self._interval = max(0.05, interval)
+        self._lock = threading.Lock()  # contadores y arranque del hilo
+        self._write_lock = threading.Lock()  # un solo escritor (hilo o flush())
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._retry: List[Tuple[Any, ...]] = []
+        self._counts = {"enqueued": 0, "written": 0, "dropped": 0, "backpressure": 0,
+                        "batches": 0, "rowErrors": 0, "batchErrors": 0}
+        self._last_flush: Optional[float] = None
+        self._last_error: Optional[str] = None
+
+    def _inc(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += n
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
 
-def record_event(conn: Connection,
-                 accion: str,
+    def put(self, row: Tuple[Any, ...]) -> bool:
+        """Encola una fila; False si se descartó por cola llena (o sink cerrado)."""
+        if self._stop.is_set():
+            self._inc("dropped")
+            return False
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._inc("backpressure")
+            try:
+                self._queue.put(row, timeout=AUDIT_ENQUEUE_TIMEOUT_MS / 1000.0)
+            except queue.Full:
+                self._inc("dropped")
+                logger.warning("Cola de auditoría llena (%d): evento descartado", self._queue.maxsize)
+                return False
+        self._inc("enqueued")
+        return True
+
+    def _take(self, first_timeout: float) -> List[Tuple[Any, ...]]:
+        batch: List[Tuple[Any, ...]] = []
+        deadline = time.monotonic() + first_timeout
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take(self._interval)
+            if batch or self._retry:
+                self._write(batch)
+
+    def _write(self, batch: List[Tuple[Any, ...]]) -> bool:
+        """Escribe reintentos pendientes + `batch`. False si no hubo conexión (quedan para reintento)."""
+        from ..db import get_conn
+        with self._write_lock:
+            rows, self._retry = self._retry + batch, []
+            if not rows:
+                return True
+            try:
+                with get_conn() as conn:
+                    try:
+                        with conn.cursor() as cur, cur.copy(_COPY_SQL) as copy:
+                            for row in rows:
+                                copy.write_row(row)
+                        conn.commit()
+                        written = len(rows)
+                    except Exception as e:
+                        conn.rollback()
+                        self._inc("batchErrors")
+                        self._last_error = str(e)
+                        written = self._write_rows(conn, rows)
+            except Exception as e:
+                # Sin conexión: conservar hasta el tope de la cola y reintentar en el próximo ciclo
+                self._inc("batchErrors")
+                self._last_error = str(e)
+                keep = rows[-self._queue.maxsize:] if self._queue.maxsize > 0 else rows
+                self._inc("dropped", len(rows) - len(keep))
+                self._retry = keep
+                logger.warning("No se pudo escribir lote de auditoría (%d eventos): %s", len(rows), e)
+                return False
+            self._inc("written", written)
+            self._inc("batches")
+            self._last_flush = time.time()
+            return True
+
+    def _write_rows(self, conn, rows: List[Tuple[Any, ...]]) -> int:
+        """Fila a fila con savepoint: una fila inválida no tumba el lote."""
+        written = 0
+        with conn.cursor() as cur:
+            for row in rows:
+                try:
+                    with conn.transaction():
+                        cur.execute(_INSERT_SQL, row)
+                    written += 1
+                except Exception as e:
+                    self._inc("rowErrors")
+                    self._inc("dropped")
+                    self._last_error = str(e)
+        conn.commit()
+        return written
+
+    def flush(self) -> bool:
+        """Escribe todo lo encolado hasta ahora (bloqueante)."""
+        ok = True
+        while True:
+            batch = self._take(0)
+            if not batch and not self._retry:
+                return ok
+            if not self._write(batch):
+                return False
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Apagado: detiene el hilo y escribe lo pendiente. Idempotente."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        if not self.flush():
+            with self._lock:
+                lost = len(self._retry) + self._queue.qsize()
+            if lost:
+                self._inc("dropped", lost)
+                logger.error("Apagado con %d eventos de auditoría sin escribir", lost)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "queued": self._queue.qsize() + len(self._retry),
+            "queueMax": self._queue.maxsize,
+            "batchSize": self._batch_size,
+            "flushIntervalS": self._interval,
+            "running": bool(self._thread is not None and self._thread.is_alive()),
+            "lastFlush": self._last_flush,
+            "lastError": self._last_error,
+        }
+
+
+audit_sink = AuditSink()
+atexit.register(audit_sink.close)
+
+
+def record_event(accion: str,
                  user_id: Optional[int] = None,
                  user_email: Optional[str] = None,
                  user_rol: Optional[str] = None,
                  modulo: Optional[str] = None,
                  entidad_tipo: Optional[str] = None,
-                 entidad_id: Optional[str] = None,
-                 detalles: Optional[Dict[str, Any]] = None,
+                 entidad_id: Optional[Any] = None,
+                 detalles: Optional[Any] = None,
                  metadata: Optional[Dict[str, Any]] = None,
                  metodo_http: Optional[str] = None,
                  ruta: Optional[str] = None,
@@ -19,39 +225,22 @@ def record_event(conn: Connection,
                  duracion_ms: Optional[int] = None,
                  ip_address: Optional[str] = None,
                  user_agent: Optional[str] = None) -> None:
-    """Inserta un evento de auditoría en audit_logs usando columnas existentes.
+    """Encola un evento de auditoría (ver AuditSink).
+
     Tolerante a errores: nunca hace raise que rompa la lógica de negocio.
-    Solo inserta columnas suministradas (las demás quedan NULL o defaults).
     """
-    if not AUDIT_ENABLED:
+    if not AUDIT_ENABLED or not accion:
         return
     try:
-        cols = []
-        vals = []
-        def add(col: str, val: Any):
-            if val is not None:
-                cols.append(col)
-                vals.append(val)
-        add("user_id", user_id)
-        add("user_email", user_email)
-        add("user_rol", user_rol)
-        add("accion", accion)
-        add("modulo", modulo)
-        add("entidad_tipo", entidad_tipo)
-        add("entidad_id", entidad_id)
-        add("detalles", detalles)
-        add("metadata", metadata)
-        add("metodo_http", metodo_http)
-        add("ruta", ruta)
-        add("estado_http", estado_http)
-        add("duracion_ms", duracion_ms)
-        add("ip_address", ip_address)
-        add("user_agent", user_agent)
-        if not cols:
-            return
-        placeholders = ",".join(["%s"] * len(cols))
-        sql = f"INSERT INTO audit_logs ({','.join(cols)}) VALUES ({placeholders})"
-        with conn.cursor() as cur:
-            cur.execute(sql, vals)
+        if detalles is not None and not isinstance(detalles, str):
+            detalles = _json(detalles)  # detalles es TEXT
+        row = (
+            user_id, user_email, user_rol, accion, modulo or "general", entidad_tipo,
+            _entidad_id(entidad_id), detalles,
+            Jsonb(metadata, dumps=_json) if metadata is not None else None,
+            metodo_http, ruta, estado_http, duracion_ms, ip_address, user_agent,
+            datetime.now(timezone.utc),
+        )
+        audit_sink.put(row)
     except Exception:
         pass
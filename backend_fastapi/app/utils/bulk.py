@@ -0,0 +1,34 @@
+"""Utilidades para cargas masivas: tablas temporales de staging + COPY.
+
+Las tablas se crean con ON COMMIT DROP, por lo que viven solo dentro de la
+transacción de la carga y no quedan residuos en la conexión devuelta al pool.
+"""
+from typing import Any, Iterable, Sequence, Tuple
+
+
+def create_staging(cur, name: str, columns: Sequence[Tuple[str, str]]) -> None:
+    """Crea (o recrea) una tabla temporal `name` con columnas (nombre, tipo)."""
+    cols = ", ".join(f"{col} {tipo}" for col, tipo in columns)
+    cur.execute(f"DROP TABLE IF EXISTS {name}")
+    cur.execute(f"CREATE TEMP TABLE {name} ({cols}) ON COMMIT DROP")
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]], analyze: bool = True) -> int:
+    """Envía filas a `table` vía COPY FROM STDIN. Retorna cuántas filas se escribieron.
+
+    Cargas por lotes: `analyze=False` en cada lote y analyze_staging() una vez al final.
+    """
+    written = 0
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+            written += 1
+    if analyze:
+        analyze_staging(cur, table)
+    return written
+
+
+def analyze_staging(cur, table: str) -> None:
+    # Las tablas temporales no las analiza autovacuum; sin estadísticas el planner
+    # asume pocas filas y elige nested loops para los merges.
+    cur.execute(f"ANALYZE {table}")
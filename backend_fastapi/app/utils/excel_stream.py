@@ -0,0 +1,136 @@
+"""Lectura de Excel por lotes con openpyxl en modo read_only.
+
+Evita tener a la vez los bytes crudos del archivo, el árbol completo del libro y
+un DataFrame con todas las filas: se itera la primera hoja con
+`iter_rows(values_only=True)` y se entregan DataFrames de a `EXCEL_BATCH_ROWS`.
+El índice de cada lote es `fila_excel - 2`, igual que con `pd.read_excel`, de
+modo que los mensajes `Fila {idx+2}` siguen apuntando a la fila real de la hoja.
+"""
+import os
+import shutil
+import tempfile
+from typing import Any, BinaryIO, Iterator, List, Optional, Union
+import numpy as np
+import pandas as pd
+
+EXCEL_BATCH_ROWS = int(os.getenv("EXCEL_BATCH_ROWS", "2000"))
+# Límite duro de filas de datos por archivo (0 = sin límite)
+UPLOAD_MAX_ROWS = int(os.getenv("UPLOAD_MAX_ROWS", "200000"))
+
+Source = Union[str, BinaryIO]
+
+
+class ExcelTooLarge(ValueError):
+    pass
+
+
+def _header_names(raw: List[Any]) -> List[str]:
+    """Nombres de columnas como los genera pandas: 'Unnamed: i' y duplicados con sufijo '.n'."""
+    names: List[str] = []
+    seen: dict = {}
+    for i, v in enumerate(raw):
+        name = f"Unnamed: {i}" if v is None or (isinstance(v, str) and v.strip() == "") else str(v)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _frame(rows: List[tuple], index: List[int], columns: List[str]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(rows, columns=columns, index=index).infer_objects()
+    # openpyxl entrega None para celdas vacías; pandas.read_excel entrega NaN
+    obj_cols = df.columns[df.dtypes == object]
+    if len(obj_cols):
+        df[obj_cols] = df[obj_cols].where(df[obj_cols].notna(), np.nan)
+    return df
+
+
+def iter_excel_batches(
+    source: Source,
+    filename: str,
+    batch_rows: int = EXCEL_BATCH_ROWS,
+    max_rows: int = UPLOAD_MAX_ROWS,
+) -> Iterator[pd.DataFrame]:
+    """Itera la primera hoja en DataFrames de hasta `batch_rows` filas.
+
+    Las filas completamente vacías se omiten. `.xls` no es soportado por openpyxl:
+    se lee completo con pandas y se entrega en lotes igualmente. Un archivo abierto
+    se rebobina antes de leer, de modo que puede recorrerse más de una vez.
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if filename.lower().endswith(".xls"):
+        df = pd.read_excel(source)
+        if max_rows and len(df) > max_rows:
+            raise ExcelTooLarge(f"El archivo supera el máximo de {max_rows} filas")
+        for start in range(0, len(df), batch_rows):
+            yield df.iloc[start:start + batch_rows]
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows_iter = ws.iter_rows(values_only=True)
+        header_raw: Optional[tuple] = None
+        header_pos = 0  # posición 0-based de la fila de encabezado en la hoja
+        for r in rows_iter:
+            if r is not None and any(v is not None for v in r):
+                header_raw = r
+                break
+            header_pos += 1
+        if header_raw is None:
+            return
+        # Recortar columnas vacías al final del encabezado
+        width = len(header_raw)
+        while width > 0 and header_raw[width - 1] is None:
+            width -= 1
+        columns = _header_names(list(header_raw[:width]))
+        batch: List[tuple] = []
+        index: List[int] = []
+        total = 0
+        # índice = fila_excel - 2 (0 = primera fila de datos con encabezado en la fila 1)
+        for idx, r in enumerate(rows_iter, start=header_pos):
+            vals = tuple(r[:width]) if r is not None else ()
+            if not any(v is not None and not (isinstance(v, str) and v.strip() == "") for v in vals):
+                continue
+            if len(vals) < width:
+                vals = vals + (None,) * (width - len(vals))
+            batch.append(vals)
+            index.append(idx)
+            total += 1
+            if max_rows and total > max_rows:
+                raise ExcelTooLarge(f"El archivo supera el máximo de {max_rows} filas")
+            if len(batch) >= batch_rows:
+                yield _frame(batch, index, columns)
+                batch, index = [], []
+        if batch:
+            yield _frame(batch, index, columns)
+    finally:
+        wb.close()
+
+
+def spool_to_tempfile(fileobj: BinaryIO, suffix: str = ".xlsx") -> str:
+    """Copia un upload a un archivo temporal en disco (por bloques) y retorna su ruta.
+    Necesario para entregar el archivo a otro proceso sin pasar los bytes por pickle."""
+    try:
+        fileobj.seek(0)
+    except Exception:
+        pass
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, 1024 * 1024)
+    return path
+
+
+def remove_quietly(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
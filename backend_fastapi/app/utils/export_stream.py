@@ -0,0 +1,132 @@
+"""Exportaciones en streaming (xlsx / csv / ndjson) con cursor de servidor.
+
+Las filas se leen con un cursor con nombre (server-side) de a `EXPORT_ITERSIZE`
+y se escriben al cliente por lotes, sin `fetchall()` ni DataFrame intermedio.
+CSV y NDJSON empiezan a enviarse con el primer lote; xlsx se arma con openpyxl
+en modo `write_only` sobre un archivo temporal (el formato zip requiere cerrar el
+libro antes de enviarlo) y luego se envía en bloques: memoria plana en ambos casos.
+"""
+import os
+import csv
+import io
+import json
+import tempfile
+import datetime
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from fastapi.responses import StreamingResponse
+from psycopg.rows import dict_row
+from ..db import get_conn
+
+EXPORT_ITERSIZE = int(os.getenv("EXPORT_ITERSIZE", "2000"))
+_CHUNK_BYTES = 64 * 1024
+
+FORMATS = ("xlsx", "csv", "ndjson")
+FORMAT_PATTERN = "^(xlsx|csv|ndjson)$"
+
+_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+Row = Dict[str, Any]
+Columns = Sequence[Tuple[str, str]]  # (clave en la fila, encabezado)
+
+
+def _iter_batches(sql: str, params: Sequence[Any], name: str, itersize: int) -> Iterator[List[Row]]:
+    with get_conn() as conn:
+        with conn.cursor(name=name, row_factory=dict_row) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(itersize)
+                if not batch:
+                    break
+                yield batch
+        conn.rollback()  # cierra la transacción de solo lectura del cursor con nombre
+
+
+def open_export(sql: str, params: Sequence[Any] = (), name: str = "export_cur",
+                itersize: int = EXPORT_ITERSIZE) -> Optional[Iterator[List[Row]]]:
+    """Ejecuta la consulta y lee el primer lote. Retorna None si no hay filas (para
+    responder 404 antes de empezar el stream); si hay, un iterador de lotes."""
+    batches = _iter_batches(sql, params, name, itersize)
+    first = next(batches, None)
+    if first is None:
+        batches.close()
+        return None
+    return chain([first], batches)
+
+
+def _xlsx_value(v: Any) -> Any:
+    if isinstance(v, datetime.datetime) and v.tzinfo is not None:
+        return v.replace(tzinfo=None)
+    return v
+
+
+def _stream_xlsx(batches: Iterator[List[Row]], columns: Columns, sheet_name: str,
+                 transform: Optional[Callable[[Row], Row]]) -> Iterator[bytes]:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append([h for _, h in columns])
+    keys = [k for k, _ in columns]
+    for batch in batches:
+        for row in batch:
+            if transform is not None:
+                row = transform(row)
+            ws.append([_xlsx_value(row.get(k)) for k in keys])
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _stream_csv(batches: Iterator[List[Row]], columns: Columns,
+                transform: Optional[Callable[[Row], Row]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    keys = [k for k, _ in columns]
+    # BOM para que Excel detecte UTF-8 (tildes, ñ)
+    buf.write("\ufeff")
+    writer.writerow([h for _, h in columns])
+    for batch in batches:
+        for row in batch:
+            if transform is not None:
+                row = transform(row)
+            writer.writerow(["" if row.get(k) is None else row.get(k) for k in keys])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+
+
+def _stream_ndjson(batches: Iterator[List[Row]], columns: Columns,
+                   transform: Optional[Callable[[Row], Row]]) -> Iterator[bytes]:
+    keys = [k for k, _ in columns]
+    for batch in batches:
+        lines = []
+        for row in batch:
+            if transform is not None:
+                row = transform(row)
+            lines.append(json.dumps({k: row.get(k) for k in keys}, default=str, ensure_ascii=False))
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def export_response(batches: Iterator[List[Row]], columns: Columns, fmt: str, filename_base: str,
+                    sheet_name: str = "Datos", transform: Optional[Callable[[Row], Row]] = None) -> StreamingResponse:
+    """StreamingResponse para `fmt` en FORMATS a partir de los lotes de `open_export`."""
+    if fmt == "csv":
+        body = _stream_csv(batches, columns, transform)
+    elif fmt == "ndjson":
+        body = _stream_ndjson(batches, columns, transform)
+    else:
+        fmt = "xlsx"
+        body = _stream_xlsx(batches, columns, sheet_name, transform)
+    headers = {"Content-Disposition": f"attachment; filename={filename_base}.{fmt}"}
+    return StreamingResponse(body, media_type=_MEDIA_TYPES[fmt], headers=headers)
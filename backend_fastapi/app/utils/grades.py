@@ -15,7 +15,7 @@ LETTER_SCORE_NOTA = {
 
 DEFAULT_SCHEME = 'heuristic'  # or 'nota'
 
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 def letter_to_score(letra: Optional[str], scheme: str = DEFAULT_SCHEME) -> float:
     if not letra:
@@ -31,3 +31,18 @@ def average_letters(letras: Optional[List[Optional[str]]], scheme: str = DEFAULT
     if not scores:
         return 0.0
     return round(sum(scores) / len(scores), 2)
+
+def average_letter_counts(counts: Optional[Dict[str, int]], scheme: str = DEFAULT_SCHEME) -> float:
+    """Igual que average_letters pero a partir de conteos por letra (p. ej. {'A': 10, 'D': 3})."""
+    if not counts:
+        return 0.0
+    total = 0
+    acc = 0.0
+    for letra, n in counts.items():
+        if not letra or not n:
+            continue
+        total += n
+        acc += letter_to_score(letra, scheme) * n
+    if not total:
+        return 0.0
+    return round(acc / total, 2)
@@ -0,0 +1,199 @@
+"""Paginación por cursor (keyset) y totales aproximados para los listados.
+
+Con `?cursor=` (vacío = primera página) el listado busca con
+`WHERE (k1, k2, ...) > (...)` sobre las mismas claves del ORDER BY en lugar de
+`OFFSET`, y retorna `nextCursor`. `?total=` elige cómo calcular el total:
+`exact` (COUNT(*), por defecto con page/pageSize), `estimated` (estadísticas del
+planner), `capped` (cuenta hasta PAGINATION_TOTAL_CAP) o `none` (por defecto con cursor).
+"""
+import base64
+import json
+import os
+from math import ceil
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+
+PAGINATION_TOTAL_CAP = int(os.getenv("PAGINATION_TOTAL_CAP", "10000"))
+
+TOTAL_MODES = ("exact", "estimated", "capped", "none")
+TOTAL_PATTERN = "^(exact|estimated|capped|none)$"
+
+
+def _decode_payload(cursor: str) -> Dict[str, Any]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    return json.loads(raw.decode("utf-8"))
+
+
+def cursor_listado(cursor: Optional[str]) -> Optional[str]:
+    """Nombre del Keyset que emitió `cursor` (None si está vacío o no se puede leer)."""
+    if not cursor:
+        return None
+    try:
+        return _decode_payload(cursor).get("k")
+    except Exception:
+        return None
+
+
+class Keyset:
+    """Claves de orden de un listado: (expresión SQL, clave en la fila, tipo para el cast).
+
+    Todas las claves van en la misma dirección y la última debe ser única (id).
+    """
+
+    def __init__(self, name: str, columns: Sequence[Tuple[str, str, str]], descending: bool = False):
+        self.name = name
+        self.columns = list(columns)
+        self.descending = descending
+
+    def order_by(self) -> str:
+        direction = " DESC" if self.descending else ""
+        return ", ".join(f"{expr}{direction}" for expr, _, _ in self.columns)
+
+    def seek(self, values: Optional[List[Any]]) -> Tuple[Optional[str], List[Any]]:
+        """Condición `(claves) > (valores)` (o `<` si es descendente) para continuar tras `values`."""
+        if values is None:
+            return None, []
+        lhs = ", ".join(expr for expr, _, _ in self.columns)
+        rhs = ", ".join(f"%s::{tipo}" for _, _, tipo in self.columns)
+        op = "<" if self.descending else ">"
+        return f"({lhs}) {op} ({rhs})", list(values)
+
+    def decode(self, cursor: Optional[str]) -> Optional[List[Any]]:
+        """None/'' = primera página. Cursor inválido o de otro listado -> 400."""
+        if not cursor:
+            return None
+        try:
+            payload = _decode_payload(cursor)
+            values = payload["v"]
+            if payload.get("k") != self.name or len(values) != len(self.columns):
+                raise ValueError("cursor de otro listado")
+        except Exception:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        return values
+
+    def encode(self, row: Dict[str, Any]) -> str:
+        payload = {"k": self.name, "v": [row.get(key) for _, key, _ in self.columns]}
+        raw = json.dumps(payload, default=str, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def page(self, rows: List[Dict[str, Any]], page_size: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """`rows` se pidió con LIMIT page_size + 1: recorta y arma el siguiente cursor."""
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, self.encode(rows[-1])
+
+
+def resolve_total_mode(total: Optional[str], cursor: Optional[str]) -> str:
+    if total:
+        return total
+    return "none" if cursor is not None else "exact"
+
+
+def _first(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return list(row.values())[0]
+    return row[0]
+
+
+def _capped_sql(from_sql: str, where_clause: str) -> str:
+    return f"SELECT COUNT(*) FROM (SELECT 1 FROM {from_sql} {where_clause} LIMIT %s) t"
+
+
+def _capped(n: Any) -> Tuple[int, bool]:
+    n = int(n or 0)
+    return min(n, PAGINATION_TOTAL_CAP), n <= PAGINATION_TOTAL_CAP
+
+
+def _plan_rows(plan: Any) -> int:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _reltuples(n: Any) -> Optional[int]:
+    if n is not None and n >= 0:  # -1: tabla nunca analizada
+        return int(n)
+    return None
+
+
+_RELTUPLES_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)"
+
+
+def count_total(cur, from_sql: str, where_clause: str, params: Sequence[Any], mode: str,
+                table: Optional[str] = None) -> Tuple[Optional[int], bool]:
+    """Total según `mode` para `SELECT ... FROM {from_sql} {where_clause}`.
+
+    Retorna (total, exacto). `estimated` sin filtros usa pg_class.reltuples de `table`;
+    con filtros, la estimación de filas del plan.
+    """
+    if mode == "none":
+        return None, False
+    if mode == "capped":
+        cur.execute(_capped_sql(from_sql, where_clause), [*params, PAGINATION_TOTAL_CAP + 1])
+        return _capped(_first(cur.fetchone()))
+    if mode == "estimated":
+        try:
+            # Savepoint: si la estimación falla se cuenta de forma exacta en la misma transacción
+            with cur.connection.transaction():
+                estimado = _estimate(cur, from_sql, where_clause, params, table)
+            if estimado is not None:
+                return estimado, False
+        except Exception:
+            pass
+    cur.execute(f"SELECT COUNT(*) FROM {from_sql} {where_clause}", list(params))
+    return int(_first(cur.fetchone()) or 0), True
+
+
+def _estimate(cur, from_sql: str, where_clause: str, params: Sequence[Any], table: Optional[str]) -> Optional[int]:
+    if not where_clause and table:
+        cur.execute(_RELTUPLES_SQL, [table])
+        return _reltuples(_first(cur.fetchone()))
+    cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {from_sql} {where_clause}", list(params))
+    return _plan_rows(_first(cur.fetchone()))
+
+
+async def acount_total(cur, from_sql: str, where_clause: str, params: Sequence[Any], mode: str,
+                       table: Optional[str] = None) -> Tuple[Optional[int], bool]:
+    """count_total() para cursores async."""
+    if mode == "none":
+        return None, False
+    if mode == "capped":
+        await cur.execute(_capped_sql(from_sql, where_clause), [*params, PAGINATION_TOTAL_CAP + 1])
+        return _capped(_first(await cur.fetchone()))
+    if mode == "estimated":
+        try:
+            async with cur.connection.transaction():
+                estimado = await _aestimate(cur, from_sql, where_clause, params, table)
+            if estimado is not None:
+                return estimado, False
+        except Exception:
+            pass
+    await cur.execute(f"SELECT COUNT(*) FROM {from_sql} {where_clause}", list(params))
+    return int(_first(await cur.fetchone()) or 0), True
+
+
+async def _aestimate(cur, from_sql: str, where_clause: str, params: Sequence[Any], table: Optional[str]) -> Optional[int]:
+    if not where_clause and table:
+        await cur.execute(_RELTUPLES_SQL, [table])
+        return _reltuples(_first(await cur.fetchone()))
+    await cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {from_sql} {where_clause}", list(params))
+    return _plan_rows(_first(await cur.fetchone()))
+
+
+def pagination_meta(page: int, page_size: int, total: Optional[int], mode: str, exact: bool = True,
+                    next_cursor: Optional[str] = None, cursor_mode: bool = False) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {
+        "page": page,
+        "pageSize": page_size,
+        "total": total,
+        "totalPages": ceil(total / page_size) if (total is not None and page_size) else None,
+    }
+    if mode != "exact":
+        meta["totalMode"] = mode
+        meta["totalExact"] = exact
+    if cursor_mode:
+        meta["nextCursor"] = next_cursor
+    return meta
@@ -0,0 +1,165 @@
+"""Métricas de uso del pool de conexiones (get_conn / get_aconn).
+
+Por cada checkout se mide la espera hasta obtener la conexión y el tiempo que la
+ruta la retuvo; se agregan por pool (`sync` / `async`) y por ruta
+(`MÉTODO /plantilla/{id}`, o `-` fuera de un request: cargas en segundo plano).
+Una espera mayor a DB_POOL_WAIT_WARN_MS se registra como warning. Junto con
+`pool.get_stats()` de psycopg_pool se exponen en /api/v1/db/pool para dimensionar
+DB_POOL_MAX contra la carga real.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger("app.db.pool")
+
+POOL_WAIT_WARN_MS = float(os.getenv("DB_POOL_WAIT_WARN_MS", "500"))
+
+# Límites superiores (ms) del histograma de espera; el último tramo es "> 5000"
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+_BUCKET_LABELS = [f"<={b}" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}"]
+
+_RATE_WINDOW_S = 60.0
+_MAX_ROUTES = 500  # rutas son plantillas (acotadas); el tope evita crecer sin control
+
+_request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("pool_request_scope", default=None)
+
+
+def _route_label() -> str:
+    scope = _request_scope.get()
+    if not scope:
+        return "-"
+    # FastAPI deja la ruta resuelta en el scope antes de ejecutar el endpoint
+    route = scope.get("route")
+    path = getattr(route, "path", None) or "(sin ruta)"
+    return f"{scope.get('method', '')} {path}".strip()
+
+
+class _Stat:
+    __slots__ = ("checkouts", "errors", "wait_ms", "wait_max_ms", "hold_ms", "hold_max_ms", "slow")
+
+    def __init__(self):
+        self.checkouts = 0
+        self.errors = 0
+        self.wait_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.hold_ms = 0.0
+        self.hold_max_ms = 0.0
+        self.slow = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        n = self.checkouts or 1
+        return {
+            "checkouts": self.checkouts,
+            "errors": self.errors,
+            "slowCheckouts": self.slow,
+            "waitAvgMs": round(self.wait_ms / n, 2),
+            "waitMaxMs": round(self.wait_max_ms, 2),
+            "holdAvgMs": round(self.hold_ms / n, 2),
+            "holdMaxMs": round(self.hold_max_ms, 2),
+        }
+
+
+class PoolMetrics:
+    """Contadores en proceso, seguros entre hilos (rutas sync) y corrutinas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._since = time.time()
+            self._pools: Dict[str, _Stat] = {}
+            self._routes: Dict[str, _Stat] = {}
+            self._histogram: Dict[str, List[int]] = {}
+            self._recent: Dict[str, Deque[float]] = {}
+
+    def _stats(self, pool: str, route: str) -> List[_Stat]:
+        stats = [self._pools.setdefault(pool, _Stat())]
+        key = f"{pool} {route}"
+        if key in self._routes or len(self._routes) < _MAX_ROUTES:
+            stats.append(self._routes.setdefault(key, _Stat()))
+        return stats
+
+    def record_wait(self, pool: str, seconds: float) -> None:
+        ms = seconds * 1000.0
+        route = _route_label()
+        now = time.time()
+        with self._lock:
+            for st in self._stats(pool, route):
+                st.checkouts += 1
+                st.wait_ms += ms
+                st.wait_max_ms = max(st.wait_max_ms, ms)
+                if ms > POOL_WAIT_WARN_MS:
+                    st.slow += 1
+            hist = self._histogram.setdefault(pool, [0] * (len(WAIT_BUCKETS_MS) + 1))
+            hist[bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+            recent = self._recent.setdefault(pool, deque())
+            recent.append(now)
+            while recent and recent[0] < now - _RATE_WINDOW_S:
+                recent.popleft()
+        if ms > POOL_WAIT_WARN_MS:
+            logger.warning("Espera de conexión %.0f ms (pool %s, %s) > DB_POOL_WAIT_WARN_MS=%.0f",
+                           ms, pool, route, POOL_WAIT_WARN_MS)
+
+    def record_hold(self, pool: str, seconds: float) -> None:
+        ms = seconds * 1000.0
+        route = _route_label()
+        with self._lock:
+            for st in self._stats(pool, route):
+                st.hold_ms += ms
+                st.hold_max_ms = max(st.hold_max_ms, ms)
+
+    def record_error(self, pool: str) -> None:
+        route = _route_label()
+        with self._lock:
+            for st in self._stats(pool, route):
+                st.errors += 1
+        logger.warning("No se obtuvo conexión del pool %s (%s)", pool, route)
+
+    def snapshot(self, top: int = 20) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            pools = {}
+            for name, st in self._pools.items():
+                recent = self._recent.get(name) or deque()
+                window = min(_RATE_WINDOW_S, max(now - self._since, 1e-9))
+                hist = self._histogram.get(name) or []
+                pools[name] = {
+                    **st.as_dict(),
+                    "acquisitionsPerSecond": round(sum(1 for t in recent if t >= now - _RATE_WINDOW_S) / window, 3),
+                    "waitHistogramMs": dict(zip(_BUCKET_LABELS, hist)),
+                }
+            routes = sorted(self._routes.items(), key=lambda kv: kv[1].wait_ms + kv[1].hold_ms, reverse=True)
+            return {
+                "since": self._since,
+                "waitWarnMs": POOL_WAIT_WARN_MS,
+                "pools": pools,
+                "routes": [{"route": k, **st.as_dict()} for k, st in routes[:top]],
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class PoolRouteMiddleware:
+    """ASGI: deja el scope del request en un ContextVar para atribuir checkouts a la ruta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
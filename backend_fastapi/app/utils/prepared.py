@@ -0,0 +1,93 @@
+"""Sentencias preparadas del lado del servidor.
+
+psycopg prepara por su cuenta una consulta tras DB_PREPARE_THRESHOLD ejecuciones
+en la misma conexión (0 = todas desde la primera, `none` = nunca) y guarda hasta
+DB_PREPARED_MAX por conexión. Las sentencias calientes (login, lecturas por id,
+escritura fila a fila de evidencias) pasan por `execute_hot`, que pide prepare=True
+desde la primera ejecución. Solo para SQL de texto fijo: cada variante de un SQL
+armado dinámicamente sería otra preparada y desalojaría a las calientes del LRU.
+
+Contadores por nombre: `prepares` (primera ejecución en una conexión: PREPARE +
+EXECUTE), `prepared` (reutiliza la preparada de esa conexión) y `unprepared`
+(prepare=False, modo pgbouncer). Las preparadas se siguen por conexión con el
+mismo límite LRU que psycopg (DB_PREPARED_MAX); es una cota: el LRU de psycopg
+también guarda las automáticas, que pueden desalojar antes a una caliente.
+
+Con pgbouncer en modo transaction (DB_PGBOUNCER=1) una preparada puede quedar en
+otra conexión del servidor: se desactivan tanto las automáticas como las explícitas.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+PGBOUNCER = os.getenv("DB_PGBOUNCER", "").strip().lower() in ("1", "true", "yes", "transaction")
+PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", "100"))
+
+
+def _threshold() -> Optional[int]:
+    if PGBOUNCER:
+        return None
+    raw = os.getenv("DB_PREPARE_THRESHOLD", "5").strip().lower()
+    if raw in ("", "none", "off"):
+        return None
+    return int(raw)
+
+
+PREPARE_THRESHOLD = _threshold()
+# prepare=False prohíbe preparar incluso si el umbral se alcanza
+HOT_PREPARE: Optional[bool] = False if PGBOUNCER else True
+
+_lock = threading.Lock()
+_counts: Dict[str, Dict[str, int]] = {}
+# conexión -> nombres preparados en ella (orden LRU)
+_por_conexion: "weakref.WeakKeyDictionary[Any, OrderedDict]" = weakref.WeakKeyDictionary()
+
+
+def connection_kwargs() -> Dict[str, Any]:
+    """kwargs de psycopg.connect para los pools."""
+    return {"prepare_threshold": PREPARE_THRESHOLD}
+
+
+def configure_connection(conn) -> None:
+    """Ajustes por conexión nueva (callback `configure` de los pools)."""
+    conn.prepared_max = PREPARED_MAX
+
+
+def _count(conn: Any, name: str) -> None:
+    with _lock:
+        c = _counts.setdefault(name, {"prepares": 0, "prepared": 0, "unprepared": 0})
+        if not HOT_PREPARE:
+            c["unprepared"] += 1
+            return
+        nombres = _por_conexion.get(conn)
+        if nombres is None:
+            nombres = _por_conexion[conn] = OrderedDict()
+        if name in nombres:
+            nombres.move_to_end(name)
+            c["prepared"] += 1
+            return
+        nombres[name] = None
+        if len(nombres) > PREPARED_MAX:
+            nombres.popitem(last=False)
+        c["prepares"] += 1
+
+
+def execute_hot(cur, name: str, sql: str, params: Optional[Sequence[Any]] = None):
+    """cur.execute() de una sentencia caliente, preparada en el servidor salvo modo pgbouncer."""
+    cur.execute(sql, params, prepare=HOT_PREPARE)
+    _count(cur.connection, name)
+    return cur
+
+
+def statement_stats() -> Dict[str, Any]:
+    with _lock:
+        counts = {k: dict(v) for k, v in sorted(_counts.items())}
+    return {
+        "pgbouncer": PGBOUNCER,
+        "prepareThreshold": PREPARE_THRESHOLD,
+        "preparedMax": PREPARED_MAX,
+        "hotPrepare": HOT_PREPARE,
+        "statements": counts,
+    }
@@ -0,0 +1,131 @@
+"""Búsqueda de texto en listados apoyada en índices trigram (pg_trgm).
+
+`col ILIKE '%term%'` puede usar un índice GIN `gin_trgm_ops` sobre la columna
+(migrations/006_trgm_busqueda.sql); `LOWER(col) LIKE LOWER(...)` no, porque el
+índice es sobre la columna y no sobre la expresión. Con términos de menos de 3
+caracteres no hay trigramas completos y Postgres recorre la tabla igual.
+Con pg_trgm instalado se puede además ordenar por relevancia (word_similarity).
+"""
+import re
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+TRGM_MIN_LEN = 3
+
+_trgm = False
+# (tabla, columna) con índice gin_trgm_ops confirmado en pg_indexes
+_indexadas: Set[Tuple[str, str]] = set()
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+_TRGM_SQL = "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+
+
+def trgm_disponible(cur) -> bool:
+    """True si la extensión pg_trgm está instalada (se recuerda una vez confirmada)."""
+    global _trgm
+    if _trgm:
+        return True
+    try:
+        cur.execute(_TRGM_SQL)
+        _trgm = cur.fetchone() is not None
+    except Exception:
+        return False
+    return _trgm
+
+
+async def atrgm_disponible(cur) -> bool:
+    """trgm_disponible() para cursores async."""
+    global _trgm
+    if _trgm:
+        return True
+    try:
+        await cur.execute(_TRGM_SQL)
+        _trgm = await cur.fetchone() is not None
+    except Exception:
+        return False
+    return _trgm
+
+
+_INDEX_SQL = (
+    "SELECT indexdef FROM pg_indexes "
+    "WHERE schemaname = current_schema() AND tablename = %s AND indexdef LIKE '%%gin_trgm_ops%%'"
+)
+
+# "CREATE INDEX ... USING gin (numero gin_trgm_ops)" -> numero
+_INDEX_COL_RE = re.compile(r'[(,]\s*"?(\w+)"?\s+gin_trgm_ops')
+
+
+def _registrar_indices(tabla: str, rows: Sequence[Any]) -> None:
+    for r in rows or []:
+        indexdef = r["indexdef"] if isinstance(r, dict) else r[0]
+        for col in _INDEX_COL_RE.findall(indexdef or ""):
+            _indexadas.add((tabla, col))
+
+
+def trgm_indexado(cur, tabla: str, columnas: Sequence[str]) -> bool:
+    """True si todas las `columnas` de `tabla` tienen índice gin_trgm_ops (se recuerda una vez confirmado)."""
+    if all((tabla, c) in _indexadas for c in columnas):
+        return True
+    try:
+        cur.execute(_INDEX_SQL, [tabla])
+        _registrar_indices(tabla, cur.fetchall())
+    except Exception:
+        return False
+    return all((tabla, c) in _indexadas for c in columnas)
+
+
+async def atrgm_indexado(cur, tabla: str, columnas: Sequence[str]) -> bool:
+    """trgm_indexado() para cursores async."""
+    if all((tabla, c) in _indexadas for c in columnas):
+        return True
+    try:
+        await cur.execute(_INDEX_SQL, [tabla])
+        _registrar_indices(tabla, await cur.fetchall())
+    except Exception:
+        return False
+    return all((tabla, c) in _indexadas for c in columnas)
+
+
+def search_filter(columns: Sequence[str], term: str) -> Tuple[str, List[Any]]:
+    """`(c1 ILIKE %s OR c2 ILIKE %s ...)` con los comodines del término escapados."""
+    like = f"%{_escape_like(term.strip())}%"
+    return "(" + " OR ".join(f"{c} ILIKE %s" for c in columns) + ")", [like] * len(columns)
+
+
+def estudiante_filter(doc_col: str, term: str) -> Tuple[str, List[Any]]:
+    """Búsqueda por documento, nombre o apellido para tablas con documento de estudiante.
+
+    El nombre/apellido se resuelve en `estudiantes` con una subconsulta: un OR entre
+    columnas de dos tablas unidas por JOIN no puede usar los índices de ninguna.
+    """
+    doc_sql, doc_params = search_filter([doc_col], term)
+    nombre_sql, nombre_params = search_filter(["nombre", "apellido"], term)
+    return (
+        f"({doc_sql} OR {doc_col} IN (SELECT documento FROM estudiantes WHERE {nombre_sql}))",
+        doc_params + nombre_params,
+    )
+
+
+def relevance_order(columns: Sequence[str], term: str) -> Tuple[str, List[Any]]:
+    """Expresión ORDER BY por similitud de palabra con el término (requiere pg_trgm)."""
+    parts = [f"word_similarity(%s, COALESCE({c}, ''))" for c in columns]
+    expr = parts[0] if len(parts) == 1 else f"GREATEST({', '.join(parts)})"
+    return f"{expr} DESC", [term.strip()] * len(columns)
+
+
+def search_info(term: Optional[str], indexado: bool, ranked: bool = False) -> Optional[Dict[str, Any]]:
+    """Metadatos para la respuesta: si el filtro puede ir por índice trigram y si se ordenó por relevancia.
+
+    `indexado`: las columnas filtradas tienen índice (trgm_indexado). `indexable` exige
+    además un término de 3+ caracteres; usar o no el índice lo decide el planner.
+    """
+    if not term or not term.strip():
+        return None
+    return {
+        "term": term.strip(),
+        "indexable": bool(indexado and len(term.strip()) >= TRGM_MIN_LEN),
+        "ranked": bool(ranked),
+    }
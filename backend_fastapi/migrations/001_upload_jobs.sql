@@ -0,0 +1,32 @@
+-- Trabajos de carga en background (POST ...?background=true -> GET /api/v1/uploads/{id})
+-- Fechas TIMESTAMPTZ: la app escribe epochs (to_timestamp) y los lee con EXTRACT(EPOCH ...),
+-- que con TIMESTAMP se desplazan según la zona horaria de la sesión.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/001_upload_jobs.sql
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id           VARCHAR(36) PRIMARY KEY,
+    tipo         VARCHAR(50) NOT NULL,
+    estado       VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    etapa        VARCHAR(50),
+    porcentaje   SMALLINT NOT NULL DEFAULT 0,
+    filename     VARCHAR(255),
+    user_id      INTEGER,
+    user_email   VARCHAR(255),
+    parametros   JSONB,
+    errores      JSONB,
+    resultado    JSONB,
+    error        TEXT,
+    created_at   TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    updated_at   TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    finished_at  TIMESTAMPTZ,
+    CONSTRAINT chk_upload_jobs_estado CHECK (estado IN ('pendiente', 'procesando', 'completado', 'fallido'))
+);
+
+-- Tablas creadas con la versión anterior (TIMESTAMP): sus valores se escribieron en la
+-- zona de la sesión, que es la que usa la conversión
+ALTER TABLE upload_jobs
+    ALTER COLUMN created_at TYPE TIMESTAMPTZ,
+    ALTER COLUMN updated_at TYPE TIMESTAMPTZ,
+    ALTER COLUMN finished_at TYPE TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_created_at ON upload_jobs (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_abiertos ON upload_jobs (tipo, created_at DESC) WHERE estado <> 'completado';
@@ -0,0 +1,36 @@
+-- Resumen diario de evidencias (wide) para contadores de dashboards.
+-- Una fila por (ficha del estudiante, evidencia, día de creación UTC) con conteos por letra.
+-- Lo mantienen las cargas (app/services/evidencias_resumen.py); reconstrucción completa:
+--   python backend_fastapi/scripts/refresh_evidencias_resumen.py
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/002_evidencias_resumen_diario.sql
+CREATE TABLE IF NOT EXISTS evidencias_resumen_diario (
+    ficha_id          INTEGER,               -- NULL = estudiante sin ficha
+    evidencia_nombre  VARCHAR(255) NOT NULL,
+    dia               DATE NOT NULL,
+    total             INTEGER NOT NULL DEFAULT 0,
+    aprobadas         INTEGER NOT NULL DEFAULT 0,  -- letra = 'A'
+    reprobadas        INTEGER NOT NULL DEFAULT 0,  -- letra = 'D'
+    no_entrego        INTEGER NOT NULL DEFAULT 0,  -- letra = '-'
+    pendientes        INTEGER NOT NULL DEFAULT 0,  -- letra IS NULL
+    actualizado_en    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_evidencias_resumen_diario
+    ON evidencias_resumen_diario (COALESCE(ficha_id, 0), evidencia_nombre, dia);
+CREATE INDEX IF NOT EXISTS idx_evidencias_resumen_diario_nombre ON evidencias_resumen_diario (evidencia_nombre);
+CREATE INDEX IF NOT EXISTS idx_evidencias_resumen_diario_dia ON evidencias_resumen_diario (dia);
+
+-- Carga inicial
+DELETE FROM evidencias_resumen_diario;
+INSERT INTO evidencias_resumen_diario (ficha_id, evidencia_nombre, dia, total, aprobadas, reprobadas, no_entrego, pendientes)
+SELECT NULLIF(s.ficha_id, 0),
+       e.evidencia_nombre,
+       (e.created_at AT TIME ZONE 'UTC')::date,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE e.letra = 'A'),
+       COUNT(*) FILTER (WHERE e.letra = 'D'),
+       COUNT(*) FILTER (WHERE e.letra = '-'),
+       COUNT(*) FILTER (WHERE e.letra IS NULL)
+FROM evidencias e
+JOIN estudiantes s ON s.documento = e.documento
+GROUP BY 1, 2, 3;
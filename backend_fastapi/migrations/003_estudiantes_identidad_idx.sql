@@ -0,0 +1,5 @@
+-- Índice funcional para la heurística de cambio de correo de la carga wide
+-- (services/wide_ingest.migrar_correos_por_nombre busca por LOWER(nombre), LOWER(apellido)).
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/003_estudiantes_identidad_idx.sql
+CREATE INDEX IF NOT EXISTS idx_estudiantes_lower_nombre_apellido
+    ON estudiantes (LOWER(nombre), LOWER(apellido));
@@ -0,0 +1,67 @@
+-- FK entera evidencias / evidencias_detalle -> evidencia_definicion.
+-- Las consultas agregadas filtran definiciones activas con d.id = e.evidencia_definicion_id
+-- (app/services/evidencia_definicion_ref.py) en lugar de unir por nombre.
+-- evidencias_detalle: definición exacta por (materia_id, evidencia_nombre).
+-- evidencias (sin materia): la de su fila en evidencias_detalle si existe; si no, una
+-- activa con ese nombre; si no, la más antigua.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/004_evidencia_definicion_id.sql
+ALTER TABLE evidencias_detalle ADD COLUMN IF NOT EXISTS evidencia_definicion_id INTEGER
+    REFERENCES evidencia_definicion(id) ON DELETE SET NULL;
+ALTER TABLE evidencias ADD COLUMN IF NOT EXISTS evidencia_definicion_id INTEGER
+    REFERENCES evidencia_definicion(id) ON DELETE SET NULL;
+
+-- Backfill
+UPDATE evidencias_detalle e SET evidencia_definicion_id = d.id
+FROM evidencia_definicion d
+WHERE d.materia_id = e.materia_id AND d.nombre = e.evidencia_nombre
+  AND e.evidencia_definicion_id IS NULL;
+
+UPDATE evidencias e SET evidencia_definicion_id = x.evidencia_definicion_id
+FROM (
+    SELECT DISTINCT ON (estudiante_documento, evidencia_nombre)
+           estudiante_documento, evidencia_nombre, evidencia_definicion_id
+    FROM evidencias_detalle
+    WHERE evidencia_definicion_id IS NOT NULL
+    ORDER BY estudiante_documento, evidencia_nombre, updated_at DESC NULLS LAST, id DESC
+) x
+WHERE x.estudiante_documento = e.documento AND x.evidencia_nombre = e.evidencia_nombre
+  AND e.evidencia_definicion_id IS NULL;
+
+UPDATE evidencias e SET evidencia_definicion_id = d.id
+FROM (
+    SELECT DISTINCT ON (nombre) nombre, id
+    FROM evidencia_definicion
+    ORDER BY nombre, activa DESC, id
+) d
+WHERE d.nombre = e.evidencia_nombre AND e.evidencia_definicion_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_definicion ON evidencias_detalle (evidencia_definicion_id);
+CREATE INDEX IF NOT EXISTS idx_evidencias_definicion ON evidencias (evidencia_definicion_id);
+-- Solo definiciones activas: el lado pequeño de los JOIN de dashboards y analítica
+CREATE INDEX IF NOT EXISTS idx_evidencia_definicion_activas ON evidencia_definicion (id) WHERE activa;
+
+-- Resumen diario (002): una fila por definición además de (ficha, evidencia, día)
+DO $$
+BEGIN
+    IF to_regclass('evidencias_resumen_diario') IS NOT NULL THEN
+        ALTER TABLE evidencias_resumen_diario ADD COLUMN IF NOT EXISTS evidencia_definicion_id INTEGER;
+        DROP INDEX IF EXISTS ux_evidencias_resumen_diario;
+        CREATE UNIQUE INDEX ux_evidencias_resumen_diario
+            ON evidencias_resumen_diario (COALESCE(ficha_id, 0), evidencia_nombre, COALESCE(evidencia_definicion_id, 0), dia);
+        DELETE FROM evidencias_resumen_diario;
+        INSERT INTO evidencias_resumen_diario
+            (ficha_id, evidencia_nombre, evidencia_definicion_id, dia, total, aprobadas, reprobadas, no_entrego, pendientes)
+        SELECT NULLIF(s.ficha_id, 0),
+               e.evidencia_nombre,
+               e.evidencia_definicion_id,
+               (e.created_at AT TIME ZONE 'UTC')::date,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE e.letra = 'A'),
+               COUNT(*) FILTER (WHERE e.letra = 'D'),
+               COUNT(*) FILTER (WHERE e.letra = '-'),
+               COUNT(*) FILTER (WHERE e.letra IS NULL)
+        FROM evidencias e
+        JOIN estudiantes s ON s.documento = e.documento
+        GROUP BY 1, 2, 3, 4;
+    END IF;
+END $$;
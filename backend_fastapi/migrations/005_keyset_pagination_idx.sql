@@ -0,0 +1,11 @@
+-- Índices para la paginación por cursor de los listados (app/utils/pagination.py):
+-- cada uno cubre el ORDER BY del listado, así `WHERE (claves) > (...) ORDER BY ... LIMIT n`
+-- es un recorrido de índice acotado en lugar de ordenar y descartar filas.
+-- users/fichas (id DESC) y evidencias (documento, evidencia_nombre: UNIQUE) ya lo tienen.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/005_keyset_pagination_idx.sql
+CREATE INDEX IF NOT EXISTS idx_calificaciones_keyset
+    ON calificaciones (estudiante_nombre, trimestre, id);
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_keyset
+    ON evidencias_detalle (estudiante_nombre, evidencia_nombre, trimestre, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_keyset
+    ON notifications (user_id, created_at DESC, id DESC);
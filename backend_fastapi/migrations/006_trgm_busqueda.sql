@@ -0,0 +1,35 @@
+-- Búsqueda con ILIKE '%término%' por índice trigram (app/utils/search.py).
+-- Un índice GIN gin_trgm_ops sirve a `col ILIKE %s` con términos de 3+ caracteres;
+-- los listados dejan de usar LOWER(col) LIKE LOWER(...), que no puede usarlo.
+-- users/materias no se indexan: son tablas pequeñas.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/006_trgm_busqueda.sql
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_calificaciones_nombre_trgm
+    ON calificaciones USING GIN (estudiante_nombre gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_calificaciones_documento_trgm
+    ON calificaciones USING GIN (estudiante_documento gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_nombre_trgm
+    ON evidencias_detalle USING GIN (estudiante_nombre gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_documento_trgm
+    ON evidencias_detalle USING GIN (estudiante_documento gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_evidencia_trgm
+    ON evidencias_detalle USING GIN (evidencia_nombre gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_evidencias_evidencia_trgm
+    ON evidencias USING GIN (evidencia_nombre gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_evidencias_documento_trgm
+    ON evidencias USING GIN (documento gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_fichas_numero_trgm
+    ON fichas USING GIN (numero gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_fichas_nombre_trgm
+    ON fichas USING GIN (nombre gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_estudiantes_nombre_trgm
+    ON estudiantes USING GIN (nombre gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_estudiantes_apellido_trgm
+    ON estudiantes USING GIN (apellido gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_estudiantes_documento_trgm
+    ON estudiantes USING GIN (documento gin_trgm_ops);
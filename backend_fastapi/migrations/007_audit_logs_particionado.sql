@@ -0,0 +1,113 @@
+-- audit_logs particionada por mes (RANGE sobre created_at, límites en UTC).
+-- Las consultas recientes (historial de cargas, actividad del dashboard) solo tocan
+-- las particiones del período; la retención desvincula meses completos en lugar de
+-- DELETE masivo. Particiones futuras y retención:
+--   python backend_fastapi/scripts/audit_retention.py --meses 12 [--archivo DIR]
+-- Filas fuera de toda partición caen en audit_logs_default; se mueven al crear su mes.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/007_audit_logs_particionado.sql
+
+-- Crea audit_logs_YYYYMM para el mes de `desde` y los `meses_adelante` siguientes.
+-- Si audit_logs_default tiene filas de un mes nuevo, se mueven a su partición.
+CREATE OR REPLACE FUNCTION audit_logs_crear_particiones(desde DATE DEFAULT CURRENT_DATE, meses_adelante INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+  mes DATE;
+  nombre TEXT;
+  creadas INTEGER := 0;
+BEGIN
+  FOR i IN 0..meses_adelante LOOP
+    mes := (date_trunc('month', desde) + make_interval(months => i))::date;
+    nombre := 'audit_logs_' || to_char(mes, 'YYYYMM');
+    CONTINUE WHEN to_regclass(nombre) IS NOT NULL;
+    EXECUTE format('CREATE TABLE %I (LIKE audit_logs INCLUDING DEFAULTS)', nombre);
+    IF to_regclass('audit_logs_default') IS NOT NULL THEN
+      EXECUTE format(
+        'WITH movidas AS (DELETE FROM audit_logs_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM movidas',
+        mes::text || ' 00:00:00+00', (mes + INTERVAL '1 month')::date::text || ' 00:00:00+00', nombre);
+    END IF;
+    EXECUTE format('ALTER TABLE audit_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   nombre, mes::text || ' 00:00:00+00', (mes + INTERVAL '1 month')::date::text || ' 00:00:00+00');
+    creadas := creadas + 1;
+  END LOOP;
+  RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+  desde DATE;
+  meses INTEGER;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('audit_logs')) = 'p' THEN
+    RETURN;  -- ya particionada
+  END IF;
+
+  DROP VIEW IF EXISTS audit_stats;
+  ALTER TABLE audit_logs RENAME TO audit_logs_legacy;
+  ALTER INDEX IF EXISTS audit_logs_pkey RENAME TO audit_logs_legacy_pkey;
+
+  -- La PK de una tabla particionada debe incluir la clave de partición
+  CREATE TABLE audit_logs (
+    id BIGINT NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    user_email VARCHAR(255),
+    user_rol VARCHAR(20),
+    accion VARCHAR(100) NOT NULL,
+    modulo VARCHAR(50) NOT NULL,
+    entidad_tipo VARCHAR(50),
+    entidad_id INTEGER,
+    detalles TEXT,
+    metadata JSONB,
+    ip_address VARCHAR(45),
+    user_agent TEXT,
+    metodo_http VARCHAR(10),
+    ruta VARCHAR(255),
+    estado_http INTEGER,
+    duracion_ms INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+  ) PARTITION BY RANGE (created_at);
+  ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+  CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+  SELECT COALESCE(MIN(created_at AT TIME ZONE 'UTC')::date, CURRENT_DATE) INTO desde FROM audit_logs_legacy;
+  meses := (EXTRACT(YEAR FROM age(date_trunc('month', CURRENT_DATE), date_trunc('month', desde))) * 12
+            + EXTRACT(MONTH FROM age(date_trunc('month', CURRENT_DATE), date_trunc('month', desde))))::int;
+  PERFORM audit_logs_crear_particiones(desde, meses + 3);
+
+  INSERT INTO audit_logs (id, user_id, user_email, user_rol, accion, modulo, entidad_tipo, entidad_id,
+                          detalles, metadata, ip_address, user_agent, metodo_http, ruta, estado_http,
+                          duracion_ms, created_at)
+  SELECT id, user_id, user_email, user_rol, accion, modulo, entidad_tipo, entidad_id,
+         detalles, metadata, ip_address, user_agent, metodo_http, ruta, estado_http,
+         duracion_ms, COALESCE(created_at, CURRENT_TIMESTAMP)
+  FROM audit_logs_legacy;
+  DROP TABLE audit_logs_legacy;
+
+  CREATE VIEW audit_stats AS
+  SELECT
+    DATE(created_at) AS fecha,
+    modulo,
+    accion,
+    COUNT(*) AS total_acciones,
+    COUNT(DISTINCT user_id) AS usuarios_unicos,
+    AVG(duracion_ms) AS duracion_promedio_ms
+  FROM audit_logs
+  WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '30 days'
+  GROUP BY DATE(created_at), modulo, accion
+  ORDER BY fecha DESC, total_acciones DESC;
+END $$;
+
+-- Índices en la tabla padre: se crean en cada partición (también en las futuras)
+CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON audit_logs (user_id);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_accion ON audit_logs (accion);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_modulo ON audit_logs (modulo);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_created_at ON audit_logs (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_metadata ON audit_logs USING GIN (metadata);
+-- Historial de cargas (uploads-history) y métricas wide por docente (dashboard docente)
+CREATE INDEX IF NOT EXISTS idx_audit_logs_uploads
+    ON audit_logs (created_at DESC) WHERE accion = 'upload' AND modulo = 'evidencias';
+CREATE INDEX IF NOT EXISTS idx_audit_logs_uploads_user
+    ON audit_logs (user_id, entidad_id) WHERE accion = 'upload' AND modulo = 'evidencias';
+
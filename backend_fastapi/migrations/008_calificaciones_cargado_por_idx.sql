@@ -0,0 +1,6 @@
+-- Dashboard docente (app/services/docente_stats.py): todos los KPIs de calificaciones
+-- filtran por cargado_por. INCLUDE (nota, estado) permite contarlos y promediar
+-- con un index-only scan, sin visitar la tabla.
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/008_calificaciones_cargado_por_idx.sql
+CREATE INDEX IF NOT EXISTS idx_calificaciones_cargado_por
+    ON calificaciones (cargado_por) INCLUDE (nota, estado);
@@ -0,0 +1,42 @@
+-- Rollup diario de evidencias_detalle para /analytics/tendencia-aprobacion.
+-- Una fila por (día de creación UTC, ficha, materia, definición) con conteos por letra;
+-- la serie de cualquier ventana y granularidad (day/week/month) sale de aquí con
+-- generate_series en lugar de agrupar evidencias_detalle en cada request.
+-- Lo mantienen las escrituras de evidencias_detalle (app/services/aprobacion_diaria.py);
+-- reconstrucción completa: python backend_fastapi/scripts/refresh_aprobacion_diaria.py
+-- Requiere migrations/004 (evidencia_definicion_id: filtro de definiciones activas al leer).
+-- Aplicar con: python backend_fastapi/scripts/run_sql_migration.py backend_fastapi/migrations/009_evidencias_detalle_diario.sql
+CREATE TABLE IF NOT EXISTS evidencias_detalle_diario (
+    dia                      DATE NOT NULL,
+    ficha_id                 INTEGER,
+    materia_id               INTEGER,
+    evidencia_definicion_id  INTEGER,
+    total                    INTEGER NOT NULL DEFAULT 0,
+    aprobadas                INTEGER NOT NULL DEFAULT 0,  -- letra = 'A'
+    reprobadas               INTEGER NOT NULL DEFAULT 0,  -- letra IN ('F', 'D')
+    no_entrego               INTEGER NOT NULL DEFAULT 0,  -- letra = '-'
+    pendientes               INTEGER NOT NULL DEFAULT 0,  -- letra IS NULL
+    actualizado_en           TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_evidencias_detalle_diario
+    ON evidencias_detalle_diario (dia, COALESCE(ficha_id, 0), COALESCE(materia_id, 0), COALESCE(evidencia_definicion_id, 0));
+-- Recálculo incremental por (materia, ficha)
+CREATE INDEX IF NOT EXISTS idx_evidencias_detalle_diario_materia
+    ON evidencias_detalle_diario (materia_id, ficha_id);
+
+-- Carga inicial
+DELETE FROM evidencias_detalle_diario;
+INSERT INTO evidencias_detalle_diario
+    (dia, ficha_id, materia_id, evidencia_definicion_id, total, aprobadas, reprobadas, no_entrego, pendientes)
+SELECT (e.created_at AT TIME ZONE 'UTC')::date,
+       e.ficha_id,
+       e.materia_id,
+       e.evidencia_definicion_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE e.letra = 'A'),
+       COUNT(*) FILTER (WHERE e.letra IN ('F', 'D')),
+       COUNT(*) FILTER (WHERE e.letra = '-'),
+       COUNT(*) FILTER (WHERE e.letra IS NULL)
+FROM evidencias_detalle e
+GROUP BY 1, 2, 3, 4;
@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+import argparse
+from dotenv import load_dotenv
+
+# Ensure backend_fastapi is on sys.path
+THIS_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = THIS_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+ENV_PATH = BACKEND_ROOT / ".env"
+if ENV_PATH.exists():
+    load_dotenv(dotenv_path=str(ENV_PATH))
+else:
+    print(f"[warn] .env not found at {ENV_PATH}. Using process environment only.")
+
+from app.db import get_conn  # type: ignore
+from app.services.audit_particiones import (  # type: ignore
+    archivar, corte_retencion, crear_particiones, desvincular, particionado, vencidas,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Particiones mensuales de audit_logs: crea las próximas y retira las vencidas. Apto para cron (mensual)."
+    )
+    parser.add_argument("--meses", type=int, default=12,
+                        help="Meses completos a conservar además del actual (default 12)")
+    parser.add_argument("--adelante", type=int, default=3,
+                        help="Particiones futuras a asegurar (default 3)")
+    parser.add_argument("--archivo", type=Path, default=None,
+                        help="Directorio donde exportar cada partición vencida como CSV .gz antes de retirarla")
+    parser.add_argument("--eliminar", action="store_true",
+                        help="DROP de las particiones retiradas (por defecto solo DETACH: quedan como tablas sueltas)")
+    parser.add_argument("--dry-run", action="store_true", help="Solo listar lo que se haría")
+    args = parser.parse_args()
+
+    try:
+        with get_conn() as conn, conn.cursor() as cur:
+            if not particionado(cur):
+                print("[error] audit_logs no está particionada: aplicar migrations/007_audit_logs_particionado.sql")
+                sys.exit(2)
+            if not args.dry_run:
+                creadas = crear_particiones(cur, args.adelante)
+                conn.commit()
+                print(f"Particiones creadas: {creadas}")
+            objetivo = vencidas(cur, args.meses)
+            print(f"Corte de retención: {corte_retencion(args.meses)} ({len(objetivo)} particiones vencidas)")
+            for p in objetivo:
+                nombre = p["nombre"]
+                if args.dry_run:
+                    print(f"  [dry-run] {nombre}: ~{p['filas_estimadas']} filas, {p['bytes']} bytes")
+                    continue
+                # Una transacción por partición: un fallo no deja a medias las demás
+                if args.archivo is not None:
+                    path = archivar(cur, nombre, args.archivo)
+                    print(f"  {nombre}: archivada en {path}")
+                desvincular(cur, nombre, eliminar=args.eliminar)
+                conn.commit()
+                print(f"  {nombre}: {'eliminada' if args.eliminar else 'desvinculada'}")
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"[error] Database operation failed: {e}")
+        sys.exit(11)
+
+
+if __name__ == "__main__":
+    main()
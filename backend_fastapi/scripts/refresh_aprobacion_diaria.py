@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+import argparse
+from dotenv import load_dotenv
+
+# Ensure backend_fastapi is on sys.path
+THIS_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = THIS_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+ENV_PATH = BACKEND_ROOT / ".env"
+if ENV_PATH.exists():
+    load_dotenv(dotenv_path=str(ENV_PATH))
+else:
+    print(f"[warn] .env not found at {ENV_PATH}. Using process environment only.")
+
+from app.db import get_conn  # type: ignore
+from app.services.aprobacion_diaria import disponible, refresh_all, refresh_materias  # type: ignore
+from psycopg.rows import dict_row  # type: ignore
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reconstruye evidencias_detalle_diario (completo o por materias). Apto para cron."
+    )
+    parser.add_argument("--materia", type=int, action="append", default=[],
+                        help="Recalcular solo esta materia (repetible)")
+    args = parser.parse_args()
+
+    try:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            if not disponible(cur):
+                print("[error] Falta la tabla evidencias_detalle_diario: aplicar migrations/009_evidencias_detalle_diario.sql")
+                sys.exit(2)
+            n = refresh_materias(cur, args.materia) if args.materia else refresh_all(cur)
+            conn.commit()
+            print(f"Rollup actualizado: {n} filas")
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"[error] Database operation failed: {e}")
+        sys.exit(11)
+
+
+if __name__ == "__main__":
+    main()
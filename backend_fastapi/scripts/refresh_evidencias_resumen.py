@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+import argparse
+from dotenv import load_dotenv
+
+# Ensure backend_fastapi is on sys.path
+THIS_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = THIS_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+ENV_PATH = BACKEND_ROOT / ".env"
+if ENV_PATH.exists():
+    load_dotenv(dotenv_path=str(ENV_PATH))
+else:
+    print(f"[warn] .env not found at {ENV_PATH}. Using process environment only.")
+
+from app.db import get_conn  # type: ignore
+from app.services.evidencias_resumen import refresh_all, refresh_fichas, resumen_disponible  # type: ignore
+from psycopg.rows import dict_row  # type: ignore
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reconstruye evidencias_resumen_diario (completo o por fichas). Apto para cron."
+    )
+    parser.add_argument("--ficha", type=int, action="append", default=[],
+                        help="Recalcular solo esta ficha (repetible; 0 = estudiantes sin ficha)")
+    args = parser.parse_args()
+
+    try:
+        with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
+            if not resumen_disponible(cur):
+                print("[error] Falta la tabla evidencias_resumen_diario: aplicar migrations/002_evidencias_resumen_diario.sql")
+                sys.exit(2)
+            n = refresh_fichas(cur, args.ficha) if args.ficha else refresh_all(cur)
+            conn.commit()
+            print(f"Resumen actualizado: {n} filas")
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"[error] Database operation failed: {e}")
+        sys.exit(11)
+
+
+if __name__ == "__main__":
+    main()